@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from node import Node, Network, DelayModel, CLI_NODE_ID
+from signature_verifier import SignatureVerifier
+
+#处理时需要工作量证明、批量签名验证或读写UTXO快照的消息，放到线程池中执行，不阻塞事件循环
+BLOCKING_MESSAGES = {"block", "cmpctblock", "blocktxn", "create_block", "getsnapshot", "snapshotchunk"}
+
+class AsyncNetwork(Network):
+    """在asyncio事件循环中路由消息的网络，节点收件箱为asyncio.Queue，延迟消息由事件循环定时投递"""
+    def __init__(self, delay_model: DelayModel=None):
+        super().__init__(delay_model=delay_model)
+        self.loop: asyncio.AbstractEventLoop = None
+
+    def register_node(self, node):
+        """注册节点"""
+        with self.lock:
+            self.messages[node.node_id] = asyncio.Queue()
+            self.mp[node.dir] = node.node_id
+
+    def deliver(self, sender_id: int, to_node_id: int, message_type: str, data):
+        """投递消息，可以从任意线程调用"""
+        message = (sender_id, message_type, data)
+        if to_node_id == CLI_NODE_ID:
+            self.messages[CLI_NODE_ID].put(message)
+            return
+        self.loop.call_soon_threadsafe(self.schedule, to_node_id, message, self.link_delay(sender_id, to_node_id))
+
+    def schedule(self, to_node_id: int, message: tuple, delay: float):
+        """在事件循环中把消息放入收件箱，有延迟时定时放入"""
+        inbox = self.messages[to_node_id]
+        if delay <= 0:
+            inbox.put_nowait(message)
+        else:
+            self.loop.call_later(delay, inbox.put_nowait, message)
+
+class AsyncNode(Node):
+    """以协程方式运行的节点，不单独占用线程"""
+    async def run_async(self, executor: ThreadPoolExecutor):
+        self.broadcast_version()
+        inbox: asyncio.Queue = self.network.messages[self.node_id]
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                #等待消息到达或到达下一个定时任务的时间
+                sender_id, message_type, data = await asyncio.wait_for(inbox.get(), timeout=self.get_timeout())
+            except asyncio.TimeoutError:
+                self.run_timers()
+                continue
+            if message_type in BLOCKING_MESSAGES:
+                #处理期间该节点的协程等待结果，节点状态不会被并发修改
+                await loop.run_in_executor(executor, self.handle_message, sender_id, message_type, data)
+            else:
+                self.handle_message(sender_id, message_type, data)
+            self.run_timers()
+
+class AsyncRuntime:
+    """在一个进程中运行大量节点：每个节点是一个协程，工作量证明等耗时操作交给线程池，签名验证共用一个进程池"""
+    def __init__(self, network: AsyncNetwork, verify_workers: int=None, executor_workers: int=None):
+        self.network = network
+        self.verifier = SignatureVerifier(workers=verify_workers)
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers)
+        self.nodes: List[AsyncNode] = []
+        self.started = threading.Event()
+
+    def create_node(self, node_id: int, dir: str) -> AsyncNode:
+        """创建并注册一个节点，事件循环已经运行时立即启动它"""
+        node = AsyncNode(node_id=node_id, network=self.network, dir=dir, verifier=self.verifier)
+        self.network.register_node(node)
+        self.nodes.append(node)
+        if self.network.loop != None:
+            asyncio.run_coroutine_threadsafe(node.run_async(executor=self.executor), self.network.loop)
+        return node
+
+    async def run(self):
+        """运行所有节点"""
+        self.network.loop = asyncio.get_running_loop()
+        tasks = [asyncio.create_task(node.run_async(executor=self.executor)) for node in self.nodes]
+        self.started.set()
+        await asyncio.gather(*tasks)
+
+    def start(self):
+        """在后台线程中启动事件循环，返回时所有已创建的节点都已开始运行"""
+        threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True).start()
+        self.started.wait()
+
+    def shutdown(self):
+        """关闭线程池和签名验证进程池"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.verifier.shutdown()
@@ -1,53 +1,230 @@
-from collections import deque
-from Cryptodome.Hash import SHA256, RIPEMD160
-from ecdsa import SigningKey, SECP256k1, VerifyingKey
-
-def get_script_sig(sig: str, pubkey: str) -> str:
-    '''返回P2PKH模式下的解锁脚本'''
-    script_sig = sig + " " + pubkey
-    return script_sig
-
-def get_script_pubkey(pubk_hash: str) -> str:
-    '''返回P2PKH模式下的锁定脚本'''
-    script_pubkey = 'OP_DUP OP_HASH160 ' + pubk_hash + ' OP_EQUALVERIFY OP_CHECKSIG'
-    return script_pubkey
-
-def execute_script(script_sig: str, script_pubkey: str, tx_hash: str) -> bool:
-    '''执行脚本'''
-    script = script_pubkey.split(' ')
-    stack = deque(script_sig.split(' '))
-    for cmd in script:
-        match cmd:
-            case 'OP_DUP':
-                if len(stack) > 0 :
-                    top = stack[-1]
-                    stack.append(top)
-                else:
-                    return False
-            case 'OP_HASH160':
-                if len(stack) > 0:
-                    top = str(stack.pop())
-                    top_sha256 = SHA256.new(bytes.fromhex(top)).hexdigest()
-                    top_hash = RIPEMD160.new(bytes.fromhex(top_sha256)).hexdigest()
-                    stack.append(top_hash)
-                else:
-                    return False
-            case 'OP_EQUALVERIFY':
-                if len(stack) > 1:
-                    pubkey_hash1 = str(stack.pop())
-                    pubkey_hash2 = str(stack.pop())
-                    if pubkey_hash1 != pubkey_hash2:
-                        return False
-                else: 
-                    return False
-            case 'OP_CHECKSIG':
-                if len(stack) > 1:
-                    pk = VerifyingKey.from_string(bytes.fromhex(str(stack.pop())), curve=SECP256k1)
-                    sig = stack.pop()
-                    is_vaild = pk.verify(bytes.fromhex(sig), bytes.fromhex(tx_hash))
-                    if not is_vaild:
-                        return False
-            case _ :
-                stack.append(cmd)
-    return True
+import struct
+import threading
+from functools import lru_cache
+from collections import deque, OrderedDict
+from hashlib import sha256
+from Cryptodome.Hash import SHA256, RIPEMD160
+from ecdsa import SigningKey, SECP256k1, VerifyingKey, BadSignatureError, MalformedPointError
+
+#脚本二进制编码中使用的操作码
+OPCODES = {
+    'OP_DUP': 0x76,
+    'OP_HASH160': 0xa9,
+    'OP_EQUALVERIFY': 0x88,
+    'OP_CHECKSIG': 0xac,
+}
+OPCODE_NAMES = {code: name for name, code in OPCODES.items()}
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+
+SIG_CACHE_SIZE = 100000 #签名缓存的最大条目数
+PUBKEY_CACHE_SIZE = 4096    #已解析公钥缓存的最大条目数
+SCRIPT_CACHE_SIZE = 4096    #已编译锁定脚本缓存的最大条目数
+
+def get_script_sig(sig: str, pubkey: str) -> str:
+    '''返回P2PKH模式下的解锁脚本'''
+    script_sig = sig + " " + pubkey
+    return script_sig
+
+def get_script_pubkey(pubk_hash: str) -> str:
+    '''返回P2PKH模式下的锁定脚本'''
+    script_pubkey = 'OP_DUP OP_HASH160 ' + pubk_hash + ' OP_EQUALVERIFY OP_CHECKSIG'
+    return script_pubkey
+
+def encode_script(script: str) -> bytes:
+    '''将文本形式的脚本编码为二进制，操作码占一个字节，数据以长度前缀压入，None编码为空脚本'''
+    if script == None:
+        return b''
+    parts = []
+    for cmd in script.split(' '):
+        code = OPCODES.get(cmd)
+        if code != None:
+            parts.append(bytes((code,)))
+            continue
+        push = bytes.fromhex(cmd)
+        if len(push) < OP_PUSHDATA1:
+            parts.append(bytes((len(push),)))
+        elif len(push) <= 0xff:
+            parts.append(bytes((OP_PUSHDATA1, len(push))))
+        else:
+            parts.append(bytes((OP_PUSHDATA2,)) + struct.pack('<H', len(push)))
+        parts.append(push)
+    return b''.join(parts)
+
+def decode_script(data: bytes) -> str:
+    '''将二进制脚本解码为文本形式，空脚本解码为None'''
+    if len(data) == 0:
+        return None
+    cmds = []
+    i = 0
+    while i < len(data):
+        code = data[i]
+        i += 1
+        name = OPCODE_NAMES.get(code)
+        if name != None:
+            cmds.append(name)
+            continue
+        if code < OP_PUSHDATA1:
+            size = code
+        elif code == OP_PUSHDATA1:
+            size = data[i]
+            i += 1
+        elif code == OP_PUSHDATA2:
+            size = int.from_bytes(data[i:i + 2], 'little')
+            i += 2
+        else:
+            raise ValueError(f"未知的操作码: {code:#x}")
+        if i + size > len(data):
+            raise ValueError("数据长度不足")
+        cmds.append(data[i:i + size].hex())
+        i += size
+    return ' '.join(cmds)
+
+def compile_script(script: str) -> tuple:
+    '''将文本形式的脚本解析为紧凑形式，操作码为int，压入的数据为bytes'''
+    ops = []
+    for cmd in script.split(' '):
+        code = OPCODES.get(cmd)
+        ops.append(code if code != None else bytes.fromhex(cmd))
+    return tuple(ops)
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def match_p2pkh(script_pubkey: str) -> bytes:
+    '''锁定脚本符合P2PKH模板时返回其中的20字节公钥哈希，否则返回None'''
+    try:
+        ops = compile_script(script_pubkey)
+    except ValueError:
+        return None
+    if len(ops) == 5 and ops[0] == OPCODES['OP_DUP'] and ops[1] == OPCODES['OP_HASH160'] \
+            and type(ops[2]) == bytes and len(ops[2]) == 20 \
+            and ops[3] == OPCODES['OP_EQUALVERIFY'] and ops[4] == OPCODES['OP_CHECKSIG']:
+        return ops[2]
+    return None
+
+def is_p2pkh_script_pubkey(script_pubkey: str) -> bool:
+    '''判断锁定脚本是否为标准P2PKH模式'''
+    return match_p2pkh(script_pubkey) != None
+
+def hash160(data: bytes) -> bytes:
+    '''RIPEMD160(SHA256(data))'''
+    return RIPEMD160.new(SHA256.new(data).digest()).digest()
+
+def get_pubkhash_from_script_pubkey(script_pubkey: str) -> str:
+    '''从P2PKH模式的锁定脚本中取出公钥哈希'''
+    return script_pubkey.split(' ')[2]
+
+class SignatureCache:
+    '''验证通过的签名缓存，交易池、区块模板和区块连接共用，线程安全'''
+    def __init__(self, max_size: int=SIG_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.data: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def key(tx_hash: str, pubkey: str, sig: str) -> bytes:
+        '''缓存键，用三者的哈希代替原文以节省内存'''
+        return sha256(f'{tx_hash}:{pubkey}:{sig}'.encode()).digest()
+
+    def contains(self, tx_hash: str, pubkey: str, sig: str) -> bool:
+        '''签名是否已经验证通过'''
+        key = self.key(tx_hash, pubkey, sig)
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                return True
+            return False
+
+    def add(self, tx_hash: str, pubkey: str, sig: str):
+        '''记录一个验证通过的签名'''
+        key = self.key(tx_hash, pubkey, sig)
+        with self.lock:
+            self.data[key] = True
+            self.data.move_to_end(key)
+            if len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+sig_cache = SignatureCache()
+
+@lru_cache(maxsize=PUBKEY_CACHE_SIZE)
+def get_verifying_key(pubkey: str) -> VerifyingKey:
+    '''解析公钥，同一公钥的多个输入共用解析结果'''
+    return VerifyingKey.from_string(bytes.fromhex(pubkey), curve=SECP256k1)
+
+def verify_signature(sig: str, pubkey: str, tx_hash: str) -> bool:
+    '''验证一个ECDSA签名，不查询缓存'''
+    try:
+        pk = get_verifying_key(pubkey)
+        return pk.verify(bytes.fromhex(sig), bytes.fromhex(tx_hash))
+    except (BadSignatureError, MalformedPointError, ValueError):
+        return False
+
+def check_signature(sig: str, pubkey: str, tx_hash: str) -> bool:
+    '''验证一个ECDSA签名，已验证通过的签名直接从缓存返回'''
+    if sig_cache.contains(tx_hash=tx_hash, pubkey=pubkey, sig=sig):
+        return True
+    if not verify_signature(sig=sig, pubkey=pubkey, tx_hash=tx_hash):
+        return False
+    sig_cache.add(tx_hash=tx_hash, pubkey=pubkey, sig=sig)
+    return True
+
+def execute_script(script_sig: str, script_pubkey: str, tx_hash: str, checks: list=None) -> bool:
+    '''执行脚本，传入checks时OP_CHECKSIG不立即验证签名，而是把(tx_hash, pubkey, sig)加入checks稍后统一验证'''
+    pubk_hash = match_p2pkh(script_pubkey)
+    if pubk_hash != None:
+        sig_pubkey = script_sig.split(' ')
+        if len(sig_pubkey) == 2:
+            return execute_p2pkh(sig=sig_pubkey[0], pubkey=sig_pubkey[1], pubk_hash=pubk_hash, tx_hash=tx_hash, checks=checks)
+    return interpret_script(script_sig=script_sig, script_pubkey=script_pubkey, tx_hash=tx_hash, checks=checks)
+
+def execute_p2pkh(sig: str, pubkey: str, pubk_hash: bytes, tx_hash: str, checks: list=None) -> bool:
+    '''P2PKH快速路径：比较公钥哈希后直接验证签名'''
+    try:
+        if hash160(bytes.fromhex(pubkey)) != pubk_hash:
+            return False
+    except ValueError:
+        return False
+    if checks != None:
+        checks.append((tx_hash, pubkey, sig))
+        return True
+    return check_signature(sig=sig, pubkey=pubkey, tx_hash=tx_hash)
+
+def interpret_script(script_sig: str, script_pubkey: str, tx_hash: str, checks: list=None) -> bool:
+    '''逐条解释执行脚本，用于非P2PKH模式的脚本'''
+    script = script_pubkey.split(' ')
+    stack = deque(script_sig.split(' '))
+    for cmd in script:
+        match cmd:
+            case 'OP_DUP':
+                if len(stack) > 0 :
+                    top = stack[-1]
+                    stack.append(top)
+                else:
+                    return False
+            case 'OP_HASH160':
+                if len(stack) > 0:
+                    top = str(stack.pop())
+                    top_sha256 = SHA256.new(bytes.fromhex(top)).hexdigest()
+                    top_hash = RIPEMD160.new(bytes.fromhex(top_sha256)).hexdigest()
+                    stack.append(top_hash)
+                else:
+                    return False
+            case 'OP_EQUALVERIFY':
+                if len(stack) > 1:
+                    pubkey_hash1 = str(stack.pop())
+                    pubkey_hash2 = str(stack.pop())
+                    if pubkey_hash1 != pubkey_hash2:
+                        return False
+                else: 
+                    return False
+            case 'OP_CHECKSIG':
+                if len(stack) > 1:
+                    pubkey = str(stack.pop())
+                    sig = str(stack.pop())
+                    if checks != None:
+                        checks.append((tx_hash, pubkey, sig))
+                    elif not check_signature(sig=sig, pubkey=pubkey, tx_hash=tx_hash):
+                        return False
+            case _ :
+                stack.append(cmd)
+    return True
             
\ No newline at end of file
@@ -1,124 +1,257 @@
-import pickle
-from typing import List
-from block import create_genesis_block, Block, deserialize_block
-from transaction import verify_transaction, Transaction, comfirm_tx, deserialize_transaction
-from merkle_tree import MerkleTree
-from proof_of_work import verify_pow
-from utxo import UTXOSet
-from copy import deepcopy
-import pickledb
-
-class BlockChain:
-    """区块链"""
-    def __init__(self):
-        self.last_block_hash: str = None
-        self.height: int = -1
-        self.db: pickledb.PickleDB = None
-
-    def add_block(self, block: Block, utxo_set: UTXOSet) -> bool:
-        """向区块链中加入区块"""
-        if verify_block(block=block, utxo_set=utxo_set):
-            self.db.set(block.hash(), block.serialize().hex())
-            self.db.set('l', (block.hash(), block.get_height()))
-            self.update()
-            comfirm_tx(utxo_set=utxo_set, transactions=block.transactions)
-            return True
-        else:
-            return False
-        
-    def find_tx(self, tx_id: str) -> Transaction:
-        """在区块链中寻找一个已确认的交易"""
-        next_hash = self.last_block_hash
-        while True:
-            block = self.db.get(next_hash)
-            block = deserialize_block(bytes.fromhex(block))
-            transactions = block.transactions
-            for tx in transactions: 
-                tx = deserialize_transaction(bytes.fromhex(tx))
-                if tx.hash() == tx_id:
-                    return tx
-            if block.get_height() == 0:
-                break
-            else:
-                next_hash = block.block_header.pre_block_hash
-        return None
-    
-    def find_block_by_hash(self, block_hash: str) -> Block:
-        """在区块链中寻找一个区块"""
-        next_hash = self.last_block_hash
-        while True:
-            block = self.db.get(next_hash)
-            block = deserialize_block(bytes.fromhex(block))
-            if block.hash() == block_hash:
-                return block
-            if block.get_height() == 0:
-                break
-            else:
-                next_hash = block.block_header.pre_block_hash
-        return None
-    
-    def get_best_height(self) -> int:
-        """获得最新区块高度"""
-        return self.height
-    
-    def get_best_block_hash(self) -> str:
-        """获得最新区块的哈希值"""
-        return self.last_block_hash
-    
-    def update(self):
-        """更新区块链"""
-        self.last_block_hash, self.height = self.db.get('l') or (None, -1)
-
-    def update_all(self, new_chain: 'BlockChain'):
-        """更新整条区块链"""
-        self.db.deldb()
-        for key in new_chain.db.getall():
-            self.db.set(key, new_chain.db.get(key))
-        self.db.set('l', (new_chain.last_block_hash, new_chain.height))
-        self.update()
-    
-    def print_blocks(self) -> List[str]:
-        """打印区块链"""
-        next_hash = self.last_block_hash
-        blocks = []
-        while True:
-            block = self.db.get(next_hash)
-            block = deserialize_block(bytes.fromhex(block))
-            blocks.append(block.hash())
-            if block.get_height() == 0:
-                break
-            else:
-                next_hash = block.block_header.pre_block_hash
-        return blocks
-
-def create_block_chain(to: str, utxo_set: UTXOSet, dir: str, coinbase_str: str="Hello Bitcoin!") -> BlockChain:
-    """创建创世区块并生成一个新的区块链"""
-    block_chain = BlockChain()
-    block_chain.db = pickledb.load(dir, True)
-    genesis_block = create_genesis_block(to=to, coinbase_str=coinbase_str)
-    block_chain.db.set(genesis_block.hash(), genesis_block.serialize().hex())
-    block_chain.db.set('l', (genesis_block.hash(), 0))
-    block_chain.update()
-    comfirm_tx(utxo_set=utxo_set, transactions=genesis_block.transactions)
-    return block_chain  # 返回BlockChain实例
-
-def load_block_chain(dir: str) -> BlockChain:
-    """加载一条区块链"""
-    block_chain = BlockChain()
-    block_chain.db = pickledb.load(dir, True)
-    block_chain.update()
-    return block_chain
-
-def verify_block(block: Block, utxo_set: UTXOSet) -> bool:
-    """验证区块"""
-    is_valid = True
-    is_valid = is_valid and verify_pow(header=block.block_header)
-    transactions = block.transactions
-    merkle_root_hash = MerkleTree(transactions=deepcopy(transactions)).root_node.data
-    is_valid = is_valid and (block.block_header.merkle_root_hash == merkle_root_hash)
-    for tx in transactions:
-        tx = deserialize_transaction(bytes.fromhex(tx))
-        is_valid = is_valid and verify_transaction(tx=tx, utxo_set=utxo_set) 
-    return is_valid
-
-
+import os
+import pickle
+from io import BytesIO
+from typing import List
+from block import create_genesis_block, Block, deserialize_block
+from transaction import verify_transaction, Transaction, comfirm_tx, decode_transaction
+from merkle_tree import MerkleTree, MerkleProof, create_merkle_proof
+from block_header import BlockHeader, deserialize_block_header, HEADER_SIZE
+from proof_of_work import verify_header_pow, get_work
+from utxo import UTXOSet, CoinsView, write_coin_record, read_coin_record
+from encoding import write_varint, read_varint
+from memory_pool import MemmoryPool
+from block_store import BlockStore
+from signature_verifier import SignatureVerifier
+from journal import write_journal, compact_journal, load_journaled_db
+import pickledb
+
+class BlockChain:
+    """区块链"""
+    def __init__(self):
+        self.last_block_hash: str = None
+        self.height: int = -1
+        #区块索引：
+        #   区块哈希 -> (高度, 文件编号, 偏移量, 长度)
+        #   'h:<高度>' -> 主链上该高度的区块哈希
+        #   't:<交易ID>' -> (区块哈希, 交易在区块中的位置)，仅在开启txindex时维护
+        #   'u:<区块哈希>' -> 主链区块的撤销数据，断开区块时用来恢复UTXO集合
+        self.db: pickledb.PickleDB = None
+        self.journal: str = None
+        self.store: BlockStore = None
+        self.txindex: bool = True
+        self.verifier: SignatureVerifier = None #区块签名验证进程池，为None时在当前线程验证
+
+    def add_block(self, block: Block, utxo_set: UTXOSet, mem_pool: MemmoryPool=None) -> bool:
+        """向区块链中加入区块，传入交易池时从中移除已确认和与区块冲突的交易"""
+        #区块必须接在当前最新区块之后
+        if block.block_header.pre_block_hash != (self.last_block_hash or '0'*64) or block.get_height() != self.height + 1:
+            return False
+        if verify_block(block=block, utxo_set=utxo_set, verifier=self.verifier):
+            self.write_block(block=block, undo=create_undo(block=block, utxo_set=utxo_set))
+            self.update()
+            comfirm_tx(utxo_set=utxo_set, transactions=block.transactions)
+            utxo_set.flush()
+            if mem_pool != None:
+                mem_pool.remove_for_block(transactions=block.transactions)
+            return True
+        else:
+            return False
+
+    def write_block(self, block: Block, undo: bytes=None):
+        """将区块追加写入区块文件，并更新索引和最新区块；重组时重新连接的区块已在区块文件中，不再重复写入"""
+        block_hash = block.hash()
+        height = block.get_height()
+        changes = self.index_changes(block=block, block_hash=block_hash, height=height)
+        if not self.db.exists(block_hash):
+            file_no, offset, length = self.store.write(block.serialize())
+            changes[block_hash] = (height, file_no, offset, length)
+        if undo != None:
+            changes[undo_key(block_hash)] = undo.hex()
+        changes['l'] = (block_hash, height)
+        write_journal(db=self.db, journal=self.journal, changes=changes)
+
+    def disconnect_block(self, utxo_set: UTXOSet) -> Block:
+        """断开主链上的最新区块，移除它产生的输出并恢复它花费的输出，返回被断开的区块；
+        没有撤销数据(创世区块或UTXO快照所在的区块)时无法断开，返回None"""
+        block_hash = self.last_block_hash
+        if block_hash == None or not self.db.exists(undo_key(block_hash)):
+            return None
+        block = self.get_block(block_hash)
+        stream = BytesIO(bytes.fromhex(self.db.get(undo_key(block_hash))))
+        spent = [read_coin_record(stream) for _ in range(0, read_varint(stream))]
+        for tx in block.transactions:
+            tx = decode_transaction(tx)
+            tx_id = tx.hash()
+            for index in range(0, len(tx.outputs)):
+                utxo_set.spend_coin(tx_id=tx_id, index=index)
+        for tx_id, index, coin in spent:
+            utxo_set.add_coin(tx_id=tx_id, index=index, coin=coin)
+        utxo_set.flush()
+        changes = {key: None for key in self.index_changes(block=block, block_hash=block_hash, height=self.height)}
+        changes[undo_key(block_hash)] = None
+        changes['l'] = (block.block_header.pre_block_hash, self.height - 1)
+        write_journal(db=self.db, journal=self.journal, changes=changes)
+        self.update()
+        return block
+
+    def index_changes(self, block: Block, block_hash: str, height: int) -> dict:
+        """区块成为主链区块时需要写入的高度索引和交易索引"""
+        changes = {height_key(height): block_hash}
+        if self.txindex:
+            for position, tx_id in enumerate(block.get_tx_ids()):
+                changes[tx_key(tx_id)] = (block_hash, position)
+        return changes
+
+    def get_block(self, block_hash: str) -> Block:
+        """根据区块哈希从区块文件中读取区块，不存在时返回None"""
+        if not self.db.exists(block_hash):
+            return None
+        height, file_no, offset, length = self.db.get(block_hash)
+        return deserialize_block(self.store.read(file_no=file_no, offset=offset, length=length))
+
+    def get_block_header(self, block_hash: str) -> BlockHeader:
+        """只读取区块头，区块头位于区块数据中编码版本号之后"""
+        if not self.db.exists(block_hash):
+            return None
+        height, file_no, offset, length = self.db.get(block_hash)
+        return deserialize_block_header(self.store.read(file_no=file_no, offset=offset + 1, length=HEADER_SIZE))
+
+    def get_block_hash(self, height: int) -> str:
+        """获得主链上指定高度的区块哈希，不存在时返回None"""
+        key = height_key(height)
+        if not self.db.exists(key):
+            return None
+        return self.db.get(key)
+
+    def get_block_height(self, block_hash: str) -> int:
+        """获得区块的高度，区块不存在时返回-1"""
+        if not self.db.exists(block_hash):
+            return -1
+        return self.db.get(block_hash)[0]
+
+    def is_main_chain(self, block_hash: str) -> bool:
+        """区块是否在主链上"""
+        return self.get_block_hash(self.get_block_height(block_hash)) == block_hash
+
+    def get_work_since(self, height: int) -> int:
+        """主链上指定高度之后所有区块的总工作量"""
+        return sum(get_work(header=self.get_block_header(self.get_block_hash(h))) for h in range(height + 1, self.height + 1))
+        
+    def find_tx(self, tx_id: str) -> Transaction:
+        """在区块链中寻找一个已确认的交易"""
+        if self.txindex:
+            key = tx_key(tx_id)
+            if not self.db.exists(key):
+                return None
+            block_hash, position = self.db.get(key)
+            block = self.get_block(block_hash)
+            return decode_transaction(block.transactions[position])
+        #未开启交易索引时沿主链逐个区块查找
+        for height in range(self.height, -1, -1):
+            block = self.get_block(self.get_block_hash(height))
+            for tx in block.transactions:
+                tx = decode_transaction(tx)
+                if tx.hash() == tx_id:
+                    return tx
+        return None
+    
+    def get_tx_proof(self, tx_id: str) -> MerkleProof:
+        """生成已确认交易的Merkle包含证明，交易不存在时返回None"""
+        if self.txindex:
+            key = tx_key(tx_id)
+            if not self.db.exists(key):
+                return None
+            block_hash, position = self.db.get(key)
+            block = self.get_block(block_hash)
+            return create_merkle_proof(transactions=block.transactions, index=position, block_hash=block_hash)
+        for height in range(self.height, -1, -1):
+            block_hash = self.get_block_hash(height)
+            block = self.get_block(block_hash)
+            for position, tx in enumerate(block.transactions):
+                if decode_transaction(tx).hash() == tx_id:
+                    return create_merkle_proof(transactions=block.transactions, index=position, block_hash=block_hash)
+        return None
+
+    def find_block_by_hash(self, block_hash: str) -> Block:
+        """在区块链中寻找一个区块"""
+        return self.get_block(block_hash)
+    
+    def get_best_height(self) -> int:
+        """获得最新区块高度"""
+        return self.height
+    
+    def get_best_block_hash(self) -> str:
+        """获得最新区块的哈希值"""
+        return self.last_block_hash
+    
+    def update(self):
+        """更新区块链"""
+        self.last_block_hash, self.height = self.db.get('l') or (None, -1)
+
+    def print_blocks(self) -> List[str]:
+        """打印区块链"""
+        #从UTXO快照开始的区块链没有快照之前的区块
+        return [block_hash for block_hash in (self.get_block_hash(height) for height in range(self.height, -1, -1)) if block_hash != None]
+
+def create_block_chain(to: str, utxo_set: UTXOSet, dir: str, coinbase_str: str="Hello Bitcoin!", txindex: bool=True) -> BlockChain:
+    """创建创世区块并生成一个新的区块链"""
+    block_chain = open_block_chain(dir=dir, txindex=txindex)
+    genesis_block = create_genesis_block(to=to, coinbase_str=coinbase_str)
+    block_chain.write_block(block=genesis_block)
+    #立即写出索引文件，节点以该文件是否存在判断区块链是否已创建
+    compact_journal(db=block_chain.db, journal=block_chain.journal)
+    block_chain.update()
+    comfirm_tx(utxo_set=utxo_set, transactions=genesis_block.transactions)
+    utxo_set.flush()
+    return block_chain  # 返回BlockChain实例
+
+def load_block_chain(dir: str, txindex: bool=True) -> BlockChain:
+    """加载一条区块链"""
+    block_chain = open_block_chain(dir=dir, txindex=txindex)
+    block_chain.update()
+    return block_chain
+
+def open_block_chain(dir: str, txindex: bool=True) -> BlockChain:
+    """打开区块索引和区块文件，区块文件存放在索引文件同级的blocks目录下"""
+    block_chain = BlockChain()
+    block_chain.txindex = txindex
+    block_chain.db = load_journaled_db(dir=dir)
+    block_chain.journal = dir + '.log'
+    block_chain.store = BlockStore(dir=os.path.join(os.path.dirname(dir), 'blocks'))
+    return block_chain
+
+def height_key(height: int) -> str:
+    """高度索引的键"""
+    return f'h:{height}'
+
+def tx_key(tx_id: str) -> str:
+    """交易索引的键"""
+    return f't:{tx_id}'
+
+def undo_key(block_hash: str) -> str:
+    """撤销数据的键"""
+    return f'u:{block_hash}'
+
+def create_undo(block: Block, utxo_set: UTXOSet) -> bytes:
+    """区块的撤销数据：区块花费的、在区块之前已存在的输出，须在区块的交易确认之前生成"""
+    records = []
+    for tx in block.transactions[1:]:
+        for tx_in in decode_transaction(tx).inputs:
+            coin = utxo_set.get_coin(tx_id=tx_in.tx_id, index=tx_in.index)
+            #花费块内前面交易产生的输出，断开时随那笔交易的输出一起移除
+            if coin != None:
+                records.append(write_coin_record(tx_id=tx_in.tx_id, index=tx_in.index, coin_data=coin.serialize()))
+    return write_varint(len(records)) + b''.join(records)
+
+def verify_block_header(block: Block) -> bool:
+    """验证区块头的工作量证明，以及默克尔根与区块中的交易是否一致"""
+    if not verify_header_pow(header=block.block_header):
+        return False
+    return block.block_header.merkle_root_hash == MerkleTree(transactions=block.transactions).root_hash
+
+def verify_block(block: Block, utxo_set: UTXOSet, verifier: SignatureVerifier=None) -> bool:
+    """验证区块，传入verifier时区块中所有签名被收集起来交给进程池并行验证"""
+    is_valid = verify_block_header(block=block) and len(block.transactions) > 0
+    transactions = block.transactions
+    checks = [] if verifier != None else None
+    #区块中的交易可以花费同一区块中前面交易的输出
+    view = CoinsView(utxo_set=utxo_set)
+    for position, tx in enumerate(transactions):
+        tx = decode_transaction(tx)
+        #有且只有第一笔交易是coinbase交易
+        is_valid = is_valid and tx.is_coinbase() == (position == 0)
+        is_valid = is_valid and verify_transaction(tx=tx, utxo_set=view, checks=checks) 
+        view.add_transaction(tx)
+    if verifier != None:
+        is_valid = is_valid and verifier.verify(checks)
+    return is_valid
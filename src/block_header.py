@@ -1,37 +1,69 @@
-from hashlib import sha256
-import json
-import pickle
-
-class BlockHeader:
-    """区块头"""
-    def __init__(self, version: int, pre_block_hash: str, merkle_root_hash: str, timestamp: float, target_bits: int, nonce: int):
-        self.version = version
-        self.pre_block_hash = pre_block_hash
-        self.merkle_root_hash = merkle_root_hash
-        self.timestamp = timestamp
-        self.target_bits = target_bits
-        self.nonce = nonce
-
-    def to_dict(self) -> dict:
-        """转换为字典格式"""
-        return {
-            "version": self.version,
-            "pre_block_hash": self.pre_block_hash,
-            "merkle_root_hash": self.merkle_root_hash,
-            "timestamp": self.timestamp,
-            "target_bits": self.target_bits,
-            "nonce": self.nonce
-        }
-    
-    def to_json(self) -> str:
-        """转换为 JSON 字符串"""
-        return json.dumps(self.to_dict(), indent=4)
-    
-    def serialize(self) -> bytes:
-         """序列化"""
-         return pickle.dumps(self.to_dict())
-    
-    def hash(self) -> str:
-        """计算区块头哈希"""
-        tx_hash = sha256(self.serialize()).hexdigest()
-        return sha256(bytes.fromhex(tx_hash)).hexdigest()
\ No newline at end of file
+from hashlib import sha256
+import json
+import struct
+from io import BytesIO
+from encoding import read_exact
+
+#区块头固定布局(小端序)：版本号、前一区块哈希、默克尔根哈希、时间戳、难度、nonce
+HEADER_FORMAT = '<I32s32sdIQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+#nonce位于区块头末尾，之前的部分在挖矿过程中保持不变
+NONCE_FORMAT = '<Q'
+PREFIX_SIZE = HEADER_SIZE - struct.calcsize(NONCE_FORMAT)
+
+class BlockHeader:
+    """区块头"""
+    def __init__(self, version: int, pre_block_hash: str, merkle_root_hash: str, timestamp: float, target_bits: int, nonce: int):
+        self.version = version
+        self.pre_block_hash = pre_block_hash
+        self.merkle_root_hash = merkle_root_hash
+        self.timestamp = timestamp
+        self.target_bits = target_bits
+        self.nonce = nonce
+
+    def to_dict(self) -> dict:
+        """转换为字典格式"""
+        return {
+            "version": self.version,
+            "pre_block_hash": self.pre_block_hash,
+            "merkle_root_hash": self.merkle_root_hash,
+            "timestamp": self.timestamp,
+            "target_bits": self.target_bits,
+            "nonce": self.nonce
+        }
+    
+    def to_json(self) -> str:
+        """转换为 JSON 字符串"""
+        return json.dumps(self.to_dict(), indent=4)
+    
+    def serialize(self) -> bytes:
+        """序列化为固定长度的二进制区块头"""
+        return struct.pack(HEADER_FORMAT,
+                           self.version,
+                           bytes.fromhex(self.pre_block_hash),
+                           bytes.fromhex(self.merkle_root_hash),
+                           self.timestamp,
+                           self.target_bits,
+                           self.nonce)
+    
+    def serialize_prefix(self) -> bytes:
+        """序列化区块头中除nonce之外的部分"""
+        return self.serialize()[:PREFIX_SIZE]
+    
+    def hash(self) -> str:
+        """计算区块头哈希"""
+        return sha256(sha256(self.serialize()).digest()).hexdigest()
+
+def deserialize_block_header(data: bytes) -> BlockHeader:
+    """区块头反序列化"""
+    return read_block_header(BytesIO(data))
+
+def read_block_header(stream: BytesIO) -> BlockHeader:
+    """从流中解码区块头"""
+    version, pre_block_hash, merkle_root_hash, timestamp, target_bits, nonce = struct.unpack(HEADER_FORMAT, read_exact(stream, HEADER_SIZE))
+    return BlockHeader(version=version,
+                       pre_block_hash=pre_block_hash.hex(),
+                       merkle_root_hash=merkle_root_hash.hex(),
+                       timestamp=timestamp,
+                       target_bits=target_bits,
+                       nonce=nonce)
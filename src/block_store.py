@@ -0,0 +1,54 @@
+import mmap
+import os
+import re
+import threading
+
+MAX_BLOCK_FILE_SIZE = 16 * 1024 * 1024  #单个区块文件的最大大小(字节)
+
+class BlockStore:
+    """只追加写入的区块文件存储，区块依次写入blk*.dat文件，通过内存映射读取"""
+    def __init__(self, dir: str):
+        self.dir = dir
+        self.lock = threading.Lock()
+        self.maps = {}  #文件编号 -> mmap
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        file_nos = [int(m.group(1)) for m in (re.fullmatch(r'blk(\d{5})\.dat', name) for name in os.listdir(dir)) if m]
+        self.file_no = max(file_nos) if file_nos else 0
+
+    def file_path(self, file_no: int) -> str:
+        """区块文件路径"""
+        return os.path.join(self.dir, f'blk{file_no:05d}.dat')
+
+    def write(self, data: bytes) -> tuple:
+        """追加写入一个区块，返回(文件编号, 偏移量, 长度)"""
+        with self.lock:
+            path = self.file_path(self.file_no)
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset > 0 and offset + len(data) > MAX_BLOCK_FILE_SIZE:
+                self.file_no += 1
+                path = self.file_path(self.file_no)
+                offset = 0
+            with open(path, 'ab') as fp:
+                fp.write(data)
+            return (self.file_no, offset, len(data))
+
+    def read(self, file_no: int, offset: int, length: int) -> bytes:
+        """根据位置读取一个区块"""
+        with self.lock:
+            m = self.maps.get(file_no)
+            if m == None or offset + length > len(m):
+                #文件在映射之后又追加了数据，需要重新映射
+                if m != None:
+                    m.close()
+                with open(self.file_path(file_no), 'rb') as fp:
+                    m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[file_no] = m
+            return m[offset:offset + length]
+
+    def close(self):
+        """关闭所有内存映射"""
+        with self.lock:
+            for m in self.maps.values():
+                m.close()
+            self.maps = {}
@@ -0,0 +1,277 @@
+import time
+from collections import deque
+from io import BytesIO
+from typing import Dict, List
+from block import Block
+from block_chain import BlockChain
+from block_header import BlockHeader, read_block_header, HEADER_SIZE
+from proof_of_work import verify_header_pow, get_work
+
+GENESIS_PRE_HASH = '0' * 64     #创世区块的前一区块哈希
+MAX_HEADERS = 2000              #一条headers消息最多携带的区块头数量
+BLOCKS_PER_REQUEST = 16         #一条getdata消息请求的区块数量
+BLOCK_DOWNLOAD_WINDOW = 128     #正在下载和已下载待连接的区块数量上限
+BLOCK_REQUEST_TIMEOUT = 5       #请求的区块超过这个时间(秒)未到达时，改向其他节点请求
+
+def create_locator(block_chain: BlockChain) -> List[str]:
+    """区块定位器：从最新区块往回，前10个逐个取，之后步长加倍，最后是创世区块"""
+    locator = []
+    height = block_chain.get_best_height()
+    step = 1
+    while height > 0:
+        locator.append(block_chain.get_block_hash(height))
+        if len(locator) >= 10:
+            step *= 2
+        height -= step
+    if block_chain.get_best_height() >= 0:
+        locator.append(block_chain.get_block_hash(0))
+    #从UTXO快照开始的区块链没有快照之前的区块
+    return [block_hash for block_hash in locator if block_hash != None]
+
+def encode_hashes(hashes: List[str]) -> bytes:
+    """哈希列表编码为连续的32字节"""
+    return b''.join(bytes.fromhex(h) for h in hashes)
+
+def decode_hashes(data: bytes) -> List[str]:
+    """解码连续的32字节哈希"""
+    return [data[i:i + 32].hex() for i in range(0, len(data), 32)]
+
+def chain_work(headers: List[BlockHeader]) -> int:
+    """一串区块头的总工作量"""
+    return sum(get_work(header=header) for header in headers)
+
+def decode_headers(data: bytes) -> List[BlockHeader]:
+    """解码连续的定长区块头"""
+    stream = BytesIO(data)
+    return [read_block_header(stream) for _ in range(0, len(data) // HEADER_SIZE)]
+
+class BlockSync:
+    """区块头优先同步：先用区块定位器取得分叉点之后的区块头，再从多个节点并行下载区块，按顺序连接"""
+    def __init__(self, node_id: int, block_chain: BlockChain, send):
+        self.node_id = node_id
+        self.block_chain = block_chain
+        self.send = send    #send(to_node_id, message_type, data)
+        self.peer_heights: Dict[int, int] = {}  #节点ID -> 该节点报告的最新高度
+        self.header_peer: int = None            #正在从其获取区块头的节点
+        self.awaiting_headers = False           #是否有尚未收到回复的getheaders
+        self.last_header_hash: str = None       #已取得的最后一个区块头的哈希
+        self.queued = deque()                   #已取得区块头、尚未请求的区块哈希
+        self.in_flight: Dict[str, tuple] = {}   #已请求的区块哈希 -> (节点ID, 请求时间)
+        self.downloaded: Dict[str, Block] = {}  #已下载、等待前面区块连接的区块
+        self.wanted = deque()                   #按高度排列的待连接区块哈希
+        self.wanted_hashes = set()              #待连接区块哈希的集合，用于判断收到的区块是否需要
+        self.heights: Dict[str, int] = {}       #待连接区块哈希 -> 高度
+        self.next_peer = 0
+        #从本地主链更早位置分叉的链，在区块头的总工作量超过本地分叉点之后的区块之前只收集区块头，不下载区块
+        self.fork_hash: str = None              #分叉点区块哈希，没有在收集分叉区块头时为None
+        self.fork_headers: List[BlockHeader] = []
+        self.fork_local_work = 0                #本地主链分叉点之后的总工作量
+
+    def is_syncing(self) -> bool:
+        """是否正在同步"""
+        return self.header_peer != None
+
+    def set_peer_height(self, peer_id: int, height: int):
+        """记录对端节点的最新高度，高于本地时开始同步"""
+        self.peer_heights[peer_id] = height
+        if height > self.block_chain.get_best_height() and not self.is_syncing():
+            self.request_headers(peer_id=peer_id)
+
+    def request_headers(self, peer_id: int, locator: List[str]=None):
+        """向对端请求区块头"""
+        self.header_peer = peer_id
+        self.awaiting_headers = True
+        if locator == None:
+            locator = create_locator(block_chain=self.block_chain)
+        self.send(peer_id, "getheaders", encode_hashes(locator))
+
+    def handle_getheaders(self, peer_id: int, data: bytes):
+        """找到定位器中第一个在主链上的区块，返回其后的区块头"""
+        start = 0
+        for block_hash in decode_hashes(data):
+            if self.block_chain.is_main_chain(block_hash):
+                start = self.block_chain.get_block_height(block_hash) + 1
+                break
+        end = min(start + MAX_HEADERS, self.block_chain.get_best_height() + 1)
+        headers = []
+        for height in range(start, end):
+            block_hash = self.block_chain.get_block_hash(height)
+            if block_hash == None:
+                #从UTXO快照开始的节点没有快照之前的区块
+                break
+            headers.append(self.block_chain.get_block_header(block_hash).serialize())
+        self.send(peer_id, "headers", b''.join(headers))
+
+    def handle_headers(self, peer_id: int, data: bytes):
+        """检查区块头的连接关系和工作量证明，把新区块加入下载队列；分叉的链在工作量超过本地之后才开始下载"""
+        if peer_id != self.header_peer:
+            return
+        self.awaiting_headers = False
+        headers = decode_headers(data)
+        more = len(headers) == MAX_HEADERS  #对端可能还有更多区块头
+        #跳过本地主链上已有的区块，可能在同步期间通过广播收到了部分区块
+        while headers and self.last_header_hash == None and self.fork_hash == None and self.block_chain.is_main_chain(headers[0].hash()):
+            headers.pop(0)
+        if len(headers) == 0:
+            if self.fork_hash != None:
+                #对端没有更多区块头，分叉链的工作量不超过本地
+                self.reset()
+                return
+            self.finish_headers()
+            return
+        if self.fork_hash != None:
+            pre_hash = self.fork_headers[-1].hash()
+        else:
+            pre_hash = self.last_header_hash or self.block_chain.get_best_block_hash() or GENESIS_PRE_HASH
+            if headers[0].pre_block_hash != pre_hash:
+                fork_hash = headers[0].pre_block_hash
+                if self.last_header_hash != None or not self.block_chain.is_main_chain(fork_hash):
+                    print(f"节点 {self.node_id} 收到节点 {peer_id} 无法连接的区块头")
+                    self.reset()
+                    return
+                self.fork_hash = fork_hash
+                self.fork_local_work = self.block_chain.get_work_since(height=self.block_chain.get_block_height(fork_hash))
+                pre_hash = fork_hash
+        if not self.verify_headers(peer_id=peer_id, pre_hash=pre_hash, headers=headers):
+            return
+        if self.fork_hash != None:
+            self.fork_headers += headers
+            if chain_work(self.fork_headers) <= self.fork_local_work:
+                if more:
+                    self.request_headers(peer_id=peer_id, locator=[self.fork_headers[-1].hash()])
+                else:
+                    self.reset()
+                return
+            #分叉链的工作量已超过本地，连接其第一个区块时断开本地分叉点之后的区块
+            pre_hash = self.fork_hash
+            height = self.block_chain.get_block_height(self.fork_hash)
+            headers = self.fork_headers
+            self.fork_hash = None
+            self.fork_headers = []
+        else:
+            height = self.heights[pre_hash] if pre_hash in self.heights else self.block_chain.get_best_height()
+        for header in headers:
+            block_hash = header.hash()
+            height += 1
+            self.queued.append(block_hash)
+            self.wanted.append(block_hash)
+            self.wanted_hashes.add(block_hash)
+            self.heights[block_hash] = height
+        self.last_header_hash = headers[-1].hash()
+        self.peer_heights[peer_id] = max(self.peer_heights.get(peer_id, -1), height)
+        self.request_blocks()
+        if more:
+            self.request_headers(peer_id=peer_id, locator=[self.last_header_hash])
+
+    def verify_headers(self, peer_id: int, pre_hash: str, headers: List[BlockHeader]) -> bool:
+        """区块头必须依次相连，难度不低于要求并满足工作量证明，无效时放弃本轮同步"""
+        for header in headers:
+            if header.pre_block_hash != pre_hash or not verify_header_pow(header=header):
+                print(f"节点 {self.node_id} 收到节点 {peer_id} 的无效区块头")
+                self.reset()
+                return False
+            pre_hash = header.hash()
+        return True
+
+    def request_blocks(self):
+        """在下载窗口内把待下载的区块分批请求，轮流发给拥有这些区块的节点"""
+        while self.queued and len(self.in_flight) + len(self.downloaded) < BLOCK_DOWNLOAD_WINDOW:
+            batch = []
+            while self.queued and len(batch) < BLOCKS_PER_REQUEST:
+                block_hash = self.queued.popleft()
+                #请求之前已经通过广播收到的区块不再请求
+                if block_hash in self.wanted_hashes and block_hash not in self.downloaded and block_hash not in self.in_flight:
+                    batch.append(block_hash)
+            if batch:
+                self.send_getdata(batch=batch)
+
+    def send_getdata(self, batch: List[str], exclude: int=None):
+        """把一批按高度排列的区块请求发给拥有它们的下一个节点，尽量避开exclude"""
+        needed = self.heights[batch[-1]]
+        peers = [peer_id for peer_id, height in self.peer_heights.items() if height >= needed and peer_id != exclude] or [exclude]
+        peer_id = peers[self.next_peer % len(peers)]
+        self.next_peer += 1
+        now = time.monotonic()
+        for block_hash in batch:
+            self.in_flight[block_hash] = (peer_id, now)
+        self.send(peer_id, "getdata", encode_hashes(batch))
+
+    def get_timeout(self) -> float:
+        """距离最早的区块请求超时的时间，没有请求中的区块时为None"""
+        if not self.in_flight:
+            return None
+        return max(0, min(requested_at for peer_id, requested_at in self.in_flight.values()) + BLOCK_REQUEST_TIMEOUT - time.monotonic())
+
+    def check_timeouts(self):
+        """超时未到达的区块改向其他节点请求"""
+        now = time.monotonic()
+        expired: Dict[int, List[str]] = {}
+        for block_hash, (peer_id, requested_at) in self.in_flight.items():
+            if now - requested_at >= BLOCK_REQUEST_TIMEOUT:
+                expired.setdefault(peer_id, []).append(block_hash)
+        for peer_id, hashes in expired.items():
+            hashes.sort(key=lambda block_hash: self.heights[block_hash])
+            for start in range(0, len(hashes), BLOCKS_PER_REQUEST):
+                self.send_getdata(batch=hashes[start:start + BLOCKS_PER_REQUEST], exclude=peer_id)
+
+    def handle_getdata(self, peer_id: int, data: bytes):
+        """发送请求的区块"""
+        for block_hash in decode_hashes(data):
+            block = self.block_chain.get_block(block_hash)
+            if block != None:
+                self.send(peer_id, "block", block.serialize())
+
+    def receive_block(self, peer_id: int, block: Block) -> List[Block]:
+        """收到一个区块，返回可以按顺序连接的区块；未同步时收到无法连接的区块则向发送者请求区块头"""
+        block_hash = block.hash()
+        if block_hash in self.heights:
+            #同步中的区块，可能来自getdata的回复，也可能是其他节点的广播
+            self.peer_heights[peer_id] = max(self.peer_heights.get(peer_id, -1), self.heights[block_hash])
+            if block_hash in self.downloaded or block_hash not in self.wanted_hashes:
+                return []
+            #还在下载队列中的哈希在请求时跳过
+            self.in_flight.pop(block_hash, None)
+            self.downloaded[block_hash] = block
+            ready = []
+            while self.wanted and self.wanted[0] in self.downloaded:
+                block_hash = self.wanted.popleft()
+                self.wanted_hashes.discard(block_hash)
+                ready.append(self.downloaded.pop(block_hash))
+            return ready
+        if block.block_header.pre_block_hash == (self.block_chain.get_best_block_hash() or GENESIS_PRE_HASH):
+            return [block]
+        if not self.is_syncing() and not self.block_chain.is_main_chain(block_hash):
+            self.request_headers(peer_id=peer_id)
+        return []
+
+    def block_connected(self, block_hash: str):
+        """一个区块连接完成后继续下载"""
+        self.heights.pop(block_hash, None)
+        self.request_blocks()
+        self.finish_headers()
+
+    def finish_headers(self):
+        """本轮同步结束，若还有节点的高度更高则继续同步"""
+        if self.awaiting_headers or self.queued or self.in_flight or self.downloaded or self.wanted:
+            return
+        header_peer = self.header_peer
+        self.reset()
+        for peer_id, height in self.peer_heights.items():
+            if height > self.block_chain.get_best_height() and peer_id != header_peer:
+                self.request_headers(peer_id=peer_id)
+                return
+
+    def reset(self):
+        """结束或放弃本轮同步"""
+        self.header_peer = None
+        self.awaiting_headers = False
+        self.heights = {}
+        self.last_header_hash = None
+        self.queued.clear()
+        self.in_flight = {}
+        self.downloaded = {}
+        self.wanted.clear()
+        self.wanted_hashes = set()
+        self.fork_hash = None
+        self.fork_headers = []
+        self.fork_local_work = 0
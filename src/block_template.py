@@ -0,0 +1,144 @@
+import heapq
+import itertools
+from typing import List
+from memory_pool import MemmoryPool, MempoolEntry
+from transaction import verify_transaction
+
+MAX_BLOCK_SIZE = 1000000    #区块中除coinbase外交易的总大小上限(字节)
+
+class BlockTemplate:
+    """区块模板，按祖先交易包的费率从交易池中选取交易，交易加入交易池时增量更新"""
+    def __init__(self, mem_pool: MemmoryPool, max_size: int=MAX_BLOCK_SIZE):
+        self.mem_pool = mem_pool
+        self.max_size = max_size
+        self.lock = mem_pool.lock   #与交易池共用一把锁，交易池变化时模板同步更新
+        self.valid = set()          #已通过验证的交易ID
+        self.transactions: List[str] = []   #已选中的交易，父交易总在子交易之前
+        self.selected = set()
+        self.size = 0
+        self.fee = 0
+        self.min_fee_rate = 0       #已选中交易包的最低费率
+        self.dirty = True           #为True时下次获取模板前需要重新选取
+        mem_pool.templates.append(self)
+        for entry in list(mem_pool.entries.values()):
+            if entry.tx_id in mem_pool.entries and not self.verify_entry(entry=entry):
+                mem_pool.remove_tx(tx_id=entry.tx_id, with_descendants=True)
+
+    def verify_entry(self, entry: MempoolEntry) -> bool:
+        """验证交易，池中父交易的输出视为可花费"""
+        if entry.tx_id in self.valid:
+            return True
+        if not verify_transaction(tx=entry.tx, utxo_set=self.mem_pool):
+            return False
+        self.valid.add(entry.tx_id)
+        return True
+
+    def get_ancestors(self, tx_id: str) -> set:
+        """交易在交易池中的全部祖先交易ID"""
+        ancestors = set()
+        stack = list(self.mem_pool.entries[tx_id].parents)
+        while stack:
+            parent_id = stack.pop()
+            if parent_id in ancestors:
+                continue
+            ancestors.add(parent_id)
+            stack.extend(self.mem_pool.entries[parent_id].parents)
+        return ancestors
+
+    def get_package(self, tx_id: str) -> List[MempoolEntry]:
+        """交易及其尚未选中的祖先组成的交易包，按父交易在前的顺序排列"""
+        entries = self.mem_pool.entries
+        package = [entries[a] for a in self.get_ancestors(tx_id) if a not in self.selected]
+        package.append(entries[tx_id])
+        #祖先交易的祖先数量一定更少，按祖先数量排序即为拓扑顺序
+        package.sort(key=lambda entry: len(self.get_ancestors(entry.tx_id)))
+        return package
+
+    @staticmethod
+    def package_fee_rate(package: List[MempoolEntry]) -> float:
+        """交易包的整体费率"""
+        return sum(entry.fee for entry in package) / sum(entry.size for entry in package)
+
+    def add_package(self, package: List[MempoolEntry], fee_rate: float):
+        """将交易包加入模板"""
+        self.min_fee_rate = fee_rate if len(self.selected) == 0 else min(self.min_fee_rate, fee_rate)
+        for entry in package:
+            self.transactions.append(entry.tx_hex)
+            self.selected.add(entry.tx_id)
+            self.size += entry.size
+            self.fee += entry.fee
+
+    def add_entry(self, entry: MempoolEntry) -> bool:
+        """交易加入交易池时调用，验证失败返回False；能放下时直接追加到模板末尾"""
+        with self.lock:
+            if not self.verify_entry(entry=entry):
+                return False
+            if self.dirty:
+                return True
+            package = self.get_package(tx_id=entry.tx_id)
+            fee_rate = self.package_fee_rate(package=package)
+            if self.size + sum(e.size for e in package) <= self.max_size:
+                self.add_package(package=package, fee_rate=fee_rate)
+            elif fee_rate > self.min_fee_rate:
+                #模板已满，但新交易包的费率更高，需要重新选取
+                self.dirty = True
+            return True
+
+    def remove_entry(self, tx_id: str):
+        """交易离开交易池时调用"""
+        with self.lock:
+            self.valid.discard(tx_id)
+            if tx_id in self.selected:
+                self.dirty = True
+
+    def invalidate(self):
+        """区块断开后调用，交易花费的输出可能已不存在，已验证的记录全部作废，下次获取模板前重新选取"""
+        with self.lock:
+            self.valid = set()
+            self.dirty = True
+
+    def rebuild(self):
+        """按祖先交易包费率从高到低重新选取交易"""
+        entries = self.mem_pool.entries
+        self.transactions = []
+        self.selected = set()
+        self.size = 0
+        self.fee = 0
+        self.min_fee_rate = 0
+        counter = itertools.count()
+        heap = []
+        for tx_id in entries:
+            heap.append((-self.package_fee_rate(package=self.get_package(tx_id=tx_id)), next(counter), tx_id))
+        heapq.heapify(heap)
+        while heap and self.size < self.max_size:
+            neg_fee_rate, seq, tx_id = heapq.heappop(heap)
+            if tx_id in self.selected:
+                continue
+            package = self.get_package(tx_id=tx_id)
+            fee_rate = self.package_fee_rate(package=package)
+            if fee_rate != -neg_fee_rate:
+                #祖先已被选中，交易包费率发生了变化
+                heapq.heappush(heap, (-fee_rate, next(counter), tx_id))
+                continue
+            if self.size + sum(entry.size for entry in package) > self.max_size:
+                continue
+            self.add_package(package=package, fee_rate=fee_rate)
+            #被选中交易的后代交易包变小了，按新的费率重新排队
+            for entry in package:
+                for child_id in entry.children:
+                    if child_id not in self.selected:
+                        heapq.heappush(heap, (-self.package_fee_rate(package=self.get_package(tx_id=child_id)), next(counter), child_id))
+        self.dirty = False
+
+    def close(self):
+        """不再随交易池更新"""
+        with self.lock:
+            if self in self.mem_pool.templates:
+                self.mem_pool.templates.remove(self)
+
+    def get_transactions(self) -> tuple:
+        """获取模板中的交易与交易费总额"""
+        with self.lock:
+            if self.dirty:
+                self.rebuild()
+            return (list(self.transactions), self.fee)
@@ -0,0 +1,132 @@
+import random
+import struct
+from hashlib import sha256
+from io import BytesIO
+from typing import Dict, List
+from block import Block
+from block_header import BlockHeader, read_block_header
+from encoding import write_varint, read_varint, write_var_bytes, read_var_bytes, read_exact
+from merkle_tree import MerkleTree
+
+SHORT_ID_SIZE = 6   #短交易ID的字节数
+
+def short_id_key(header: BlockHeader, nonce: int) -> bytes:
+    """短交易ID的密钥，由区块头和随机数决定，每个区块不同，难以构造碰撞"""
+    return sha256(header.serialize() + struct.pack('<Q', nonce)).digest()[:16]
+
+def short_id(key: bytes, tx_id: str) -> bytes:
+    """交易的短ID：带密钥的交易ID哈希的前6字节"""
+    return sha256(key + bytes.fromhex(tx_id)).digest()[:SHORT_ID_SIZE]
+
+class CompactBlock:
+    """紧凑区块：区块头、随机数、除预填交易外每笔交易的短ID，以及预填的交易(至少包括coinbase)"""
+    def __init__(self, header: BlockHeader, nonce: int, short_ids: List[bytes], prefilled: List[tuple]):
+        self.header = header
+        self.nonce = nonce
+        self.short_ids = short_ids
+        self.prefilled = prefilled  #(交易在区块中的位置, 交易)，按位置排列
+
+    def hash(self) -> str:
+        return self.header.hash()
+
+    def tx_count(self) -> int:
+        return len(self.short_ids) + len(self.prefilled)
+
+    def serialize(self) -> bytes:
+        """序列化：区块头、随机数、短ID列表、预填交易列表(位置为与前一个预填位置的差值)"""
+        parts = [self.header.serialize(), struct.pack('<Q', self.nonce), write_varint(len(self.short_ids))]
+        parts += self.short_ids
+        parts.append(write_varint(len(self.prefilled)))
+        last = -1
+        for index, tx in self.prefilled:
+            parts.append(write_varint(index - last - 1) + write_var_bytes(bytes.fromhex(tx)))
+            last = index
+        return b''.join(parts)
+
+def deserialize_compact_block(data: bytes) -> CompactBlock:
+    """紧凑区块反序列化"""
+    stream = BytesIO(data)
+    header = read_block_header(stream)
+    nonce = struct.unpack('<Q', read_exact(stream, 8))[0]
+    short_ids = [read_exact(stream, SHORT_ID_SIZE) for _ in range(0, read_varint(stream))]
+    prefilled = []
+    last = -1
+    for _ in range(0, read_varint(stream)):
+        last += read_varint(stream) + 1
+        prefilled.append((last, read_var_bytes(stream).hex()))
+    return CompactBlock(header=header, nonce=nonce, short_ids=short_ids, prefilled=prefilled)
+
+def create_compact_block(block: Block) -> CompactBlock:
+    """由区块生成紧凑区块，预填coinbase交易"""
+    nonce = random.getrandbits(64)
+    key = short_id_key(header=block.block_header, nonce=nonce)
+    short_ids = [short_id(key=key, tx_id=tx_id) for tx_id in block.get_tx_ids()[1:]]
+    return CompactBlock(header=block.block_header, nonce=nonce, short_ids=short_ids, prefilled=[(0, block.transactions[0])])
+
+def encode_block_txn_request(block_hash: str, indexes: List[int]) -> bytes:
+    """getblocktxn请求：区块哈希、缺失交易的数量和位置"""
+    return bytes.fromhex(block_hash) + write_varint(len(indexes)) + b''.join(write_varint(index) for index in indexes)
+
+def decode_block_txn_request(data: bytes) -> tuple:
+    """解码getblocktxn请求，返回(区块哈希, 位置列表)"""
+    stream = BytesIO(data)
+    block_hash = read_exact(stream, 32).hex()
+    return (block_hash, [read_varint(stream) for _ in range(0, read_varint(stream))])
+
+def encode_block_txn(block_hash: str, transactions: List[str]) -> bytes:
+    """blocktxn回复：区块哈希、按请求顺序排列的交易"""
+    return bytes.fromhex(block_hash) + write_varint(len(transactions)) + b''.join(write_var_bytes(bytes.fromhex(tx)) for tx in transactions)
+
+def decode_block_txn(data: bytes) -> tuple:
+    """解码blocktxn回复，返回(区块哈希, 交易列表)"""
+    stream = BytesIO(data)
+    block_hash = read_exact(stream, 32).hex()
+    return (block_hash, [read_var_bytes(stream).hex() for _ in range(0, read_varint(stream))])
+
+class PartialBlock:
+    """正在重建的区块，交易从本地交易池中按短ID取得，缺失的交易向发送者请求"""
+    def __init__(self, compact: CompactBlock):
+        self.compact = compact
+        self.transactions: List[str] = [None] * compact.tx_count()
+
+    def init_data(self, candidates: Dict[str, str]) -> List[int]:
+        """用候选交易(交易ID -> 交易)填充区块，返回缺失交易的位置"""
+        for index, tx in self.compact.prefilled:
+            if index >= len(self.transactions):
+                raise ValueError("预填交易的位置超出区块的交易数量")
+            self.transactions[index] = tx
+        key = short_id_key(header=self.compact.header, nonce=self.compact.nonce)
+        by_short_id: Dict[bytes, str] = {}
+        collided = set()
+        for tx_id, tx in candidates.items():
+            sid = short_id(key=key, tx_id=tx_id)
+            if sid in by_short_id:
+                #短ID碰撞时无法确定是哪笔交易，改为向发送者请求
+                collided.add(sid)
+            by_short_id[sid] = tx
+        short_ids = iter(self.compact.short_ids)
+        for index in range(0, len(self.transactions)):
+            if self.transactions[index] == None:
+                sid = next(short_ids)
+                if sid not in collided:
+                    self.transactions[index] = by_short_id.get(sid)
+        return self.get_missing()
+
+    def get_missing(self) -> List[int]:
+        """缺失交易的位置"""
+        return [index for index, tx in enumerate(self.transactions) if tx == None]
+
+    def fill(self, transactions: List[str]) -> bool:
+        """按位置顺序填入收到的缺失交易，数量不符时返回False"""
+        missing = self.get_missing()
+        if len(transactions) != len(missing):
+            return False
+        for index, tx in zip(missing, transactions):
+            self.transactions[index] = tx
+        return True
+
+    def get_block(self) -> Block:
+        """重建完成的区块，默克尔根不一致(短ID碰撞或交易被替换)时返回None"""
+        if MerkleTree(transactions=self.transactions).root_hash != self.compact.header.merkle_root_hash:
+            return None
+        return Block(block_header=self.compact.header, tx_num=len(self.transactions), transactions=list(self.transactions))
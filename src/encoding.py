@@ -0,0 +1,65 @@
+import struct
+import sys
+from io import BytesIO
+
+ENCODING_VERSION = 1    #交易与区块二进制编码格式的版本号
+
+def write_varint(n: int) -> bytes:
+    """变长整数编码(与比特币CompactSize相同)"""
+    if n < 0xfd:
+        return bytes((n,))
+    elif n <= 0xffff:
+        return b'\xfd' + struct.pack('<H', n)
+    elif n <= 0xffffffff:
+        return b'\xfe' + struct.pack('<I', n)
+    else:
+        return b'\xff' + struct.pack('<Q', n)
+
+def read_exact(stream: BytesIO, n: int) -> bytes:
+    """从流中读取n个字节，数据不足时抛出异常"""
+    #长度超出平台整数范围时同样视为数据不足
+    data = stream.read(n) if n <= sys.maxsize else b''
+    if len(data) != n:
+        raise ValueError("数据长度不足")
+    return data
+
+def read_varint(stream: BytesIO) -> int:
+    """从流中读取变长整数，不是最短编码时抛出异常，保证每个整数只有一种编码"""
+    prefix = read_exact(stream, 1)[0]
+    if prefix < 0xfd:
+        return prefix
+    elif prefix == 0xfd:
+        n, minimum = struct.unpack('<H', read_exact(stream, 2))[0], 0xfd
+    elif prefix == 0xfe:
+        n, minimum = struct.unpack('<I', read_exact(stream, 4))[0], 0x10000
+    else:
+        n, minimum = struct.unpack('<Q', read_exact(stream, 8))[0], 0x100000000
+    if n < minimum:
+        raise ValueError("变长整数不是最短编码")
+    return n
+
+def write_var_bytes(data: bytes) -> bytes:
+    """带长度前缀的字节串"""
+    return write_varint(len(data)) + data
+
+def read_var_bytes(stream: BytesIO) -> bytes:
+    """从流中读取带长度前缀的字节串"""
+    return read_exact(stream, read_varint(stream))
+
+def write_double(value: float) -> bytes:
+    """8字节浮点数"""
+    return struct.pack('<d', value)
+
+def read_double(stream: BytesIO) -> float:
+    """从流中读取8字节浮点数"""
+    return struct.unpack('<d', read_exact(stream, 8))[0]
+
+def write_encoding_version() -> bytes:
+    """编码格式版本号"""
+    return struct.pack('<B', ENCODING_VERSION)
+
+def read_encoding_version(stream: BytesIO):
+    """读取并检查编码格式版本号"""
+    version = read_exact(stream, 1)[0]
+    if version != ENCODING_VERSION:
+        raise ValueError(f"不支持的编码格式版本: {version}")
@@ -0,0 +1,50 @@
+import json
+import os
+import pickledb
+
+JOURNAL_COMPACT_SIZE = 1024 * 1024      #日志超过该大小且大于数据库文件时合并进数据库
+
+def write_journal(db: pickledb.PickleDB, journal: str, changes: dict):
+    """将一组修改应用到数据库，并以追加日志的方式持久化，值为None表示删除该键"""
+    for key, value in changes.items():
+        if value == None:
+            if db.exists(key):
+                db.rem(key)
+        else:
+            db.set(key, value)
+    with open(journal, 'a') as fp:
+        fp.write(json.dumps(changes) + '\n')
+    #日志足够大时才把整个数据库写一次文件，使单次写入的开销与数据库大小无关
+    db_size = os.path.getsize(db.loco) if os.path.exists(db.loco) else 0
+    if os.path.getsize(journal) > max(JOURNAL_COMPACT_SIZE, db_size):
+        compact_journal(db=db, journal=journal)
+
+def replay_journal(db: pickledb.PickleDB, journal: str):
+    """将日志中的修改应用到数据库"""
+    if not os.path.exists(journal):
+        return
+    with open(journal, 'r') as fp:
+        for line in fp:
+            try:
+                changes = json.loads(line)
+            except json.JSONDecodeError:
+                #最后一行可能因为写入中断而不完整
+                break
+            for key, value in changes.items():
+                if value == None:
+                    if db.exists(key):
+                        db.rem(key)
+                else:
+                    db.set(key, value)
+    compact_journal(db=db, journal=journal)
+
+def compact_journal(db: pickledb.PickleDB, journal: str):
+    """将数据库整体写入文件并清空日志"""
+    db.dump()
+    open(journal, 'w').close()
+
+def load_journaled_db(dir: str) -> pickledb.PickleDB:
+    """加载一个关闭自动写入、由日志持久化的数据库"""
+    db = pickledb.load(dir, False)
+    replay_journal(db=db, journal=dir+'.log')
+    return db
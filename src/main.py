@@ -1,11 +1,20 @@
-from node import Network, create_and_start_node
-from cli import BitcoinCmd
-DIR_BASE = 'data/'
-
-network = Network()
-create_and_start_node(node_id=0, network=network, dir=DIR_BASE+'djj')
-create_and_start_node(node_id=1, network=network, dir=DIR_BASE+'zsy')
-create_and_start_node(node_id=2, network=network, dir=DIR_BASE+'cby')
-create_and_start_node(node_id=3, network=network, dir=DIR_BASE+'chr')
-cmd = BitcoinCmd(network)
-cmd.cmdloop()
\ No newline at end of file
+import argparse
+from node import Network, create_and_start_node
+from tcp_transport import start_tcp_nodes
+from cli import BitcoinCmd
+DIR_BASE = 'data/'
+NODES = [(0, 'djj'), (1, 'zsy'), (2, 'cby'), (3, 'chr')]
+
+if __name__ == '__main__':
+    #节点使用forkserver/spawn方式启动子进程，子进程会重新导入本模块，不能再次启动节点
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-transport', choices=['memory', 'tcp'], default='memory', help='节点间的传输方式：memory为单进程内存队列，tcp为每个节点一个进程，通过本机TCP通信')
+    args = parser.parse_args()
+    if args.transport == 'tcp':
+        network = start_tcp_nodes(nodes=[(node_id, DIR_BASE+name) for node_id, name in NODES])
+    else:
+        network = Network()
+        for node_id, name in NODES:
+            create_and_start_node(node_id=node_id, network=network, dir=DIR_BASE+name)
+    cmd = BitcoinCmd(network)
+    cmd.cmdloop()
\ No newline at end of file
@@ -1,16 +1,207 @@
-from queue import Queue
-from transaction import Transaction
-
-class MemmoryPool:
-    """交易池"""
-    def __init__(self):
-        self.data = Queue()
-
-    def add_tx(self, tx: Transaction):
-        self.data.put(tx.serialize().hex())
-    
-    def get_tx(self) -> str:
-        if self.data.empty():
-            return None
-        else:
-            return self.data.get()
\ No newline at end of file
+import heapq
+import itertools
+import threading
+from typing import Dict, List
+from transaction import Transaction, decode_transaction, has_duplicate_inputs
+from transaction_input import TransactionInput
+from transaction_output import TransactionOutput
+from utxo import UTXOSet
+
+DEFAULT_MEMPOOL_SIZE = 5 * 1024 * 1024  #交易池中交易数据的默认总大小上限(字节)
+
+class MempoolEntry:
+    """交易池中的一笔交易"""
+    def __init__(self, tx: Transaction, tx_hex: str, fee: float, parents: set):
+        self.tx = tx
+        self.tx_hex = tx_hex
+        self.tx_id = tx.hash()
+        self.fee = fee
+        self.size = len(tx_hex) // 2
+        self.fee_rate = fee / self.size #每字节交易费
+        self.parents = parents  #交易池中被该交易花费的父交易ID
+        self.children = set()   #交易池中花费该交易输出的子交易ID
+
+class MemmoryPool:
+    """交易池，以交易ID为键，按交易费率排序，拒绝与池中交易冲突的双花交易"""
+    def __init__(self, utxo_set: UTXOSet=None, max_size: int=DEFAULT_MEMPOOL_SIZE):
+        self.utxo_set = utxo_set
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        self.entries: Dict[str, MempoolEntry] = {}
+        self.spent: Dict[tuple, str] = {}   #已被池中交易花费的输出点 -> 花费它的交易ID
+        self.size = 0
+        #按费率排列的堆，删除交易时不从堆中移除，取出时跳过已不在池中的交易
+        self.counter = itertools.count()
+        self.best_heap = []     #(-费率, 序号, 交易ID)
+        self.worst_heap = []    #(费率, 序号, 交易ID)
+        self.templates = []     #随交易池变化增量更新的区块模板
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def contains(self, tx_id: str) -> bool:
+        """交易是否在交易池中"""
+        return tx_id in self.entries
+
+    def get_entry(self, tx_id: str) -> MempoolEntry:
+        """根据交易ID获取交易池条目"""
+        return self.entries.get(tx_id)
+
+    def find_utxo_by_vin(self, vin: List[TransactionInput]) -> List[TransactionOutput]:
+        """根据tx_in获取被花费的输出，池中交易的输出优先，其余从UTXO集合中获取，不存在时对应None"""
+        outputs = []
+        for tx_in in vin:
+            parent = self.entries.get(tx_in.tx_id)
+            if parent != None:
+                outputs.append(parent.tx.outputs[tx_in.index] if tx_in.index < len(parent.tx.outputs) else None)
+            else:
+                outputs.append(self.utxo_set.get_coin(tx_id=tx_in.tx_id, index=tx_in.index) if self.utxo_set != None else None)
+        return outputs
+
+    def get_input_value(self, tx: Transaction) -> tuple:
+        """计算交易的输入总额并找出池中的父交易，有输入找不到时返回(None, None)"""
+        input_value = 0
+        parents = set()
+        for tx_in in tx.inputs:
+            parent = self.entries.get(tx_in.tx_id)
+            if parent != None:
+                if tx_in.index >= len(parent.tx.outputs):
+                    return (None, None)
+                input_value += parent.tx.outputs[tx_in.index].value
+                parents.add(parent.tx_id)
+                continue
+            coin = self.utxo_set.get_coin(tx_id=tx_in.tx_id, index=tx_in.index) if self.utxo_set != None else None
+            if coin == None:
+                return (None, None)
+            input_value += coin.value
+        return (input_value, parents)
+
+    def add_tx(self, tx: Transaction) -> bool:
+        """向交易池中加入交易，重复、冲突、输入不存在或费用为负的交易被拒绝"""
+        if tx.is_coinbase() or has_duplicate_inputs(tx=tx):
+            return False
+        with self.lock:
+            tx_id = tx.hash()
+            if tx_id in self.entries:
+                return False
+            for tx_in in tx.inputs:
+                if (tx_in.tx_id, tx_in.index) in self.spent:
+                    return False
+            input_value, parents = self.get_input_value(tx)
+            if input_value == None:
+                return False
+            fee = input_value - sum(tx_out.value for tx_out in tx.outputs)
+            if fee < 0:
+                return False
+            entry = MempoolEntry(tx=tx, tx_hex=tx.serialize().hex(), fee=fee, parents=parents)
+            self.entries[tx_id] = entry
+            for tx_in in tx.inputs:
+                self.spent[(tx_in.tx_id, tx_in.index)] = tx_id
+            for parent_id in parents:
+                self.entries[parent_id].children.add(tx_id)
+            self.size += entry.size
+            for template in self.templates:
+                if not template.add_entry(entry=entry):
+                    self.remove_tx(tx_id=tx_id, with_descendants=True)
+                    return False
+            seq = next(self.counter)
+            heapq.heappush(self.best_heap, (-entry.fee_rate, seq, tx_id))
+            heapq.heappush(self.worst_heap, (entry.fee_rate, seq, tx_id))
+            self.trim()
+            self.compact_heaps()
+            return tx_id in self.entries
+
+    def trim(self):
+        """超过大小上限时淘汰费率最低的交易及其后代"""
+        while self.size > self.max_size and self.worst_heap:
+            fee_rate, seq, tx_id = heapq.heappop(self.worst_heap)
+            if tx_id in self.entries:
+                self.remove_tx(tx_id=tx_id, with_descendants=True)
+
+    def compact_heaps(self):
+        """堆中已移除交易的残留条目过多时重建堆"""
+        if len(self.best_heap) <= 2 * len(self.entries) + 64:
+            return
+        self.best_heap = [item for item in self.best_heap if item[2] in self.entries]
+        self.worst_heap = [item for item in self.worst_heap if item[2] in self.entries]
+        heapq.heapify(self.best_heap)
+        heapq.heapify(self.worst_heap)
+
+    def get_tx(self) -> str:
+        """取出费率最高且没有池中父交易的交易，交易池为空时返回None"""
+        with self.lock:
+            skipped = []
+            tx_hex = None
+            while self.best_heap:
+                item = heapq.heappop(self.best_heap)
+                entry = self.entries.get(item[2])
+                if entry == None:
+                    continue
+                if len(entry.parents) > 0:
+                    skipped.append(item)
+                    continue
+                tx_hex = entry.tx_hex
+                self.remove_tx(tx_id=entry.tx_id, with_descendants=False)
+                break
+            for item in skipped:
+                heapq.heappush(self.best_heap, item)
+            return tx_hex
+
+    def remove_tx(self, tx_id: str, with_descendants: bool):
+        """从交易池中移除交易，with_descendants为True时一并移除其后代交易"""
+        with self.lock:
+            entry = self.entries.pop(tx_id, None)
+            if entry == None:
+                return
+            self.size -= entry.size
+            for template in self.templates:
+                template.remove_entry(tx_id=tx_id)
+            for tx_in in entry.tx.inputs:
+                self.spent.pop((tx_in.tx_id, tx_in.index), None)
+            for parent_id in entry.parents:
+                parent = self.entries.get(parent_id)
+                if parent != None:
+                    parent.children.discard(tx_id)
+            for child_id in list(entry.children):
+                if with_descendants:
+                    self.remove_tx(tx_id=child_id, with_descendants=True)
+                else:
+                    child = self.entries.get(child_id)
+                    if child != None:
+                        child.parents.discard(tx_id)
+
+    def remove_for_disconnect(self) -> List[Transaction]:
+        """区块断开后移除输入已不存在的交易(花费了被断开区块中交易的输出)及其后代，返回被移除的交易"""
+        with self.lock:
+            removed = []
+            for tx_id in list(self.entries):
+                entry = self.entries.get(tx_id)
+                if entry == None:
+                    continue
+                if self.get_input_value(tx=entry.tx)[0] != None:
+                    continue
+                descendants = set()
+                stack = [tx_id]
+                while stack:
+                    descendant_id = stack.pop()
+                    if descendant_id not in descendants:
+                        descendants.add(descendant_id)
+                        stack.extend(self.entries[descendant_id].children)
+                removed += [self.entries[descendant_id].tx for descendant_id in descendants]
+                self.remove_tx(tx_id=tx_id, with_descendants=True)
+            for template in self.templates:
+                template.invalidate()
+            return removed
+
+    def remove_for_block(self, transactions: List[str]):
+        """区块连接后移除已确认的交易，以及与区块中交易双花冲突的交易及其后代"""
+        with self.lock:
+            for tx_hex in transactions:
+                tx = decode_transaction(tx_hex)
+                self.remove_tx(tx_id=tx.hash(), with_descendants=False)
+                if tx.is_coinbase():
+                    continue
+                for tx_in in tx.inputs:
+                    conflict = self.spent.get((tx_in.tx_id, tx_in.index))
+                    if conflict != None:
+                        self.remove_tx(tx_id=conflict, with_descendants=True)
@@ -1,39 +1,97 @@
-from hashlib import sha256
-from typing import List
-
-class MerkleTreeNode:
-    """Merkle树节点"""
-    def __init__(self, left: 'MerkleTreeNode', right: 'MerkleTreeNode', data: str):
-        self.left = left
-        self.right = right
-        self.data = data
-        if left == None and right == None:
-            self.data = sha256(sha256(bytes.fromhex(self.data)).digest()).hexdigest()
-        else:
-            self.data = sha256(sha256(bytes.fromhex(self.left.data+self.right.data)).digest()).hexdigest()
-
-class MerkleTree:
-    """Merkle树"""
-    def __init__(self, transactions: List[str]):
-        self.root_node = self.merkle_root_node(transactions=transactions)
-
-    @staticmethod
-    def merkle_root_node(transactions: List[str]) -> MerkleTreeNode:
-        """根据一个交易列表获得Merkle树的根节点"""
-        nodes = []
-        if len(transactions) % 2 != 0:
-            transactions.append(transactions[-1])
-        
-        for tx in transactions:
-            node = MerkleTreeNode(left=None, right=None, data=tx)
-            nodes.append(node)
-        
-        while len(nodes) > 1:
-            if len(nodes) % 2 != 0:
-                nodes.append(nodes[-1])
-            new_nodes = []
-            for i in range(0, len(nodes), 2):
-                node = MerkleTreeNode(nodes[i], nodes[i+1], None)
-                new_nodes.append(node)
-            nodes = new_nodes
-        return nodes[0]
+from hashlib import sha256
+import json
+from typing import List
+from transaction import decode_transaction
+from block_header import BlockHeader
+
+class MerkleTree:
+    """Merkle树，每一层保存为一个由32字节哈希组成的列表，不创建节点对象"""
+    def __init__(self, transactions: List[str]):
+        #叶子节点复用交易缓存中的交易ID，即交易二进制数据的双重SHA256
+        leaves = [bytes.fromhex(decode_transaction(tx).hash()) for tx in transactions]
+        self.levels = self.build_levels(leaves=leaves)
+        self.root_hash = self.levels[-1][0].hex()
+
+    @staticmethod
+    def build_levels(leaves: List[bytes]) -> List[List[bytes]]:
+        """由叶子哈希逐层计算到根，返回从叶子层到根层的全部层，不修改传入的列表"""
+        level = list(leaves)
+        levels = []
+        #与比特币不同，只有一个叶子时也要与自身配对计算一次
+        if len(level) % 2 != 0:
+            level.append(level[-1])
+        levels.append(level)
+        while len(level) > 1:
+            if len(level) % 2 != 0:
+                level.append(level[-1])
+            level = [sha256(sha256(level[i] + level[i+1]).digest()).digest() for i in range(0, len(level), 2)]
+            levels.append(level)
+        return levels
+
+    @staticmethod
+    def merkle_root(leaves: List[bytes]) -> bytes:
+        """根据叶子哈希列表计算Merkle根"""
+        return MerkleTree.build_levels(leaves=leaves)[-1][0]
+
+    @staticmethod
+    def depth(tx_count: int) -> int:
+        """有tx_count个叶子的树从叶子层到根的层数，即证明路径的长度"""
+        return max(1, (tx_count - 1).bit_length())
+
+    def get_branch(self, index: int) -> List[str]:
+        """第index个叶子到根路径上每一层的兄弟节点哈希"""
+        branch = []
+        for level in self.levels[:-1]:
+            branch.append(level[index ^ 1].hex())
+            index //= 2
+        return branch
+
+class MerkleProof:
+    """交易在区块中的Merkle包含证明"""
+    def __init__(self, tx_id: str, block_hash: str, index: int, tx_count: int, branch: List[str]):
+        self.tx_id = tx_id
+        self.block_hash = block_hash
+        self.index = index  #交易在区块中的位置
+        self.tx_count = tx_count    #区块中的交易数量
+        self.branch = branch    #从叶子层到根的兄弟节点哈希
+
+    def to_dict(self) -> dict:
+        """转换为字典格式"""
+        return {
+            "tx_id": self.tx_id,
+            "block_hash": self.block_hash,
+            "index": self.index,
+            "tx_count": self.tx_count,
+            "branch": self.branch
+        }
+
+    def to_json(self) -> str:
+        """转换为 JSON 字符串"""
+        return json.dumps(self.to_dict(), indent=4)
+
+def create_merkle_proof(transactions: List[str], index: int, block_hash: str) -> MerkleProof:
+    """为区块中第index笔交易生成Merkle包含证明"""
+    merkle_tree = MerkleTree(transactions=transactions)
+    tx_id = decode_transaction(transactions[index]).hash()
+    return MerkleProof(tx_id=tx_id, block_hash=block_hash, index=index, tx_count=len(transactions), branch=merkle_tree.get_branch(index=index))
+
+def verify_merkle_proof(proof: MerkleProof, header: BlockHeader) -> bool:
+    """只根据区块头验证交易的Merkle包含证明"""
+    if header.hash() != proof.block_hash:
+        return False
+    #奇数层末尾补齐的重复节点也能算出同一个根，位置必须落在真实的交易上
+    if proof.index < 0 or proof.index >= proof.tx_count or len(proof.branch) != MerkleTree.depth(proof.tx_count):
+        return False
+    node = bytes.fromhex(proof.tx_id)
+    index = proof.index
+    for sibling in proof.branch:
+        sibling = bytes.fromhex(sibling)
+        if index % 2 == 0:
+            node = sha256(sha256(node + sibling).digest()).digest()
+        else:
+            #真实节点的左兄弟不会与它相同，相同说明它是补齐的重复节点(交易数量被虚报)
+            if sibling == node:
+                return False
+            node = sha256(sha256(sibling + node).digest()).digest()
+        index //= 2
+    return index == 0 and node.hex() == header.merkle_root_hash
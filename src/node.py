@@ -1,195 +1,548 @@
-import pickle
-import threading
-import random
-import time
-from memory_pool import MemmoryPool
-from utxo import load_utxo_set, UTXOSet
-from wallet import load_wallet, Wallet
-from block_chain import create_block_chain, load_block_chain, BlockChain, verify_block
-from block import deserialize_block, create_block
-from transaction import deserialize_transaction, create_transaction
-import os
-
-class Node(threading.Thread):
-    def __init__(self, node_id, network, dir):
-        super().__init__()
-        self.node_id: int = node_id
-        self.network: 'Network' = network  # 网络对象，负责节点间通信
-        self.mem_pool = MemmoryPool()
-        self.block_chain: BlockChain = None
-        self.utxo_set: UTXOSet = None
-        self.wallet: Wallet = None
-        self.dir = dir
-        self.init_data(dir)
-
-    def broadcast_transaction(self, transaction: str):
-        """广播交易"""
-        self.network.broadcast(self.node_id, "transaction", transaction)
-        print(f"节点 {self.node_id} 广播了交易: {deserialize_transaction(bytes.fromhex(transaction)).hash()}")
-
-    def broadcast_block(self, block: str):
-        """广播区块"""
-        self.network.broadcast(self.node_id, "block", block)
-        print(f"节点 {self.node_id} 广播了区块: {deserialize_block(bytes.fromhex(block)).hash()}")
-
-    def broadcast_version(self):
-        """广播 version 消息"""
-        self.network.broadcast(self.node_id, "version", VersionMessage(node_id=self.node_id, best_height=self.block_chain.get_best_height()).serlialize().hex())
-
-    def send_data(self, to_node_id: int, message_type: str, data: str):
-        """发送消息"""
-        self.network.messages[to_node_id].append((self.node_id, message_type, data))
-
-
-    def process_message(self, sender_id: int, message_type: str, data: str):
-        """处理消息"""
-        if message_type == "transaction":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的交易")
-            self.mem_pool.add_tx(deserialize_transaction(bytes.fromhex(data)))
-        elif message_type == "block":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的区块")
-            block = deserialize_block(bytes.fromhex(data))
-            self.block_chain.add_block(block=block, utxo_set=self.utxo_set)
-        elif message_type == "version":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的版本消息")
-            version_message = VersionMessage.deserialize(bytes.fromhex(data))
-            if version_message.best_height > self.block_chain.get_best_height():
-                self.send_data(to_node_id=sender_id, message_type="getblocks", data="")
-                self.send_data(to_node_id=sender_id, message_type="getutxos", data="")
-            elif version_message.best_height < self.block_chain.get_best_height():
-                self.broadcast_version()
-        elif message_type == "getblocks":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的获取区块消息")
-            self.send_data(to_node_id=sender_id, message_type="blocks", data=self.block_chain)
-        elif message_type == "blocks":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的区块消息")
-            new_chain = data
-            self.block_chain.update_all(new_chain=new_chain)
-        elif message_type == "getutxos":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的获取UTXO消息")
-            self.send_data(to_node_id=sender_id, message_type="utxos", data=self.utxo_set)
-        elif message_type == "utxos":
-            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的UTXO消息")
-            new_utxo_set = data
-            self.utxo_set.update_utxo_set(utxo_set=new_utxo_set)
-        elif message_type == "getbalance":
-            print(f'地址{data}的比特余额:{self.utxo_set.get_balance_by_address(data)}')
-            self.send_data(to_node_id=sender_id, message_type="reply", data=True)        
-        elif message_type == "create_tx":
-            if data['tx_fee'] == None:
-                data['tx_fee'] = 0.05
-            tx = create_transaction(send=self.wallet, to=data['to'], value=data['value'], utxo_set=self.utxo_set, tx_fee=data['tx_fee'])
-            if tx:
-                self.mem_pool.add_tx(tx)
-                self.broadcast_transaction(tx.serialize().hex())
-                self.send_data(to_node_id=sender_id, message_type="reply", data=True)
-        elif message_type == "get_tx":
-            tx = self.block_chain.find_tx(data)
-            if tx:
-                print(tx.to_json())
-            else:
-                print('没有找到交易')
-            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
-        elif message_type == "get_block":
-            block = self.block_chain.find_block_by_hash(data)
-            if block:
-                print(block.to_json())
-            else:
-                print('没有找到区块')
-            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
-        elif message_type == "get_best_height":
-            print(f'最新区块高度为:{self.block_chain.get_best_height()}')
-            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
-        elif message_type == "get_best_block_hash":
-            print(f'最新区块哈希值为:{self.block_chain.get_best_block_hash()}')
-            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
-        elif message_type == "create_block":
-            block = create_block(block_height=self.block_chain.get_best_height()+1, pre_block_hash=self.block_chain.get_best_block_hash(), mem_pool=self.mem_pool, address=self.wallet.get_address(), utxo_set=self.utxo_set)
-            if block:
-                self.block_chain.add_block(block=block, utxo_set=self.utxo_set)
-                self.broadcast_block(block.serialize().hex())
-                self.send_data(to_node_id=443, message_type="reply", data=True) 
-        elif message_type == "list_address":
-            print(self.wallet.get_address())
-            self.send_data(to_node_id=443, message_type="reply", data=True) 
-        elif message_type == "print_blocks":
-            blocks = self.block_chain.print_blocks()
-            blocks.reverse()
-            for block_hash in blocks:
-                print(block_hash)
-            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
-
-    def init_data(self, dir):
-        """初始化数据"""
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-        self.utxo_set = load_utxo_set(dir=dir+'/utxo.db')
-        self.wallet = load_wallet(dir=dir+'/wallet.conf')
-        if self.node_id == 0 and not os.path.exists(os.path.join(dir, 'block.db')):
-            self.block_chain = create_block_chain(to=self.wallet.get_address(), utxo_set=self.utxo_set, dir=dir+'/block.db')
-        else:
-            self.block_chain = load_block_chain(dir=dir+'/block.db')
-
-    def run(self):
-        self.broadcast_version()
-        while True:
-            # 从网络获取所有未处理的消息
-            messages = self.network.get_messages(self.node_id)
-            for sender_id, message_type, data in messages:
-                self.process_message(sender_id, message_type, data)
-            time.sleep(random.uniform(0.5, 1))  # 模拟运行延迟
-
-
-class Network:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.messages = {}  # 存储每个节点的消息队列
-        self.messages[443] = []  # 专门用于命令行的消息队列 
-        self.mp = {}
-
-    def register_node(self, node):
-        """注册节点"""
-        with self.lock:
-            self.messages[node.node_id] = []
-            self.mp[node.dir] = node.node_id
-
-    def broadcast(self, sender_id, message_type, data):
-        """广播消息"""
-        with self.lock:
-            for node_id, queue in self.messages.items():
-                if node_id != sender_id:  # 不广播给自己
-                    queue.append((sender_id, message_type, data))
-
-    def get_messages(self, node_id):
-        """获取节点的消息"""
-        with self.lock:
-            messages = self.messages[node_id]
-            self.messages[node_id] = []  # 清空队列
-        return messages
-    
-    def send_data(self, to_node_id: int, message_type: str, data: str):
-        """专用于命令行向主网络发送消息"""
-        self.messages[to_node_id].append((443, message_type, data))
-
-class VersionMessage:
-    """version消息"""
-    def __init__(self, node_id: int, best_height: int):
-        self.node_id = node_id
-        self.best_height = best_height
-
-    def serlialize(self) -> bytes:
-        """序列化"""
-        return pickle.dumps(self)
-    
-    def deserialize(data: bytes) -> 'VersionMessage':
-        """反序列化"""
-        return pickle.loads(data)
-    
-
-def create_and_start_node(node_id: int, network: Network, dir: str):
-    """模拟比特币网络"""
-    node = Node(node_id=node_id, network=network, dir=dir)  # 确保传递正确的整数值
-    # 注册节点到网络
-    network.register_node(node)
-    # 启动节点
-    node.start()
+import heapq
+import itertools
+import queue
+import threading
+import random
+import struct
+import time
+from typing import Dict, List
+from io import BytesIO
+from memory_pool import MemmoryPool
+from block_template import BlockTemplate
+from tx_admission import TxAdmission
+from tx_relay import TxRelay
+from block_sync import BlockSync, GENESIS_PRE_HASH
+from compact_block import CompactBlock, PartialBlock, create_compact_block, deserialize_compact_block, encode_block_txn_request, decode_block_txn_request, encode_block_txn, decode_block_txn
+from utxo_snapshot import SnapshotSync
+from utxo import load_utxo_set, UTXOSet
+from wallet import load_wallet, Wallet
+from block_chain import create_block_chain, load_block_chain, BlockChain, verify_block
+from block import Block, deserialize_block, create_block
+from proof_of_work import verify_header_pow, get_work
+from transaction import Transaction, decode_transaction, create_transaction
+from signature_verifier import SignatureVerifier, get_shared_verifier
+from merkle_tree import verify_merkle_proof
+from encoding import write_varint, read_varint
+import os
+
+CLI_NODE_ID = 443   #命令行在网络中使用的节点ID
+COMPACT_BLOCK_TIMEOUT = 2   #紧凑区块的缺失交易超过这个时间(秒)未到达时，放弃重建，改为请求完整区块
+
+class Node(threading.Thread):
+    def __init__(self, node_id, network, dir, verify_workers: int=None, verifier: SignatureVerifier=None, snapshot_sync: bool=False):
+        super().__init__()
+        self.node_id: int = node_id
+        self.network: 'Network' = network  # 网络对象，负责节点间通信
+        self.mem_pool: MemmoryPool = None
+        self.block_template: BlockTemplate = None
+        self.admission: TxAdmission = None
+        self.relay: TxRelay = None
+        self.verifier: SignatureVerifier = verifier    #未传入时使用本进程中各节点共用的签名验证进程池
+        self.block_chain: BlockChain = None
+        self.sync: BlockSync = None
+        self.snapshot: SnapshotSync = None
+        self.snapshot_sync = snapshot_sync      #为True时本地没有区块链的节点先下载UTXO快照
+        self.reorg: tuple = None    #未完成的重组：(分叉点区块哈希, 按高度排列的被断开的原主链区块, 原主链在分叉点之后的工作量)
+        self.compact_blocks: Dict[str, tuple] = {}  #等待缺失交易的紧凑区块：区块哈希 -> (PartialBlock, 发送节点ID, 请求时间)
+        self.utxo_set: UTXOSet = None
+        self.wallet: Wallet = None
+        self.dir = dir
+        self.verify_workers = verify_workers    #区块与交易签名验证进程数，None表示使用全部CPU核心
+        self.init_data(dir)
+
+    def broadcast_transaction(self, tx: Transaction):
+        """公告交易，相邻节点需要时再请求交易本身"""
+        self.relay.announce(tx_id=tx.hash())
+        print(f"节点 {self.node_id} 广播了交易: {tx.hash()}")
+
+    def broadcast_block(self, block: Block):
+        """以紧凑区块的形式广播区块"""
+        self.network.broadcast(self.node_id, "cmpctblock", create_compact_block(block=block).serialize())
+        print(f"节点 {self.node_id} 广播了区块: {block.hash()}")
+
+    def broadcast_version(self):
+        """广播 version 消息"""
+        self.network.broadcast(self.node_id, "version", VersionMessage(node_id=self.node_id, best_height=self.block_chain.get_best_height()).serialize())
+
+    def send_data(self, to_node_id: int, message_type: str, data: str):
+        """发送消息"""
+        self.network.send(self.node_id, to_node_id, message_type, data)
+
+
+    def handle_message(self, sender_id: int, message_type: str, data: str):
+        """处理一条消息，对端发来无法解码的数据时丢弃该消息，节点继续运行"""
+        try:
+            self.process_message(sender_id, message_type, data)
+        except (ValueError, struct.error) as e:
+            print(f"节点 {self.node_id} 丢弃了节点 {sender_id} 发来的无法解码的 {message_type} 消息: {e}")
+
+    def process_message(self, sender_id: int, message_type: str, data: str):
+        """处理消息"""
+        if message_type == "transaction":
+            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的交易")
+            try:
+                tx = decode_transaction(data.hex())
+            except ValueError:
+                print(f"节点 {self.node_id} 收到节点 {sender_id} 无法解码的交易")
+                return
+            if self.relay.receive_tx(tx_id=tx.hash()):
+                self.admission.submit(tx)
+        elif message_type == "tx_verified":
+            # 取回异步验证完成的交易，被接受的交易继续向相邻节点公告
+            for tx in self.admission.process_results():
+                self.relay.announce(tx_id=tx.hash())
+        elif message_type == "inv":
+            self.relay.handle_inv(peer_id=sender_id, data=data)
+        elif message_type == "gettxdata":
+            self.relay.handle_gettxdata(peer_id=sender_id, data=data, get_tx=self.get_mempool_tx)
+        elif message_type == "block":
+            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的区块")
+            if self.snapshot.wants_snapshot():
+                #快照同步期间不连接区块，快照完成后通过区块头同步取得
+                return
+            self.process_block(peer_id=sender_id, block=deserialize_block(data))
+        elif message_type == "cmpctblock":
+            if self.snapshot.wants_snapshot():
+                return
+            self.receive_compact_block(peer_id=sender_id, compact=deserialize_compact_block(data))
+        elif message_type == "getblocktxn":
+            block_hash, indexes = decode_block_txn_request(data)
+            block = self.block_chain.get_block(block_hash)
+            if block != None and all(index < len(block.transactions) for index in indexes):
+                self.send_data(to_node_id=sender_id, message_type="blocktxn", data=encode_block_txn(block_hash=block_hash, transactions=[block.transactions[index] for index in indexes]))
+        elif message_type == "blocktxn":
+            block_hash = data[:32].hex()
+            pending = self.compact_blocks.pop(block_hash, None)
+            if pending == None:
+                return
+            partial, peer_id, requested_at = pending
+            try:
+                transactions = decode_block_txn(data)[1]
+            except ValueError:
+                #回复无法解码时同样改为请求完整区块
+                transactions = None
+            if transactions == None or not partial.fill(transactions=transactions):
+                self.send_data(to_node_id=peer_id, message_type="getdata", data=bytes.fromhex(block_hash))
+                return
+            self.finish_compact_block(peer_id=peer_id, partial=partial)
+        elif message_type == "version":
+            # print(f"节点 {self.node_id} 收到来自节点 {sender_id} 的版本消息")
+            try:
+                version_message = VersionMessage.deserialize(data)
+            except ValueError:
+                print(f"节点 {self.node_id} 收到节点 {sender_id} 无法解码的version消息")
+                return
+            if self.snapshot.wants_snapshot():
+                #快照同步期间只记录对端高度，快照完成或放弃后再同步之后的区块
+                self.sync.peer_heights[sender_id] = version_message.best_height
+                if version_message.best_height >= 0:
+                    self.snapshot.request_snapshot(peer_id=sender_id)
+            else:
+                self.sync.set_peer_height(peer_id=sender_id, height=version_message.best_height)
+            if version_message.best_height < self.block_chain.get_best_height():
+                self.broadcast_version()
+        elif message_type == "getheaders":
+            self.sync.handle_getheaders(peer_id=sender_id, data=data)
+        elif message_type == "headers":
+            self.sync.handle_headers(peer_id=sender_id, data=data)
+        elif message_type == "getdata":
+            self.sync.handle_getdata(peer_id=sender_id, data=data)
+        elif message_type == "getsnapshot":
+            self.snapshot.handle_getsnapshot(peer_id=sender_id)
+        elif message_type == "snapshot":
+            if self.snapshot.handle_snapshot(peer_id=sender_id, data=data):
+                self.sync.finish_headers()
+        elif message_type == "getsnapshotchunk":
+            self.snapshot.handle_getchunk(peer_id=sender_id, data=data)
+        elif message_type == "snapshotchunk":
+            if self.snapshot.handle_chunk(peer_id=sender_id, data=data):
+                self.sync.finish_headers()
+        elif message_type == "getbalance":
+            print(f'地址{data}的比特余额:{self.utxo_set.get_balance_by_address(data)}')
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True)        
+        elif message_type == "create_tx":
+            if data['tx_fee'] == None:
+                data['tx_fee'] = 0.05
+            tx = create_transaction(send=self.wallet, to=data['to'], value=data['value'], utxo_set=self.utxo_set, tx_fee=data['tx_fee'])
+            if tx:
+                if self.mem_pool.add_tx(tx):
+                    self.broadcast_transaction(tx)
+                else:
+                    print('交易无效或与交易池中的交易冲突，未能加入交易池')
+                self.send_data(to_node_id=sender_id, message_type="reply", data=True)
+        elif message_type == "get_tx":
+            tx = self.block_chain.find_tx(data)
+            if tx:
+                print(tx.to_json())
+            else:
+                print('没有找到交易')
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
+        elif message_type == "get_tx_proof":
+            proof = self.block_chain.get_tx_proof(data)
+            if proof:
+                print(proof.to_json())
+                header = self.block_chain.get_block_header(proof.block_hash)
+                print(f'验证结果:{verify_merkle_proof(proof=proof, header=header)}')
+            else:
+                print('没有找到交易')
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
+        elif message_type == "get_block":
+            block = self.block_chain.find_block_by_hash(data)
+            if block:
+                print(block.to_json())
+            else:
+                print('没有找到区块')
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
+        elif message_type == "get_best_height":
+            print(f'最新区块高度为:{self.block_chain.get_best_height()}')
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
+        elif message_type == "get_best_block_hash":
+            print(f'最新区块哈希值为:{self.block_chain.get_best_block_hash()}')
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
+        elif message_type == "create_block":
+            block = create_block(block_height=self.block_chain.get_best_height()+1, pre_block_hash=self.block_chain.get_best_block_hash(), mem_pool=self.mem_pool, address=self.wallet.get_address(), utxo_set=self.utxo_set, template=self.block_template)
+            if block:
+                self.connect_block(block=block)
+                self.broadcast_block(block)
+                self.send_data(to_node_id=CLI_NODE_ID, message_type="reply", data=True) 
+        elif message_type == "ping":
+            self.send_data(to_node_id=sender_id, message_type="pong", data=data)
+        elif message_type == "list_address":
+            print(self.wallet.get_address())
+            self.send_data(to_node_id=CLI_NODE_ID, message_type="reply", data=True) 
+        elif message_type == "print_blocks":
+            blocks = self.block_chain.print_blocks()
+            blocks.reverse()
+            for block_hash in blocks:
+                print(block_hash)
+            self.send_data(to_node_id=sender_id, message_type="reply", data=True) 
+
+    def process_block(self, peer_id: int, block: Block):
+        """收到完整区块，交给区块同步决定连接还是请求区块头"""
+        for ready_block in self.sync.receive_block(peer_id=peer_id, block=block):
+            if not self.connect_block(block=ready_block):
+                self.sync.reset()
+                break
+            self.sync.block_connected(block_hash=ready_block.hash())
+
+    def receive_compact_block(self, peer_id: int, compact: CompactBlock):
+        """收到紧凑区块，用交易池和孤儿交易池中的交易重建区块，缺失的交易向发送者请求"""
+        block_hash = compact.hash()
+        if block_hash in self.compact_blocks or self.block_chain.db.exists(block_hash):
+            return
+        if compact.header.pre_block_hash != (self.block_chain.get_best_block_hash() or GENESIS_PRE_HASH):
+            #不能直接连接在最新区块之后，交给区块头同步处理
+            if not self.sync.is_syncing():
+                self.sync.request_headers(peer_id=peer_id)
+            return
+        if not verify_header_pow(header=compact.header):
+            return
+        with self.mem_pool.lock:
+            candidates = {tx_id: entry.tx_hex for tx_id, entry in self.mem_pool.entries.items()}
+        for tx_id, (tx, missing) in list(self.admission.orphans.entries.items()):
+            candidates.setdefault(tx_id, tx.serialize().hex())
+        partial = PartialBlock(compact=compact)
+        try:
+            missing = partial.init_data(candidates=candidates)
+        except ValueError:
+            return
+        if len(missing) > 0:
+            self.compact_blocks[block_hash] = (partial, peer_id, time.monotonic())
+            self.send_data(to_node_id=peer_id, message_type="getblocktxn", data=encode_block_txn_request(block_hash=block_hash, indexes=missing))
+            return
+        self.finish_compact_block(peer_id=peer_id, partial=partial)
+
+    def finish_compact_block(self, peer_id: int, partial: PartialBlock):
+        """紧凑区块重建完成后连接，重建出的区块与区块头不符或含有无法解码的交易时改为请求完整区块"""
+        try:
+            block = partial.get_block()
+        except ValueError:
+            block = None
+        if block == None:
+            self.send_data(to_node_id=peer_id, message_type="getdata", data=bytes.fromhex(partial.compact.hash()))
+            return
+        self.process_block(peer_id=peer_id, block=block)
+
+    def connect_block(self, block) -> bool:
+        """把区块连接到本地区块链，接在主链更早位置的区块先触发重组；区块无效时撤销未完成的重组"""
+        pre_hash = block.block_header.pre_block_hash
+        if pre_hash != self.block_chain.get_best_block_hash() and self.block_chain.is_main_chain(pre_hash):
+            #区块同步只在对端的链工作量超过本地之后才交出接在主链更早位置的区块，先断开分叉点之后的本地区块
+            if not self.disconnect_to(block_hash=pre_hash):
+                self.abort_reorg()
+                return False
+        if not self.attach_block(block=block):
+            self.abort_reorg()
+            return False
+        if self.reorg != None:
+            fork_hash, old_blocks, old_work = self.reorg
+            if self.block_chain.get_work_since(height=self.block_chain.get_block_height(fork_hash)) > old_work:
+                #新链的工作量已超过原主链，重组完成
+                self.reorg = None
+        return True
+
+    def attach_block(self, block) -> bool:
+        """把接在最新区块之后的区块加入区块链，并更新交易池、孤儿交易和交易转发"""
+        if not self.block_chain.add_block(block=block, utxo_set=self.utxo_set, mem_pool=self.mem_pool):
+            return False
+        tx_ids = block.get_tx_ids()
+        self.admission.block_connected(tx_ids=tx_ids)
+        #已确认的交易不必再从其他节点请求
+        for tx_id in tx_ids[1:]:
+            self.relay.seen.add(tx_id)
+        #不再能连接到最新区块之后的紧凑区块不必继续等待
+        best_block_hash = self.block_chain.get_best_block_hash()
+        self.compact_blocks = {block_hash: pending for block_hash, pending in self.compact_blocks.items() if pending[0].compact.header.pre_block_hash == best_block_hash}
+        return True
+
+    def disconnect_to(self, block_hash: str) -> bool:
+        """断开主链上指定区块之后的区块并记录重组，被断开区块中的交易重新提交验证，仍然有效的回到交易池"""
+        fork_height = self.block_chain.get_block_height(block_hash)
+        old_work = self.block_chain.get_work_since(height=fork_height)
+        disconnected = []
+        while self.block_chain.get_best_block_hash() != block_hash:
+            block = self.block_chain.disconnect_block(utxo_set=self.utxo_set)
+            if block == None:
+                break
+            disconnected.insert(0, block)
+        if self.reorg == None:
+            self.reorg = (block_hash, disconnected, old_work)
+        else:
+            #上一次重组尚未完成，要恢复的仍是最初的主链
+            fork_hash, old_blocks, reorg_work = self.reorg
+            depth = self.block_chain.get_block_height(fork_hash) - fork_height
+            if depth > 0:
+                self.reorg = (block_hash, disconnected[:depth] + old_blocks, reorg_work + sum(get_work(header=block.block_header) for block in disconnected[:depth]))
+        print(f"节点 {self.node_id} 区块链重组，断开了 {len(disconnected)} 个区块")
+        self.compact_blocks = {}
+        self.resubmit_transactions(blocks=disconnected)
+        return self.block_chain.get_best_block_hash() == block_hash
+
+    def abort_reorg(self):
+        """新链的区块无效时，若新链在分叉点之后的工作量不超过原主链，断开新链的区块并重新连接原主链的区块"""
+        if self.reorg == None:
+            return
+        fork_hash, old_blocks, old_work = self.reorg
+        self.reorg = None
+        if self.block_chain.get_work_since(height=self.block_chain.get_block_height(fork_hash)) > old_work:
+            return
+        disconnected = []
+        while self.block_chain.get_best_block_hash() != fork_hash:
+            block = self.block_chain.disconnect_block(utxo_set=self.utxo_set)
+            if block == None:
+                return
+            disconnected.insert(0, block)
+        restored = 0
+        for block in old_blocks:
+            if not self.attach_block(block=block):
+                break
+            restored += 1
+        print(f"节点 {self.node_id} 新链的区块无效，恢复了原主链的 {restored} 个区块")
+        self.resubmit_transactions(blocks=disconnected)
+
+    def resubmit_transactions(self, blocks: List[Block]):
+        """区块断开后更新交易池：移除输入已不存在的交易，被断开区块中的交易和被移除的交易重新提交验证"""
+        evicted = self.mem_pool.remove_for_disconnect()
+        for block in blocks:
+            for tx_hex in block.transactions[1:]:
+                self.admission.submit(decode_transaction(tx_hex))
+        #父交易重新被接受之前，被移除的交易暂存在孤儿交易池中
+        for tx in evicted:
+            self.admission.submit(tx)
+
+    def get_timeout(self) -> float:
+        """距离下一个定时任务的时间，没有定时任务时为None"""
+        timeouts = [timeout for timeout in (self.relay.get_flush_timeout(), self.sync.get_timeout(), self.snapshot.get_timeout(), self.get_compact_block_timeout()) if timeout != None]
+        return min(timeouts) if timeouts else None
+
+    def run_timers(self):
+        """执行到期的定时任务：交易公告的批量发送、区块与快照分块请求的超时重发和紧凑区块的超时处理"""
+        self.relay.maybe_flush()
+        self.sync.check_timeouts()
+        if self.snapshot.check_timeouts():
+            self.sync.finish_headers()
+        self.check_compact_blocks()
+
+    def get_compact_block_timeout(self) -> float:
+        """距离最早的紧凑区块等待超时的时间，没有等待中的紧凑区块时为None"""
+        if not self.compact_blocks:
+            return None
+        return max(0, min(pending[2] for pending in self.compact_blocks.values()) + COMPACT_BLOCK_TIMEOUT - time.monotonic())
+
+    def check_compact_blocks(self):
+        """缺失交易超时未到达的紧凑区块不再等待，向发送者请求完整区块"""
+        now = time.monotonic()
+        for block_hash, (partial, peer_id, requested_at) in list(self.compact_blocks.items()):
+            if now - requested_at >= COMPACT_BLOCK_TIMEOUT:
+                del self.compact_blocks[block_hash]
+                self.send_data(to_node_id=peer_id, message_type="getdata", data=bytes.fromhex(block_hash))
+
+    def get_mempool_tx(self, tx_id: str) -> str:
+        """从交易池中取得交易的十六进制编码，没有时返回None"""
+        with self.mem_pool.lock:
+            entry = self.mem_pool.get_entry(tx_id)
+            return entry.tx_hex if entry != None else None
+
+    def notify_tx_verified(self):
+        """交易签名验证完成后唤醒节点线程"""
+        self.network.send(self.node_id, self.node_id, "tx_verified", None)
+
+    def init_data(self, dir):
+        """初始化数据"""
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        self.utxo_set = load_utxo_set(dir=dir+'/utxo.db')
+        self.mem_pool = MemmoryPool(utxo_set=self.utxo_set)
+        self.block_template = BlockTemplate(mem_pool=self.mem_pool)
+        self.wallet = load_wallet(dir=dir+'/wallet.conf')
+        if self.node_id == 0 and not os.path.exists(os.path.join(dir, 'block.db')):
+            self.block_chain = create_block_chain(to=self.wallet.get_address(), utxo_set=self.utxo_set, dir=dir+'/block.db')
+        else:
+            self.block_chain = load_block_chain(dir=dir+'/block.db')
+        if self.verifier == None:
+            self.verifier = get_shared_verifier(workers=self.verify_workers)
+        self.block_chain.verifier = self.verifier
+        self.sync = BlockSync(node_id=self.node_id, block_chain=self.block_chain, send=lambda to_node_id, message_type, data: self.send_data(to_node_id=to_node_id, message_type=message_type, data=data))
+        self.snapshot = SnapshotSync(node_id=self.node_id, block_chain=self.block_chain, utxo_set=self.utxo_set, dir=dir+'/snapshots', send=self.sync.send, enabled=self.snapshot_sync)
+        #被拒绝的交易记入已见集合，不再请求
+        self.admission = TxAdmission(mem_pool=self.mem_pool, verifier=self.verifier, on_result=self.notify_tx_verified, on_reject=lambda tx_id: self.relay.seen.add(tx_id))
+        self.relay = TxRelay(node_id=self.node_id, send=self.sync.send, get_peers=lambda: self.network.get_peers(self.node_id), has_tx=self.admission.contains)
+
+    def run(self):
+        self.broadcast_version()
+        while True:
+            # 阻塞等待消息到达或到达下一个定时任务的时间，收到后处理所有未处理的消息
+            messages = self.network.get_messages(self.node_id, timeout=self.get_timeout())
+            for sender_id, message_type, data in messages:
+                self.handle_message(sender_id, message_type, data)
+            self.run_timers()
+
+
+class DelayModel:
+    """链路延迟模型，每条链路的延迟为基础延迟加上随机抖动(秒)"""
+    def __init__(self, default_delay: float=0, jitter: float=0):
+        self.default_delay = default_delay
+        self.jitter = jitter
+        self.link_delays = {}   #(发送节点ID, 接收节点ID) -> 该链路的基础延迟
+
+    def set_link_delay(self, sender_id: int, receiver_id: int, delay: float):
+        """设置一条有向链路的基础延迟"""
+        self.link_delays[(sender_id, receiver_id)] = delay
+
+    def get_delay(self, sender_id: int, receiver_id: int) -> float:
+        """一条消息在链路上的延迟"""
+        delay = self.link_delays.get((sender_id, receiver_id), self.default_delay)
+        if self.jitter > 0:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+class Network:
+    def __init__(self, delay_model: DelayModel=None):
+        self.lock = threading.Lock()
+        self.messages: Dict[int, queue.Queue] = {}  # 每个节点的阻塞收件箱
+        self.messages[CLI_NODE_ID] = queue.Queue()  # 专门用于命令行的消息队列 
+        self.mp = {}
+        self.delay_model = delay_model if delay_model != None else DelayModel()
+        #按送达时间排列的延迟消息，由调度线程到期后放入收件箱
+        self.delayed = []
+        self.delayed_cond = threading.Condition(self.lock)
+        self.counter = itertools.count()
+        self.scheduler: threading.Thread = None
+
+    def register_node(self, node):
+        """注册节点"""
+        with self.lock:
+            self.messages[node.node_id] = queue.Queue()
+            self.mp[node.dir] = node.node_id
+
+    def link_delay(self, sender_id: int, to_node_id: int) -> float:
+        """消息的链路延迟，节点发给自己和命令行的消息没有延迟"""
+        if sender_id == to_node_id or sender_id == CLI_NODE_ID or to_node_id == CLI_NODE_ID:
+            return 0
+        return self.delay_model.get_delay(sender_id, to_node_id)
+
+    def deliver(self, sender_id: int, to_node_id: int, message_type: str, data):
+        """按链路延迟把消息投递到节点的收件箱"""
+        delay = self.link_delay(sender_id, to_node_id)
+        message = (sender_id, message_type, data)
+        if delay <= 0:
+            self.messages[to_node_id].put(message)
+            return
+        with self.delayed_cond:
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.counter), to_node_id, message))
+            if self.scheduler == None:
+                self.scheduler = threading.Thread(target=self.run_scheduler, daemon=True)
+                self.scheduler.start()
+            self.delayed_cond.notify()
+
+    def run_scheduler(self):
+        """延迟消息调度线程"""
+        with self.delayed_cond:
+            while True:
+                if len(self.delayed) == 0:
+                    self.delayed_cond.wait()
+                    continue
+                wait_time = self.delayed[0][0] - time.monotonic()
+                if wait_time > 0:
+                    self.delayed_cond.wait(wait_time)
+                    continue
+                deliver_at, seq, to_node_id, message = heapq.heappop(self.delayed)
+                self.messages[to_node_id].put(message)
+
+    def send(self, sender_id: int, to_node_id: int, message_type: str, data):
+        """向一个节点发送消息"""
+        self.deliver(sender_id, to_node_id, message_type, data)
+
+    def get_peers(self, node_id: int) -> list:
+        """节点的相邻节点，即除自己和命令行外的所有节点"""
+        with self.lock:
+            return [peer_id for peer_id in self.messages if peer_id != node_id and peer_id != CLI_NODE_ID]
+
+    def broadcast(self, sender_id, message_type, data):
+        """广播消息"""
+        for node_id in self.get_peers(sender_id):
+            self.deliver(sender_id, node_id, message_type, data)
+
+    def get_messages(self, node_id, timeout: float=None) -> list:
+        """获取节点的消息，收件箱为空时阻塞直到有消息到达或超时"""
+        inbox = self.messages[node_id]
+        try:
+            messages = [inbox.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(inbox.get_nowait())
+            except queue.Empty:
+                return messages
+    
+    def send_data(self, to_node_id: int, message_type: str, data: str):
+        """专用于命令行向主网络发送消息"""
+        self.deliver(CLI_NODE_ID, to_node_id, message_type, data)
+
+class VersionMessage:
+    """version消息"""
+    def __init__(self, node_id: int, best_height: int):
+        self.node_id = node_id
+        self.best_height = best_height
+
+    def serialize(self) -> bytes:
+        """序列化：节点ID、最新高度加1(空区块链的高度为-1)，均为变长整数"""
+        return write_varint(self.node_id) + write_varint(self.best_height + 1)
+
+    @staticmethod
+    def deserialize(data: bytes) -> 'VersionMessage':
+        """反序列化"""
+        stream = BytesIO(data)
+        node_id = read_varint(stream)
+        best_height = read_varint(stream) - 1
+        return VersionMessage(node_id=node_id, best_height=best_height)
+    
+
+def create_and_start_node(node_id: int, network: Network, dir: str, verify_workers: int=None, snapshot_sync: bool=False):
+    """模拟比特币网络"""
+    node = Node(node_id=node_id, network=network, dir=dir, verify_workers=verify_workers, snapshot_sync=snapshot_sync)  # 确保传递正确的整数值
+    # 注册节点到网络
+    network.register_node(node)
+    # 启动节点
+    node.start()
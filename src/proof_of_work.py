@@ -1,29 +1,105 @@
-from block_header import BlockHeader
-
-def pow(header: BlockHeader) -> tuple:
-    """工作量证明"""
-    target_bits = header.target_bits
-    target = 2 ** (256 - target_bits)
-    nonce = 0
-    hash_result = ''
-    while True:
-        header.nonce = nonce
-        hash_result = header.hash()
-        actual = int(hash_result, 16)
-        print(f'\rblock_hash:{hash_result}', end="")
-        if actual < target:
-           break
-        nonce += 1
-    print("")
-    return (hash_result, nonce)
-
-def verify_pow(header: BlockHeader) -> bool:
-    """验证工作量证明"""
-    target_bits = header.target_bits
-    target = 2 ** (256 - target_bits)
-    hash_result = header.hash()
-    actual = int(hash_result, 16)
-    if actual < target:
-        return True
-    else:
-        return False
+import os
+import queue
+import struct
+from hashlib import sha256
+from block_header import BlockHeader, NONCE_FORMAT
+from utils import get_mp_context
+
+NONCE_CHUNK = 1 << 14   #每个工作进程一次领取的nonce数量
+PARALLEL_MIN_BITS = 16  #难度低于该值时直接单进程挖矿，避免进程启动开销
+RESULT_POLL_INTERVAL = 0.5  #等待挖矿结果时检查工作进程是否存活的间隔(秒)
+TARGET_BITS = 10    #区块要求的难度，难度低于该值的区块头无效
+
+def pow(header: BlockHeader, workers: int=None) -> tuple:
+    """工作量证明"""
+    if workers == None:
+        workers = os.cpu_count() or 1
+    prefix = header.serialize_prefix()
+    if workers <= 1 or header.target_bits < PARALLEL_MIN_BITS:
+        hash_result, nonce = search_nonce(prefix=prefix, target_bits=header.target_bits, start=0, step=1)
+    else:
+        hash_result, nonce = parallel_pow(prefix=prefix, target_bits=header.target_bits, workers=workers)
+    header.nonce = nonce
+    print(f'block_hash:{hash_result}')
+    return (hash_result, nonce)
+
+def search_nonce(prefix: bytes, target_bits: int, start: int, step: int, stop_event=None) -> tuple:
+    """从第start个nonce块开始每隔step块搜索一次，找到满足难度的哈希后返回(hash, nonce)"""
+    target = 2 ** (256 - target_bits)
+    #区块头前缀的哈希中间状态只计算一次，每次尝试只需追加nonce
+    midstate = sha256(prefix)
+    pack_nonce = struct.Struct(NONCE_FORMAT).pack
+    chunk_start = start * NONCE_CHUNK
+    while stop_event == None or not stop_event.is_set():
+        for nonce in range(chunk_start, chunk_start + NONCE_CHUNK):
+            h = midstate.copy()
+            h.update(pack_nonce(nonce))
+            digest = sha256(h.digest()).digest()
+            if int.from_bytes(digest, 'big') < target:
+                return (digest.hex(), nonce)
+        chunk_start += step * NONCE_CHUNK
+    return None
+
+def _pow_worker(prefix: bytes, target_bits: int, start: int, step: int, stop_event, result_queue):
+    """挖矿工作进程"""
+    result = search_nonce(prefix=prefix, target_bits=target_bits, start=start, step=step, stop_event=stop_event)
+    if result != None:
+        stop_event.set()
+        result_queue.put(result)
+
+def parallel_pow(prefix: bytes, target_bits: int, workers: int) -> tuple:
+    """多进程工作量证明，将nonce空间按块交错分配给各个工作进程"""
+    ctx = get_mp_context()
+    stop_event = ctx.Event()
+    result_queue = ctx.Queue()
+    processes = []
+    for i in range(0, workers):
+        p = ctx.Process(target=_pow_worker, args=(prefix, target_bits, i, workers, stop_event, result_queue), daemon=True)
+        p.start()
+        processes.append(p)
+    try:
+        result = wait_pow_result(result_queue=result_queue, processes=processes)
+    finally:
+        #任一进程找到结果后通知其余进程停止
+        stop_event.set()
+        for p in processes:
+            p.join(timeout=1)
+            if p.is_alive():
+                p.terminate()
+    if result == None:
+        print('挖矿工作进程全部异常退出，改为单进程挖矿')
+        result = search_nonce(prefix=prefix, target_bits=target_bits, start=0, step=1)
+    return result
+
+def wait_pow_result(result_queue, processes: list) -> tuple:
+    """等待工作进程的挖矿结果，工作进程全部退出且没有结果时返回None"""
+    while True:
+        try:
+            return result_queue.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            if any(p.is_alive() for p in processes):
+                continue
+        #工作进程退出前可能刚放入结果
+        try:
+            return result_queue.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            return None
+
+def verify_pow(header: BlockHeader) -> bool:
+    """验证工作量证明"""
+    target_bits = header.target_bits
+    target = 2 ** (256 - target_bits)
+    hash_result = header.hash()
+    actual = int(hash_result, 16)
+    if actual < target:
+        return True
+    else:
+        return False
+
+def verify_header_pow(header: BlockHeader) -> bool:
+    """验证区块头的难度不低于要求，并满足工作量证明"""
+    return header.target_bits >= TARGET_BITS and verify_pow(header=header)
+
+def get_work(header: BlockHeader) -> int:
+    """区块头代表的工作量，即满足难度目标平均需要尝试的哈希次数"""
+    return 2 ** header.target_bits
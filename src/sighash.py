@@ -0,0 +1,35 @@
+from hashlib import sha256
+from bitcoin_script import encode_script
+from encoding import write_varint, write_var_bytes, write_encoding_version
+
+class SigHasher:
+    """交易签名哈希计算器
+
+    各输入共用的部分(版本号、锁定时间、全部输入的输出点、全部输出)只序列化和哈希一次，
+    每个输入的签名哈希在共用部分的哈希中间状态上追加该输入的输出点和公钥得到，
+    对n个输入的交易签名或验证的总开销为O(n)。
+    """
+    def __init__(self, tx):
+        self.inputs = tx.inputs
+        hash_prevouts = sha256(sha256(b''.join(self.outpoint(i) for i in range(0, len(tx.inputs)))).digest()).digest()
+        hash_outputs = sha256(sha256(b''.join(tx_output.serialize() for tx_output in tx.outputs)).digest()).digest()
+        common = b''.join([write_encoding_version(),
+                           write_varint(tx.version),
+                           write_varint(tx.vin_sz),
+                           write_varint(tx.vout_sz),
+                           write_varint(tx.lock_time),
+                           hash_prevouts,
+                           hash_outputs])
+        self.midstate = sha256(common)
+
+    def outpoint(self, index: int) -> bytes:
+        """第index个输入花费的输出点"""
+        tx_input = self.inputs[index]
+        return bytes.fromhex(tx_input.tx_id) + write_varint(tx_input.index)
+
+    def sighash(self, index: int, pubkey: str) -> str:
+        """第index个输入的签名哈希，pubkey为该输入的公钥"""
+        h = self.midstate.copy()
+        h.update(self.outpoint(index))
+        h.update(write_var_bytes(encode_script(pubkey)))
+        return sha256(h.digest()).hexdigest()
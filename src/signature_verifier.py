@@ -0,0 +1,123 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait, BrokenExecutor
+from typing import Dict, List
+from bitcoin_script import verify_signature, sig_cache
+from utils import get_mp_context
+
+MIN_PARALLEL_CHECKS = 16    #签名数量少于该值时直接在当前线程验证
+BATCHES_PER_WORKER = 4      #每个工作进程分到的批次数，批次越多失败时越早停止
+
+def check_signature_batch(checks: List[tuple]) -> bool:
+    """验证一批签名，遇到第一个无效签名即返回False"""
+    for tx_hash, pubkey, sig in checks:
+        if not verify_signature(sig=sig, pubkey=pubkey, tx_hash=tx_hash):
+            return False
+    return True
+
+class SignatureVerifier:
+    """签名验证进程池"""
+    def __init__(self, workers: int=None):
+        if workers == None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.executor: ProcessPoolExecutor = None
+        self.lock = threading.Lock()    #多个节点线程共用同一个验证器，进程池在锁内创建和替换
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """第一次使用时创建进程池"""
+        with self.lock:
+            if self.executor == None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_mp_context())
+            return self.executor
+
+    def discard_executor(self, executor: ProcessPoolExecutor):
+        """丢弃出错的进程池，下次使用时重新创建"""
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+        print("签名验证进程池出错，重新创建进程池")
+        executor.shutdown(wait=False)
+
+    def verify(self, checks: List[tuple]) -> bool:
+        """验证一组(tx_hash, pubkey, sig)签名，全部有效时返回True"""
+        #已在签名缓存中的签名不再验证
+        checks = [check for check in checks if not sig_cache.contains(*check)]
+        if self.verify_uncached(checks):
+            for check in checks:
+                sig_cache.add(*check)
+            return True
+        return False
+
+    def verify_uncached(self, checks: List[tuple]) -> bool:
+        """验证一组不在缓存中的签名"""
+        if self.workers <= 1 or len(checks) < MIN_PARALLEL_CHECKS:
+            return check_signature_batch(checks)
+        batch_size = -(-len(checks) // (self.workers * BATCHES_PER_WORKER))
+        executor = self.get_executor()
+        try:
+            pending = {executor.submit(check_signature_batch, checks[i:i + batch_size]) for i in range(0, len(checks), batch_size)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                if not all(future.result() for future in done):
+                    #出现无效签名后取消尚未开始的批次
+                    for future in pending:
+                        future.cancel()
+                    return False
+            return True
+        except RuntimeError:
+            #工作进程异常退出(BrokenProcessPool)或进程池已被其他线程丢弃，这一组签名改在当前线程验证
+            self.discard_executor(executor)
+            return check_signature_batch(checks)
+
+    def submit(self, checks: List[tuple]) -> Future:
+        """异步验证一组签名，返回结果为bool的Future，验证通过的签名加入缓存"""
+        checks = [check for check in checks if not sig_cache.contains(*check)]
+        if self.workers <= 1 or len(checks) == 0:
+            future = Future()
+            future.set_result(check_signature_batch(checks))
+        else:
+            executor = self.get_executor()
+            try:
+                future = executor.submit(check_signature_batch, checks)
+                future.add_done_callback(lambda f: self.check_executor(executor=executor, future=f))
+            except RuntimeError:
+                self.discard_executor(executor)
+                future = Future()
+                future.set_result(check_signature_batch(checks))
+        future.add_done_callback(lambda f: self.cache_result(checks=checks, future=f))
+        return future
+
+    def check_executor(self, executor: ProcessPoolExecutor, future: Future):
+        """异步验证因进程池出错而失败时丢弃该进程池"""
+        if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+            self.discard_executor(executor)
+
+    @staticmethod
+    def cache_result(checks: List[tuple], future: Future):
+        """异步验证通过后把签名加入缓存"""
+        if not future.cancelled() and future.exception() == None and future.result():
+            for check in checks:
+                sig_cache.add(*check)
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor != None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+shared_verifiers: Dict[int, SignatureVerifier] = {}    #工作进程数 -> 同一进程中的节点共用的签名验证进程池
+shared_verifiers_lock = threading.Lock()
+
+def get_shared_verifier(workers: int=None) -> SignatureVerifier:
+    """获取同一进程中各节点共用的签名验证进程池，避免每个节点各自启动一组工作进程"""
+    if workers == None:
+        workers = os.cpu_count() or 1
+    with shared_verifiers_lock:
+        verifier = shared_verifiers.get(workers)
+        if verifier == None:
+            verifier = SignatureVerifier(workers=workers)
+            shared_verifiers[workers] = verifier
+        return verifier
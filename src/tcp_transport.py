@@ -0,0 +1,201 @@
+import atexit
+import json
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+from io import BytesIO
+from typing import Dict, List
+from encoding import read_exact, write_var_bytes, read_var_bytes
+from node import Network, Node, CLI_NODE_ID
+
+FRAME_HEADER = struct.Struct('>I')  #帧头：4字节大端序的负载长度
+MAX_FRAME_SIZE = 32 * 1024 * 1024   #单个帧的最大负载长度(字节)
+CONNECT_RETRIES = 50                #连接对端失败时的重试次数
+CONNECT_RETRY_INTERVAL = 0.1        #两次重试之间的间隔(秒)
+BASE_PORT = 18440                   #多进程模式下节点监听端口的起始值
+
+#消息数据的类型标记
+DATA_BYTES = 0
+DATA_STR = 1
+DATA_JSON = 2
+
+def encode_message(sender_id: int, message_type: str, data) -> bytes:
+    """把一条消息编码为字节：发送节点ID、消息类型、带类型标记的数据"""
+    if isinstance(data, (bytes, bytearray)):
+        tag, body = DATA_BYTES, bytes(data)
+    elif isinstance(data, str):
+        tag, body = DATA_STR, data.encode()
+    else:
+        #命令行参数、应答等简单数据，不能JSON编码的对象会抛出TypeError
+        tag, body = DATA_JSON, json.dumps(data).encode()
+    return struct.pack('>IB', sender_id, tag) + write_var_bytes(message_type.encode()) + body
+
+def decode_message(payload: bytes) -> tuple:
+    """解码一条消息，返回(发送节点ID, 消息类型, 数据)"""
+    stream = BytesIO(payload)
+    sender_id, tag = struct.unpack('>IB', read_exact(stream, 5))
+    message_type = read_var_bytes(stream).decode()
+    body = stream.read()
+    if tag == DATA_BYTES:
+        data = body
+    elif tag == DATA_STR:
+        data = body.decode()
+    else:
+        data = json.loads(body)
+    return (sender_id, message_type, data)
+
+def write_frame(sock: socket.socket, payload: bytes):
+    """发送一个带长度前缀的帧"""
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+def recv_exact(sock: socket.socket, n: int) -> bytes:
+    """从套接字读取n个字节，连接关闭时返回None"""
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+def read_frame(sock: socket.socket) -> bytes:
+    """读取一个帧的负载，连接关闭时返回None"""
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header == None:
+        return None
+    length = FRAME_HEADER.unpack(header)[0]
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"帧长度超出上限: {length}")
+    return recv_exact(sock, length)
+
+class TcpNetwork(Network):
+    """本机TCP传输，每个进程运行一个节点(或命令行)，消息以带长度前缀的字节帧发送"""
+    def __init__(self, node_id: int, address_book: Dict[int, tuple], dirs: Dict[str, int]=None):
+        super().__init__()
+        self.node_id = node_id              #本进程中运行的节点ID
+        self.address_book = address_book    #节点ID -> (主机, 端口)
+        self.mp = dict(dirs) if dirs != None else {}
+        self.connections: Dict[int, socket.socket] = {}
+        self.connection_locks: Dict[int, threading.Lock] = {}
+        self.server: socket.socket = None
+
+    def listen(self):
+        """开始监听本节点的端口"""
+        self.server = socket.create_server(self.address_book[self.node_id])
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        """接受对端连接，每个连接一个读取线程"""
+        while True:
+            sock, addr = self.server.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.read_loop, args=(sock,), daemon=True).start()
+
+    def read_loop(self, sock: socket.socket):
+        """从一个连接读取消息并放入本节点的收件箱"""
+        inbox = self.messages[self.node_id]
+        with sock:
+            while True:
+                try:
+                    payload = read_frame(sock)
+                except (ValueError, OSError) as e:
+                    #帧长度非法时无法再找到下一帧的边界，关闭这个连接
+                    print(f"节点 {self.node_id} 关闭了一个出错的连接: {e}")
+                    return
+                if payload == None:
+                    return
+                try:
+                    message = decode_message(payload)
+                except (ValueError, struct.error) as e:
+                    #帧边界仍然完整，丢弃这一帧继续读取
+                    print(f"节点 {self.node_id} 丢弃了一个无法解码的帧: {e}")
+                    continue
+                inbox.put(message)
+
+    def register_node(self, node):
+        """注册本进程中的节点"""
+        super().register_node(node)
+        self.mp[node.dir] = node.node_id
+
+    def connect(self, to_node_id: int) -> socket.socket:
+        """获取到对端的连接，对端尚未启动时重试"""
+        sock = self.connections.get(to_node_id)
+        if sock != None:
+            return sock
+        for _ in range(0, CONNECT_RETRIES):
+            try:
+                sock = socket.create_connection(self.address_book[to_node_id])
+                break
+            except ConnectionRefusedError:
+                time.sleep(CONNECT_RETRY_INTERVAL)
+        else:
+            raise ConnectionRefusedError(f"无法连接节点 {to_node_id}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections[to_node_id] = sock
+        return sock
+
+    def deliver(self, sender_id: int, to_node_id: int, message_type: str, data):
+        """投递消息，发给本进程节点的消息直接放入收件箱，其余编码后通过TCP发送"""
+        if to_node_id == self.node_id:
+            self.messages[to_node_id].put((sender_id, message_type, data))
+            return
+        try:
+            payload = encode_message(sender_id, message_type, data)
+        except TypeError:
+            print(f"消息 {message_type} 的数据无法编码为字节，未发送")
+            return
+        with self.lock:
+            lock = self.connection_locks.setdefault(to_node_id, threading.Lock())
+        with lock:
+            try:
+                write_frame(self.connect(to_node_id), payload)
+            except OSError:
+                #连接已断开时重连一次
+                sock = self.connections.pop(to_node_id, None)
+                if sock != None:
+                    sock.close()
+                try:
+                    write_frame(self.connect(to_node_id), payload)
+                except OSError as e:
+                    print(f"向节点 {to_node_id} 发送消息失败: {e}")
+
+    def get_peers(self, node_id: int) -> list:
+        """节点的相邻节点，即地址簿中除自己和命令行外的所有节点"""
+        return [peer_id for peer_id in self.address_book if peer_id != node_id and peer_id != CLI_NODE_ID]
+
+def create_address_book(node_ids: List[int], host: str='127.0.0.1', base_port: int=BASE_PORT) -> Dict[int, tuple]:
+    """为节点和命令行分配本机端口"""
+    address_book = {node_id: (host, base_port + i) for i, node_id in enumerate(node_ids)}
+    address_book[CLI_NODE_ID] = (host, base_port + len(node_ids))
+    return address_book
+
+def run_tcp_node(node_id: int, dir: str, address_book: Dict[int, tuple], verify_workers: int=None):
+    """节点进程入口"""
+    network = TcpNetwork(node_id=node_id, address_book=address_book)
+    node = Node(node_id=node_id, network=network, dir=dir, verify_workers=verify_workers)
+    network.register_node(node)
+    network.listen()
+    node.run()
+
+def start_tcp_nodes(nodes: List[tuple], host: str='127.0.0.1', base_port: int=BASE_PORT) -> TcpNetwork:
+    """每个(node_id, dir)启动一个节点进程，返回命令行使用的网络"""
+    address_book = create_address_book(node_ids=[node_id for node_id, dir in nodes], host=host, base_port=base_port)
+    #节点进程中还要创建挖矿和签名验证子进程，因此不能是守护进程，由退出处理函数负责结束
+    ctx = multiprocessing.get_context('fork')
+    processes = [ctx.Process(target=run_tcp_node, args=(node_id, dir, address_book)) for node_id, dir in nodes]
+    for p in processes:
+        p.start()
+    atexit.register(stop_processes, processes)
+    network = TcpNetwork(node_id=CLI_NODE_ID, address_book=address_book, dirs={dir: node_id for node_id, dir in nodes})
+    network.listen()
+    return network
+
+def stop_processes(processes: List[multiprocessing.Process]):
+    """结束节点进程"""
+    for p in processes:
+        p.kill()
+    for p in processes:
+        p.join(timeout=1)
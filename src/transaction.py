@@ -1,165 +1,236 @@
-from hashlib import sha256
-import json
-import pickle
-from typing import List
-from ecdsa import SigningKey, SECP256k1
-from bitcoin_script import get_script_pubkey, get_script_sig, execute_script
-from transaction_input import TransactionInput
-from transaction_output import TransactionOutput
-from coinbase_input import CoinbaseInput
-from wallet import Wallet
-from utxo import UTXOSet, UTXO
-from utils import get_pubkhash_from_address
-from copy import deepcopy
-from reward import get_coinbase_reward
-
-class Transaction:
-    '''比特币交易类'''
-    def __init__(self, version: int, vin_sz: int, vout_sz: int, lock_time: int, inputs, outputs: List[TransactionOutput]):
-        self.version = version  #版本
-        self.vin_sz = vin_sz    #交易输入列表中交易数量
-        self.vout_sz = vout_sz  #交易输出列表中交易数量
-        self.lock_time = lock_time  #交易锁定时间
-        self.inputs = inputs  #输入列表
-        self.outputs = outputs  #输出列表   
-
-    def to_dict(self) -> dict:
-        """转换为字典格式"""
-        return {
-            "version": self.version,
-            "vin_sz": self.vin_sz,
-            "vout_sz": self.vout_sz,
-            "lock_time": self.lock_time,
-            "inputs": [tx_input.to_dict() for tx_input in self.inputs],
-            "outputs": [tx_output.to_dict() for tx_output in self.outputs]
-        }
-
-    def to_json(self) -> str:
-        """转换为 JSON 字符串"""
-        return json.dumps(self.to_dict(), indent=4)
-    
-    def serialize(self) -> bytes:
-         """交易序列化"""
-         return pickle.dumps(self)
-
-    def is_coinbase(self) -> bool:
-        """该交易是否是创币交易"""
-        return type(self.inputs[0]) == CoinbaseInput
-    
-    def trimmed_copy(self) -> 'Transaction':
-        """返回该交易修剪之后的复制实例"""
-        inputs = []
-        for tx_input in self.inputs:
-            inputs.append(TransactionInput(tx_id=tx_input.tx_id, index=tx_input.index, script_sig=None))
-        return Transaction(version=self.version, vin_sz=self.vin_sz, vout_sz=self.vout_sz, lock_time=self.lock_time, inputs=inputs, outputs=self.outputs)
-    
-    def hash(self) -> str:
-        """计算交易哈希"""
-        tx_hash = sha256(self.serialize()).hexdigest()
-        return sha256(bytes.fromhex(tx_hash)).hexdigest()
-
-    def sign(self,  private_key: str):
-        """签名"""
-        if self.is_coinbase():
-            return
-        tx_copy = self.trimmed_copy()
-        for i in range(0, len(tx_copy.inputs)):
-            tx_copy.inputs[i].script_sig = self.inputs[i].script_sig
-            tx_copy_id = tx_copy.hash()
-            sk = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
-            signature = sk.sign(bytes.fromhex(tx_copy_id)).hex()
-            self.inputs[i].script_sig = get_script_sig(sig=signature, pubkey=tx_copy.inputs[i].script_sig)
-            tx_copy.inputs[i].script_sig = None
-
-def create_transaction(send: Wallet, to: List[str], value: List[float], utxo_set: UTXOSet, version=1, lock_time=0, tx_fee=0.05) -> Transaction:
-    """创建一个普通交易"""
-    if Wallet == None or to == None or len(to) == 0:
-       print("交易创建出错")
-    send_address = send.get_address()
-    pubkey = send.pubkey.to_string().hex()
-    #如果发送者并没有明确后面的一些接收者应该接收的金额，value将默认复制最后一个金额
-    while len(value) < len(to):
-        value.append(value[-1])
-    utxos_value_sum, utxos = utxo_set.find_utxo_by_address(address=send_address, value=sum(value)+tx_fee)
-    inputs = []
-    for tx_id, index in utxos:
-        tx_in = TransactionInput(tx_id=tx_id, index=index, script_sig=pubkey)
-        inputs.append(tx_in)
-    if not inputs:  # 检查inputs是否为空
-        raise ValueError("没有足够的UTXO来创建交易")
-    outputs = []
-    for i in range(0, len(value)):
-        pubkey_hash = get_pubkhash_from_address(address=to[i])
-        script_pubkey = get_script_pubkey(pubk_hash=pubkey_hash)
-        tx_out = TransactionOutput(value=value[i], script_pubkey=script_pubkey)
-        outputs.append(tx_out)
-    #找零
-    if utxos_value_sum > sum(value)+tx_fee:
-        change_value = utxos_value_sum - sum(value) - tx_fee
-        change_pubkhash = get_pubkhash_from_address(address=send_address)
-        change_script_pubkey = get_script_pubkey(pubk_hash=change_pubkhash)
-        change_tx_out = TransactionOutput(value=change_value, script_pubkey=change_script_pubkey)
-        outputs.append(change_tx_out)
-    tx = Transaction(version = version,
-                     vin_sz=len(inputs),
-                     vout_sz=len(outputs),
-                     lock_time=lock_time,
-                     inputs=inputs,
-                     outputs=outputs)
-    tx.sign(private_key=send.sigkey.to_string().hex())
-    return tx
-
-def create_coinbase_transaction(block_height: int, coinbase_str: str, to: str, tx_fee: float=0) -> Transaction:
-    """创建一个铸币交易"""
-    coinbase = CoinbaseInput(block_height=block_height, coinbase_str=coinbase_str)
-    pubkhash = get_pubkhash_from_address(address=to)
-    script_pubkey = get_script_pubkey(pubk_hash=pubkhash)
-    value = get_coinbase_reward(block_height=block_height) + tx_fee
-    output = TransactionOutput(value=value, script_pubkey=script_pubkey)
-    outputs = [output]
-    coinbase_tx = Transaction(version=1,
-                              vin_sz=0,
-                              vout_sz=1,
-                              lock_time=0,
-                              inputs=[coinbase],
-                              outputs=outputs
-                              )
-    return coinbase_tx
-
-def verify_transaction(tx: Transaction, utxo_set: UTXOSet) -> bool:
-    '''验证交易'''
-    if tx.is_coinbase():
-        return True
-    is_valid = True
-    utxos = utxo_set.find_utxo_by_vin(vin=tx.inputs)
-    tx_copy = tx.trimmed_copy()
-    for i in range(0, len(utxos)):
-        if utxos[i] == None:
-            return False
-        tx_copy.inputs[i].script_sig = tx.inputs[i].script_sig.split(' ')[1]
-        is_valid = is_valid and execute_script(script_sig=tx.inputs[i].script_sig, script_pubkey=utxos[i].script_pubkey, tx_hash=tx_copy.hash())
-        tx_copy.inputs[i].script_sig = None
-    input_value = 0
-    for utxo in utxos:
-        input_value += utxo.value
-    output_value = 0
-    for tx_out in tx.outputs:
-        output_value += tx_out.value
-    is_valid = is_valid and (input_value >= output_value)
-    return is_valid
-    
-def deserialize_transaction(data: bytes) -> Transaction:
-    """反序列化为交易实例"""
-    return pickle.loads(data)
-
-def comfirm_tx(utxo_set: UTXOSet, transactions: List[str]):
-    """确认交易"""
-    for tx in transactions:
-        tx = deserialize_transaction(bytes.fromhex(tx))
-        utxo = UTXO(tx_id=tx.hash(), vout=deepcopy(tx.outputs))
-        utxo_set.add_utxo(utxo=utxo)
-        if not tx.is_coinbase():
-            utxo_set.remove_utxo_by_vin(vin=tx.inputs)
-
-
-
+from hashlib import sha256
+from collections import OrderedDict
+from io import BytesIO
+import json
+import threading
+from typing import List
+from ecdsa import SigningKey, SECP256k1
+from bitcoin_script import get_script_pubkey, get_script_sig, execute_script
+from transaction_input import TransactionInput, read_transaction_input
+from transaction_output import TransactionOutput, read_transaction_output
+from coinbase_input import CoinbaseInput
+from sighash import SigHasher
+from wallet import Wallet
+from utxo import UTXOSet, UTXO
+from utils import get_pubkhash_from_address
+from reward import get_coinbase_reward
+from encoding import write_varint, read_varint, write_encoding_version, read_encoding_version
+
+TX_CACHE_SIZE = 10000   #解码交易缓存的最大条目数
+
+class Transaction:
+    '''比特币交易类'''
+    def __init__(self, version: int, vin_sz: int, vout_sz: int, lock_time: int, inputs, outputs: List[TransactionOutput]):
+        self.version = version  #版本
+        self.vin_sz = vin_sz    #交易输入列表中交易数量
+        self.vout_sz = vout_sz  #交易输出列表中交易数量
+        self.lock_time = lock_time  #交易锁定时间
+        self.inputs = inputs  #输入列表
+        self.outputs = outputs  #输出列表   
+
+    def __setattr__(self, name, value):
+        #修改交易字段时使缓存的交易哈希失效
+        #输入输出列表保存为元组，其中的输入输出也不可修改，交易只能通过重新赋值字段改变
+        if name == 'inputs' or name == 'outputs':
+            value = tuple(value)
+        if name != '_tx_id':
+            self.__dict__['_tx_id'] = None
+        self.__dict__[name] = value
+
+    def to_dict(self) -> dict:
+        """转换为字典格式"""
+        return {
+            "version": self.version,
+            "vin_sz": self.vin_sz,
+            "vout_sz": self.vout_sz,
+            "lock_time": self.lock_time,
+            "inputs": [tx_input.to_dict() for tx_input in self.inputs],
+            "outputs": [tx_output.to_dict() for tx_output in self.outputs]
+        }
+
+    def to_json(self) -> str:
+        """转换为 JSON 字符串"""
+        return json.dumps(self.to_dict(), indent=4)
+    
+    def serialize(self) -> bytes:
+        """交易序列化为二进制：编码版本、版本号、输入输出数量、锁定时间、输入列表、输出列表"""
+        parts = [write_encoding_version(),
+                 write_varint(self.version),
+                 write_varint(self.vin_sz),
+                 write_varint(self.vout_sz),
+                 write_varint(self.lock_time),
+                 write_varint(len(self.inputs))]
+        parts += [tx_input.serialize() for tx_input in self.inputs]
+        parts.append(write_varint(len(self.outputs)))
+        parts += [tx_output.serialize() for tx_output in self.outputs]
+        return b''.join(parts)
+
+    def is_coinbase(self) -> bool:
+        """该交易是否是创币交易"""
+        return type(self.inputs[0]) == CoinbaseInput
+    
+    def hash(self) -> str:
+        """计算交易哈希，结果会被缓存直到交易被修改"""
+        if self._tx_id == None:
+            self._tx_id = sha256(sha256(self.serialize()).digest()).hexdigest()
+        return self._tx_id
+
+    def sign(self,  private_key: str):
+        """签名，签名前每个输入的解锁脚本中存放的是该输入的公钥"""
+        if self.is_coinbase():
+            return
+        sk = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
+        hasher = SigHasher(tx=self)
+        inputs = []
+        for i in range(0, len(self.inputs)):
+            tx_input = self.inputs[i]
+            pubkey = tx_input.script_sig
+            signature = sk.sign(bytes.fromhex(hasher.sighash(index=i, pubkey=pubkey))).hex()
+            inputs.append(TransactionInput(tx_id=tx_input.tx_id, index=tx_input.index, script_sig=get_script_sig(sig=signature, pubkey=pubkey)))
+        #重新赋值输入列表，缓存的交易哈希随之失效
+        self.inputs = inputs
+
+def create_transaction(send: Wallet, to: List[str], value: List[float], utxo_set: UTXOSet, version=1, lock_time=0, tx_fee=0.05) -> Transaction:
+    """创建一个普通交易"""
+    if Wallet == None or to == None or len(to) == 0:
+       print("交易创建出错")
+    send_address = send.get_address()
+    pubkey = send.pubkey.to_string().hex()
+    #如果发送者并没有明确后面的一些接收者应该接收的金额，value将默认复制最后一个金额
+    while len(value) < len(to):
+        value.append(value[-1])
+    utxos_value_sum, utxos = utxo_set.find_utxo_by_address(address=send_address, value=sum(value)+tx_fee)
+    inputs = []
+    for tx_id, index in utxos:
+        tx_in = TransactionInput(tx_id=tx_id, index=index, script_sig=pubkey)
+        inputs.append(tx_in)
+    if not inputs:  # 检查inputs是否为空
+        raise ValueError("没有足够的UTXO来创建交易")
+    outputs = []
+    for i in range(0, len(value)):
+        pubkey_hash = get_pubkhash_from_address(address=to[i])
+        script_pubkey = get_script_pubkey(pubk_hash=pubkey_hash)
+        tx_out = TransactionOutput(value=value[i], script_pubkey=script_pubkey)
+        outputs.append(tx_out)
+    #找零
+    if utxos_value_sum > sum(value)+tx_fee:
+        change_value = utxos_value_sum - sum(value) - tx_fee
+        change_pubkhash = get_pubkhash_from_address(address=send_address)
+        change_script_pubkey = get_script_pubkey(pubk_hash=change_pubkhash)
+        change_tx_out = TransactionOutput(value=change_value, script_pubkey=change_script_pubkey)
+        outputs.append(change_tx_out)
+    tx = Transaction(version = version,
+                     vin_sz=len(inputs),
+                     vout_sz=len(outputs),
+                     lock_time=lock_time,
+                     inputs=inputs,
+                     outputs=outputs)
+    tx.sign(private_key=send.sigkey.to_string().hex())
+    return tx
+
+def create_coinbase_transaction(block_height: int, coinbase_str: str, to: str, tx_fee: float=0) -> Transaction:
+    """创建一个铸币交易"""
+    coinbase = CoinbaseInput(block_height=block_height, coinbase_str=coinbase_str)
+    pubkhash = get_pubkhash_from_address(address=to)
+    script_pubkey = get_script_pubkey(pubk_hash=pubkhash)
+    value = get_coinbase_reward(block_height=block_height) + tx_fee
+    output = TransactionOutput(value=value, script_pubkey=script_pubkey)
+    outputs = [output]
+    coinbase_tx = Transaction(version=1,
+                              vin_sz=0,
+                              vout_sz=1,
+                              lock_time=0,
+                              inputs=[coinbase],
+                              outputs=outputs
+                              )
+    return coinbase_tx
+
+def has_duplicate_inputs(tx: Transaction) -> bool:
+    """交易是否多次花费同一个输出点，这样的输入金额会被重复计算"""
+    return len(set((tx_in.tx_id, tx_in.index) for tx_in in tx.inputs)) != len(tx.inputs)
+
+def verify_transaction(tx: Transaction, utxo_set: UTXOSet, checks: list=None) -> bool:
+    '''验证交易，传入checks时签名验证被收集到checks中，由调用者统一验证'''
+    if tx.is_coinbase():
+        return True
+    if has_duplicate_inputs(tx=tx):
+        return False
+    is_valid = True
+    utxos = utxo_set.find_utxo_by_vin(vin=tx.inputs)
+    hasher = SigHasher(tx=tx)
+    for i in range(0, len(utxos)):
+        if utxos[i] == None:
+            return False
+        tx_hash = hasher.sighash(index=i, pubkey=tx.inputs[i].script_sig.split(' ')[1])
+        is_valid = is_valid and execute_script(script_sig=tx.inputs[i].script_sig, script_pubkey=utxos[i].script_pubkey, tx_hash=tx_hash, checks=checks)
+    input_value = 0
+    for utxo in utxos:
+        input_value += utxo.value
+    output_value = 0
+    for tx_out in tx.outputs:
+        output_value += tx_out.value
+    is_valid = is_valid and (input_value >= output_value)
+    return is_valid
+    
+def deserialize_transaction(data: bytes) -> Transaction:
+    """反序列化为交易实例，交易数据之后不能有多余的字节"""
+    stream = BytesIO(data)
+    tx = read_transaction(stream)
+    if stream.read(1):
+        raise ValueError("交易数据之后有多余的字节")
+    return tx
+
+def read_transaction(stream: BytesIO) -> Transaction:
+    """从流中解码一笔交易"""
+    read_encoding_version(stream)
+    version = read_varint(stream)
+    vin_sz = read_varint(stream)
+    vout_sz = read_varint(stream)
+    lock_time = read_varint(stream)
+    inputs = [read_transaction_input(stream) for _ in range(0, read_varint(stream))]
+    outputs = [read_transaction_output(stream) for _ in range(0, read_varint(stream))]
+    return Transaction(version=version, vin_sz=vin_sz, vout_sz=vout_sz, lock_time=lock_time, inputs=inputs, outputs=outputs)
+
+class TransactionCache:
+    """已解码交易的LRU缓存，以交易的十六进制序列化数据为键，缓存中的交易实例不应被修改"""
+    def __init__(self, max_size: int=TX_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.data: OrderedDict = OrderedDict()
+
+    def get(self, tx_hex: str) -> Transaction:
+        """获取解码后的交易，未命中时解码并放入缓存"""
+        with self.lock:
+            tx = self.data.get(tx_hex)
+            if tx != None:
+                self.data.move_to_end(tx_hex)
+                return tx
+        #交易ID由tx.hash()按规范编码重新计算，不使用收到的原始数据，同一交易的不同编码得到相同的交易ID
+        tx = deserialize_transaction(bytes.fromhex(tx_hex))
+        with self.lock:
+            self.data[tx_hex] = tx
+            if len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+        return tx
+
+tx_cache = TransactionCache()
+
+def decode_transaction(tx_hex: str) -> Transaction:
+    """通过缓存将十六进制序列化数据解码为交易实例"""
+    return tx_cache.get(tx_hex)
+
+def comfirm_tx(utxo_set: UTXOSet, transactions: List[str]):
+    """确认交易"""
+    height = 0
+    for tx in transactions:
+        tx = decode_transaction(tx)
+        if tx.is_coinbase():
+            height = tx.inputs[0].get_block_height()
+        #交易输出不可修改，不必复制
+        utxo = UTXO(tx_id=tx.hash(), vout=tx.outputs, height=height)
+        utxo_set.add_utxo(utxo=utxo)
+        if not tx.is_coinbase():
+            utxo_set.remove_utxo_by_vin(vin=tx.inputs)
+
+
+
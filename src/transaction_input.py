@@ -1,14 +1,38 @@
-class TransactionInput:
-    '''比特币交易输入类'''
-    def __init__(self, tx_id: str, index: int, script_sig: str):
-        self.tx_id = tx_id  #指向包含被花费的UTXO的交易的散列值
-        self.index = index  #被花费的UTXO的索引号
-        self.script_sig = script_sig #解锁脚本
-    
-    def to_dict(self) -> dict:
-        """转换为字典格式"""
-        return {
-            "tx_id": self.tx_id,
-            "index": self.index,
-            "script_sig": self.script_sig
-        }
+from io import BytesIO
+from bitcoin_script import encode_script, decode_script
+from coinbase_input import NULL_TX_ID, COINBASE_INDEX, coinbase_input_from_data
+from encoding import write_varint, read_varint, write_var_bytes, read_var_bytes, read_exact
+
+class TransactionInput:
+    '''比特币交易输入类'''
+    def __init__(self, tx_id: str, index: int, script_sig: str):
+        self.tx_id = tx_id  #指向包含被花费的UTXO的交易的散列值
+        self.index = index  #被花费的UTXO的索引号
+        self.script_sig = script_sig #解锁脚本
+
+    def __setattr__(self, name, value):
+        #输入创建后不可修改，否则所属交易缓存的交易哈希会过期，需要修改时创建新的输入
+        if name in self.__dict__:
+            raise AttributeError(f"交易输入创建后不可修改: {name}")
+        self.__dict__[name] = value
+    
+    def to_dict(self) -> dict:
+        """转换为字典格式"""
+        return {
+            "tx_id": self.tx_id,
+            "index": self.index,
+            "script_sig": self.script_sig
+        }
+
+    def serialize(self) -> bytes:
+        """二进制编码：前序交易ID、输出索引、解锁脚本"""
+        return bytes.fromhex(self.tx_id) + write_varint(self.index) + write_var_bytes(encode_script(self.script_sig))
+
+def read_transaction_input(stream: BytesIO):
+    """从流中解码一个交易输入，根据coinbase标记返回TransactionInput或CoinbaseInput"""
+    tx_id = read_exact(stream, 32).hex()
+    index = read_varint(stream)
+    script = read_var_bytes(stream)
+    if tx_id == NULL_TX_ID and index == COINBASE_INDEX:
+        return coinbase_input_from_data(coinbase=script.hex())
+    return TransactionInput(tx_id=tx_id, index=index, script_sig=decode_script(script))
@@ -1,12 +1,32 @@
-class TransactionOutput:
-    '''比特币交易输出类'''
-    def __init__(self, value: float, script_pubkey: str):
-        self.value = value #输出的比特币额
-        self.script_pubkey = script_pubkey #锁定脚本
-
-    def to_dict(self) -> dict:
-        """转换为字典格式"""
-        return {
-            "value": self.value,
-            "script_pubkey": self.script_pubkey
-        }
\ No newline at end of file
+from io import BytesIO
+from bitcoin_script import encode_script, decode_script
+from encoding import write_double, read_double, write_var_bytes, read_var_bytes
+
+class TransactionOutput:
+    '''比特币交易输出类'''
+    def __init__(self, value: float, script_pubkey: str):
+        self.value = value #输出的比特币额
+        self.script_pubkey = script_pubkey #锁定脚本
+
+    def __setattr__(self, name, value):
+        #输出创建后不可修改，否则所属交易缓存的交易哈希会过期，需要修改时创建新的输出
+        if name in self.__dict__:
+            raise AttributeError(f"交易输出创建后不可修改: {name}")
+        self.__dict__[name] = value
+
+    def to_dict(self) -> dict:
+        """转换为字典格式"""
+        return {
+            "value": self.value,
+            "script_pubkey": self.script_pubkey
+        }
+
+    def serialize(self) -> bytes:
+        """二进制编码：金额、锁定脚本"""
+        return write_double(self.value) + write_var_bytes(encode_script(self.script_pubkey))
+
+def read_transaction_output(stream: BytesIO) -> TransactionOutput:
+    """从流中解码一个交易输出"""
+    value = read_double(stream)
+    script_pubkey = decode_script(read_var_bytes(stream))
+    return TransactionOutput(value=value, script_pubkey=script_pubkey)
@@ -0,0 +1,130 @@
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List
+from memory_pool import MemmoryPool
+from signature_verifier import SignatureVerifier
+from transaction import Transaction, verify_transaction
+
+MAX_ORPHANS = 100   #孤儿交易池最多保留的交易数量
+
+class OrphanPool:
+    """孤儿交易池，存放父交易尚未到达的交易，超出上限时淘汰最早加入的交易"""
+    def __init__(self, max_size: int=MAX_ORPHANS):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()   #交易ID -> (交易, 缺失的父交易ID)
+        self.by_parent: Dict[str, set] = {}         #缺失的父交易ID -> 等待它的孤儿交易ID
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def contains(self, tx_id: str) -> bool:
+        """交易是否在孤儿交易池中"""
+        return tx_id in self.entries
+
+    def add(self, tx: Transaction, missing: set):
+        """加入一笔孤儿交易"""
+        tx_id = tx.hash()
+        if tx_id in self.entries:
+            return
+        self.entries[tx_id] = (tx, missing)
+        for parent_id in missing:
+            self.by_parent.setdefault(parent_id, set()).add(tx_id)
+        while len(self.entries) > self.max_size:
+            self.remove(tx_id=next(iter(self.entries)))
+
+    def remove(self, tx_id: str):
+        """移除一笔孤儿交易"""
+        tx, missing = self.entries.pop(tx_id)
+        for parent_id in missing:
+            children = self.by_parent.get(parent_id)
+            children.discard(tx_id)
+            if len(children) == 0:
+                del self.by_parent[parent_id]
+
+    def pop_children(self, parent_id: str) -> List[Transaction]:
+        """父交易到达后取出等待它的孤儿交易"""
+        children = []
+        for tx_id in list(self.by_parent.get(parent_id, ())):
+            children.append(self.entries[tx_id][0])
+            self.remove(tx_id=tx_id)
+        return children
+
+class TxAdmission:
+    """交易准入流水线：签名交给进程池异步验证，结果由节点线程取回后加入交易池，缺少父交易的交易进入孤儿交易池"""
+    def __init__(self, mem_pool: MemmoryPool, verifier: SignatureVerifier, max_orphans: int=MAX_ORPHANS, on_result=None, on_reject=None):
+        self.mem_pool = mem_pool
+        self.verifier = verifier
+        self.orphans = OrphanPool(max_size=max_orphans)
+        self.pending = set()            #正在验证签名的交易ID
+        self.results = queue.Queue()    #(交易, 验证结果)，由验证进程池的回调线程放入
+        self.on_result = on_result      #放入验证结果后调用，用于唤醒节点线程
+        self.on_reject = on_reject      #on_reject(交易ID)，交易被确定拒绝时在节点线程中调用
+
+    def submit(self, tx: Transaction):
+        """提交一笔收到的交易，立即返回"""
+        tx_id = tx.hash()
+        if tx.is_coinbase():
+            self.reject(tx_id=tx_id)
+            return
+        if self.contains(tx_id):
+            return
+        with self.mem_pool.lock:
+            outputs = self.mem_pool.find_utxo_by_vin(vin=tx.inputs)
+            missing = {tx_in.tx_id for tx_in, output in zip(tx.inputs, outputs) if output == None}
+            if len(missing) > 0:
+                self.orphans.add(tx=tx, missing=missing)
+                return
+            #先完成脚本和金额检查，签名收集到checks中异步验证
+            checks = []
+            if not verify_transaction(tx=tx, utxo_set=self.mem_pool, checks=checks):
+                self.reject(tx_id=tx_id)
+                return
+        self.pending.add(tx_id)
+        future = self.verifier.submit(checks)
+        future.add_done_callback(lambda f: self.finish(tx=tx, future=f))
+
+    def finish(self, tx: Transaction, future: Future):
+        """签名验证完成的回调，把结果交回节点线程，验证没能完成时结果为None"""
+        self.results.put((tx, None if future.cancelled() or future.exception() != None else future.result()))
+        if self.on_result != None:
+            self.on_result()
+
+    def process_results(self) -> List[Transaction]:
+        """在节点线程中取回验证结果并加入交易池，返回本次被接受的交易"""
+        accepted = []
+        while True:
+            try:
+                tx, is_valid = self.results.get_nowait()
+            except queue.Empty:
+                break
+            tx_id = tx.hash()
+            self.pending.discard(tx_id)
+            if is_valid == None:
+                #验证进程池出错不代表交易无效，之后仍可以再次收到并验证
+                continue
+            if is_valid and self.mem_pool.add_tx(tx):
+                accepted.append(tx)
+                self.resubmit_orphans(parent_id=tx_id)
+            else:
+                self.reject(tx_id=tx_id)
+        return accepted
+
+    def contains(self, tx_id: str) -> bool:
+        """交易是否正在验证、在孤儿交易池或交易池中"""
+        return tx_id in self.pending or self.orphans.contains(tx_id) or self.mem_pool.contains(tx_id)
+
+    def reject(self, tx_id: str):
+        """交易被确定拒绝"""
+        if self.on_reject != None:
+            self.on_reject(tx_id)
+
+    def resubmit_orphans(self, parent_id: str):
+        """父交易到达后重新提交等待它的孤儿交易"""
+        for child in self.orphans.pop_children(parent_id=parent_id):
+            self.submit(child)
+
+    def block_connected(self, tx_ids: List[str]):
+        """区块连接后，父交易在区块中确认的孤儿交易重新提交"""
+        for tx_id in tx_ids:
+            self.resubmit_orphans(parent_id=tx_id)
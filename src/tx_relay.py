@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List
+from block_sync import encode_hashes, decode_hashes
+
+MAX_SEEN_TXS = 50000        #已见交易过滤器最多记录的交易ID数量
+INV_FLUSH_INTERVAL = 0.05   #交易公告的批量发送间隔(秒)
+MAX_INV_SIZE = 1000         #一条inv消息最多携带的交易ID数量
+TX_REQUEST_TIMEOUT = 2      #请求的交易超过这个时间(秒)未到达时，可以向其他节点请求
+
+class SeenFilter:
+    """有上限的已见集合，超出上限时淘汰最早加入的记录"""
+    def __init__(self, max_size: int=MAX_SEEN_TXS):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def contains(self, key: str) -> bool:
+        return key in self.entries
+
+    def add(self, key: str):
+        """加入一条记录，已存在时移到最新位置"""
+        self.entries[key] = None
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+class TxRelay:
+    """基于公告的交易转发：新交易只以交易ID批量公告，对端没有见过时才用gettxdata请求交易本身"""
+    def __init__(self, node_id: int, send, get_peers, has_tx=None, flush_interval: float=INV_FLUSH_INTERVAL, max_seen: int=MAX_SEEN_TXS):
+        self.node_id = node_id
+        self.send = send            #send(to_node_id, message_type, data)
+        self.get_peers = get_peers  #get_peers() -> 相邻节点ID列表
+        self.has_tx = has_tx        #has_tx(交易ID) -> 交易是否已收到、正在验证或在等待父交易，为None时只看已见集合
+        self.flush_interval = flush_interval
+        self.seen = SeenFilter(max_size=max_seen)   #已接受、已被拒绝、已公告或已在区块中确认的交易ID
+        self.requested: OrderedDict = OrderedDict() #已请求、尚未到达的交易ID -> (节点ID, 请求时间)，按请求时间排列
+        self.announcers: Dict[str, List[int]] = {}  #已请求的交易ID -> 也公告了它、尚未被请求的节点ID
+        self.pending: Dict[int, List[str]] = {}     #等待下次批量发送的公告：节点ID -> 交易ID列表
+        self.flush_at: float = None                 #下次批量发送的时间，没有待发送公告时为None
+
+    def announce(self, tx_id: str):
+        """公告一笔已接受的交易，在下次批量发送时发给所有相邻节点，已经见过它的节点不会再请求"""
+        self.seen.add(tx_id)
+        for peer_id in self.get_peers():
+            self.pending.setdefault(peer_id, []).append(tx_id)
+        if self.flush_at == None and self.pending:
+            self.flush_at = time.monotonic() + self.flush_interval
+
+    def get_flush_timeout(self) -> float:
+        """距离下次批量发送或最早的交易请求超时的时间，两者都没有时为None"""
+        deadlines = []
+        if self.flush_at != None:
+            deadlines.append(self.flush_at)
+        if self.requested:
+            deadlines.append(next(iter(self.requested.values()))[1] + TX_REQUEST_TIMEOUT)
+        if len(deadlines) == 0:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def maybe_flush(self):
+        """到达批量发送时间时发送公告，并改向其他节点请求超时未到达的交易"""
+        if self.flush_at != None and time.monotonic() >= self.flush_at:
+            self.flush()
+        else:
+            self.retry_requests()
+
+    def flush(self):
+        """把积累的公告按节点合并为inv消息发送，并改向其他节点请求超时未到达的交易"""
+        pending = self.pending
+        self.pending = {}
+        self.flush_at = None
+        for peer_id, tx_ids in pending.items():
+            self.send_hashes(peer_id=peer_id, message_type="inv", tx_ids=tx_ids)
+        self.retry_requests()
+
+    def retry_requests(self):
+        """请求超时的交易改向下一个公告了它的节点请求，没有其他公告者时放弃"""
+        now = time.monotonic()
+        expired = []
+        for tx_id, (peer_id, requested_at) in self.requested.items():
+            if now - requested_at < TX_REQUEST_TIMEOUT:
+                break
+            expired.append(tx_id)
+        retries: Dict[int, List[str]] = {}
+        for tx_id in expired:
+            del self.requested[tx_id]
+            announcers = self.announcers.pop(tx_id, None)
+            if announcers:
+                next_peer = announcers.pop(0)
+                if announcers:
+                    self.announcers[tx_id] = announcers
+                #重新请求的交易排到最后，请求时间仍然有序
+                self.requested[tx_id] = (next_peer, now)
+                retries.setdefault(next_peer, []).append(tx_id)
+        for peer_id, tx_ids in retries.items():
+            self.send_hashes(peer_id=peer_id, message_type="gettxdata", tx_ids=tx_ids)
+
+    def send_hashes(self, peer_id: int, message_type: str, tx_ids: List[str]):
+        """把交易ID列表分成多条消息发送，每条最多MAX_INV_SIZE个"""
+        for start in range(0, len(tx_ids), MAX_INV_SIZE):
+            self.send(peer_id, message_type, encode_hashes(tx_ids[start:start + MAX_INV_SIZE]))
+
+    def is_known(self, tx_id: str) -> bool:
+        """交易是否不必再请求"""
+        return self.seen.contains(tx_id) or (self.has_tx != None and self.has_tx(tx_id))
+
+    def handle_inv(self, peer_id: int, data: bytes):
+        """收到公告，只请求没有见过且没有在请求中的交易；已在请求中的交易记下公告者，请求超时后改向它请求"""
+        now = time.monotonic()
+        wanted = []
+        for tx_id in decode_hashes(data):
+            if self.is_known(tx_id):
+                continue
+            request = self.requested.get(tx_id)
+            if request != None:
+                if peer_id != request[0]:
+                    announcers = self.announcers.setdefault(tx_id, [])
+                    if peer_id not in announcers:
+                        announcers.append(peer_id)
+                continue
+            self.requested[tx_id] = (peer_id, now)
+            wanted.append(tx_id)
+        if wanted:
+            self.send(peer_id, "gettxdata", encode_hashes(wanted))
+
+    def handle_gettxdata(self, peer_id: int, data: bytes, get_tx):
+        """发送请求的交易，get_tx(交易ID)返回交易的十六进制编码，没有时返回None"""
+        for tx_id in decode_hashes(data):
+            tx_hex = get_tx(tx_id)
+            if tx_hex != None:
+                self.send(peer_id, "transaction", bytes.fromhex(tx_hex))
+
+    def receive_tx(self, tx_id: str) -> bool:
+        """收到一笔交易，返回是否需要验证；交易在验证接受或被拒绝后才记入已见集合，
+        验证期间到达的公告由has_tx过滤"""
+        self.requested.pop(tx_id, None)
+        self.announcers.pop(tx_id, None)
+        return not self.is_known(tx_id)
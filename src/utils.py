@@ -1,7 +1,14 @@
-import base58
-
-def get_pubkhash_from_address(address: str) -> str:
-    """根据比特币地址获取公钥哈希"""
-    address = base58.b58decode(address)
-    pubkhash = address[1:len(address)-4]
-    return pubkhash.hex()
+import multiprocessing
+import base58
+
+def get_pubkhash_from_address(address: str) -> str:
+    """根据比特币地址获取公钥哈希"""
+    address = base58.b58decode(address)
+    pubkhash = address[1:len(address)-4]
+    return pubkhash.hex()
+
+def get_mp_context():
+    """子进程的启动方式：节点所在进程中已有线程，fork会复制其他线程持有的锁，子进程可能死锁，因此使用forkserver，不支持时使用spawn"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
@@ -1,110 +1,275 @@
-from typing import List
-from utils import get_pubkhash_from_address
-from transaction_output import TransactionOutput
-from transaction_input import TransactionInput
-import pickle
-import pickledb
-
-class UTXO:
-    """未花费输出"""
-    def __init__(self, tx_id: str, vout: List[TransactionOutput]):
-        self.tx_id = tx_id
-        self.vout = vout
-    
-    def serialize(self) -> bytes:
-        return pickle.dumps(self)
-    
-    @staticmethod
-    def derserialize(data: bytes) -> 'UTXO':
-        return pickle.loads(data)
-
-class UTXOSet:
-    """UTXO集合"""
-    def __init__(self):
-        self.db: pickledb.PickleDB = None
-
-    def add_utxo(self, utxo: UTXO):
-        """向UTXO集合中添加一个UTXO"""
-        self.db.set(utxo.tx_id, utxo.serialize().hex())
-
-    def find_utxo_by_address(self, address: str, value: float) -> tuple:
-        """找到指定地址的足够的utxo"""
-        pubk_hash = get_pubkhash_from_address(address=address)
-        utxos = []
-        utxo_value_sum = 0
-        tx_id_list = self.db.getall()
-        for tx_id in tx_id_list:
-            utxo = UTXO.derserialize(bytes.fromhex(self.db.get(tx_id)))
-            for index, out in enumerate(utxo.vout):
-                if out == None:
-                    continue
-                l = out.script_pubkey.split(' ')
-                if pubk_hash == l[2]:
-                    utxo_value_sum += out.value
-                    utxos.append((utxo.tx_id, index))
-            if utxo_value_sum > value:
-                break
-        return (utxo_value_sum, utxos)
-    
-    def remove_utxo_by_vin(self, vin: List[TransactionInput]):
-        """从UTXO集合中移除utxo"""
-        tx_id_list = self.db.getall()
-        del_index = []
-        for tx_in in vin:
-            tx_id = tx_in.tx_id
-            index = tx_in.index
-            for tx_id_u in tx_id_list:  # 在复制的列表上进行迭代
-                if tx_id_u == tx_id:
-                    utxo = UTXO.derserialize(bytes.fromhex(self.db.get(tx_id)))
-                    utxo.vout[index] = None
-                    self.db.set(tx_id, utxo.serialize().hex())
-                    if all([x == None for x in utxo.vout]):
-                        del_index.append(tx_id)
-        for tx_id in del_index:
-            self.db.rem(tx_id)
-    
-    def find_utxo_by_vin(self, vin: List[TransactionInput]) -> List[TransactionOutput]:
-        """根据tx_in从UTXO集合中获取utxo"""
-        utxos = []
-        tx_id_list = self.db.getall()
-        for tx_in in vin:
-            tx_id = tx_in.tx_id
-            index = tx_in.index
-            for tx_id_u in tx_id_list:
-                if tx_id_u == tx_id:
-                    utxo = UTXO.derserialize(bytes.fromhex(self.db.get(tx_id)))
-                    utxos.append(utxo.vout[index])
-                    break
-        return utxos
-    
-    def get_balance_by_address(self, address: str) -> float:
-        """根据比特币地址从UTXO中找到余额"""
-        pubk_hash = get_pubkhash_from_address(address=address)
-        utxo_value_sum = 0
-        tx_id_list = self.db.getall()
-        for tx_id in tx_id_list:
-            utxo = UTXO.derserialize(bytes.fromhex(self.db.get(tx_id)))
-            for out in utxo.vout:
-                if out == None:
-                    continue
-                l = out.script_pubkey.split(' ')
-                if pubk_hash == l[2]:
-                    utxo_value_sum += out.value
-        return utxo_value_sum
-    
-    def update_utxo_set(self, utxo_set: 'UTXOSet'):
-        """更新UTXO集合"""
-        for tx_id in utxo_set.db.getall():
-            self.db.set(tx_id, utxo_set.db.get(tx_id))
-    
-    def serialize(self) -> bytes:
-        return pickle.dumps(self)
-    
-    @staticmethod
-    def deserialize(data: bytes) -> 'UTXOSet':
-        return pickle.loads(data)
-
-def load_utxo_set(dir: str) -> UTXOSet:
-    utxo_set = UTXOSet()
-    utxo_set.db = pickledb.load(dir, True)
-    return utxo_set
+from typing import List, Dict
+from collections import OrderedDict
+from utils import get_pubkhash_from_address
+from bitcoin_script import get_pubkhash_from_script_pubkey, get_script_pubkey, is_p2pkh_script_pubkey
+from transaction_output import TransactionOutput
+from transaction_input import TransactionInput
+import pickle
+import struct
+import pickledb
+from encoding import write_varint, read_varint, write_var_bytes, read_var_bytes, read_exact
+from journal import write_journal, load_journaled_db
+
+#coin记录的固定部分：金额、区块高度、锁定脚本类型
+COIN_FORMAT = '<dIB'
+COIN_SIZE = struct.calcsize(COIN_FORMAT)
+SCRIPT_P2PKH = 0    #标准P2PKH锁定脚本，只存储20字节公钥哈希
+SCRIPT_RAW = 1      #其他锁定脚本，按原文存储
+
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024   #coins缓存默认内存上限(字节)
+CACHE_ENTRY_OVERHEAD = 200              #缓存中每个条目除脚本外的估计内存开销(字节)
+
+class Coin(TransactionOutput):
+    """UTXO集合中的一个未花费输出，在交易输出的基础上记录了所在区块高度"""
+    def __init__(self, value: float, script_pubkey: str, height: int):
+        super().__init__(value=value, script_pubkey=script_pubkey)
+        self.height = height
+
+    def serialize(self) -> bytes:
+        """紧凑二进制编码"""
+        if is_p2pkh_script_pubkey(script_pubkey=self.script_pubkey):
+            script = bytes.fromhex(get_pubkhash_from_script_pubkey(script_pubkey=self.script_pubkey))
+            return struct.pack(COIN_FORMAT, self.value, self.height, SCRIPT_P2PKH) + script
+        return struct.pack(COIN_FORMAT, self.value, self.height, SCRIPT_RAW) + self.script_pubkey.encode()
+
+    @staticmethod
+    def deserialize(data: bytes) -> 'Coin':
+        value, height, script_type = struct.unpack(COIN_FORMAT, data[:COIN_SIZE])
+        if script_type == SCRIPT_P2PKH:
+            script_pubkey = get_script_pubkey(pubk_hash=data[COIN_SIZE:].hex())
+        else:
+            script_pubkey = data[COIN_SIZE:].decode()
+        return Coin(value=value, script_pubkey=script_pubkey, height=height)
+
+class UTXO:
+    """一笔交易产生的未花费输出"""
+    def __init__(self, tx_id: str, vout: List[TransactionOutput], height: int=0):
+        self.tx_id = tx_id
+        self.vout = vout
+        self.height = height
+
+def outpoint_key(tx_id: str, index: int) -> str:
+    """UTXO集合中一个输出的键"""
+    return f'{tx_id}:{index}'
+
+def parse_outpoint_key(key: str) -> tuple:
+    """从键中解析出(tx_id, index)"""
+    tx_id, index = key.split(':')
+    return (tx_id, int(index))
+
+def write_coin_record(tx_id: str, index: int, coin_data: bytes) -> bytes:
+    """一条coin记录的编码：交易ID、输出序号、coin编码"""
+    return bytes.fromhex(tx_id) + write_varint(index) + write_var_bytes(coin_data)
+
+def read_coin_record(stream) -> tuple:
+    """读取一条coin记录，返回(交易ID, 输出序号, Coin)"""
+    tx_id = read_exact(stream, 32).hex()
+    index = read_varint(stream)
+    return (tx_id, index, Coin.deserialize(read_var_bytes(stream)))
+
+class CoinsCache:
+    """UTXO集合前的写回缓存，按LRU淘汰干净条目，脏条目在每个区块连接后统一写回"""
+    def __init__(self, db: pickledb.PickleDB, journal: str, max_size: int=DEFAULT_CACHE_SIZE):
+        self.db = db
+        self.journal = journal  #写回日志文件路径
+        self.max_size = max_size
+        #干净条目按最近使用顺序排列，淘汰时从最久未使用的一端取出；脏条目单独存放，写回之前不能淘汰
+        self.clean: OrderedDict = OrderedDict()     #键 -> Coin
+        self.dirty: Dict[str, Coin] = {}            #键 -> Coin，None表示已花费
+        self.size = 0
+
+    @staticmethod
+    def entry_size(key: str, coin: Coin) -> int:
+        """估计一个缓存条目占用的内存"""
+        if coin == None:
+            return len(key) + CACHE_ENTRY_OVERHEAD
+        return len(key) + CACHE_ENTRY_OVERHEAD + len(coin.script_pubkey)
+
+    def put_dirty(self, key: str, coin: Coin):
+        """写入一个待写回的条目"""
+        if key in self.clean:
+            self.size -= self.entry_size(key, self.clean.pop(key))
+        elif key in self.dirty:
+            self.size -= self.entry_size(key, self.dirty[key])
+        self.dirty[key] = coin
+        self.size += self.entry_size(key, coin)
+        self.evict()
+
+    def get(self, key: str) -> Coin:
+        """读取一个未花费输出，缓存未命中时从数据库加载"""
+        if key in self.dirty:
+            return self.dirty[key]
+        if key in self.clean:
+            self.clean.move_to_end(key)
+            return self.clean[key]
+        if not self.db.exists(key):
+            return None
+        coin = Coin.deserialize(bytes.fromhex(self.db.get(key)))
+        self.clean[key] = coin
+        self.size += self.entry_size(key, coin)
+        self.evict()
+        return coin
+
+    def set(self, key: str, coin: Coin):
+        """添加一个未花费输出"""
+        self.put_dirty(key, coin)
+
+    def spend(self, key: str):
+        """花费一个输出"""
+        self.put_dirty(key, None)
+
+    def evict(self):
+        """超出内存上限时从最久未使用的一端淘汰干净条目，脏条目要等到写回之后才能淘汰"""
+        while self.size > self.max_size and self.clean:
+            key, coin = self.clean.popitem(last=False)
+            self.size -= self.entry_size(key, coin)
+
+    def flush(self):
+        """将脏条目写回数据库，并以追加日志的方式持久化"""
+        if len(self.dirty) == 0:
+            return
+        changes = {}
+        for key, coin in self.dirty.items():
+            if coin == None:
+                changes[key] = None
+                self.size -= self.entry_size(key, coin)
+            else:
+                changes[key] = coin.serialize().hex()
+                self.clean[key] = coin
+        self.dirty = {}
+        write_journal(db=self.db, journal=self.journal, changes=changes)
+        self.evict()
+
+class UTXOSet:
+    """UTXO集合"""
+    def __init__(self):
+        self.db: pickledb.PickleDB = None
+        self.cache: CoinsCache = None
+        #地址索引：公钥哈希 -> {(tx_id, index): value}
+        self.address_index: Dict[str, Dict[tuple, float]] = {}
+
+    def add_utxo(self, utxo: UTXO):
+        """向UTXO集合中添加一笔交易的全部输出"""
+        for index, out in enumerate(utxo.vout):
+            if out == None:
+                continue
+            coin = Coin(value=out.value, script_pubkey=out.script_pubkey, height=utxo.height)
+            self.add_coin(tx_id=utxo.tx_id, index=index, coin=coin)
+
+    def add_coin(self, tx_id: str, index: int, coin: Coin):
+        """向UTXO集合中添加一个输出"""
+        self.cache.set(outpoint_key(tx_id=tx_id, index=index), coin)
+        self.index_coin(tx_id=tx_id, index=index, coin=coin)
+
+    def get_coin(self, tx_id: str, index: int) -> Coin:
+        """根据输出点获取一个未花费输出，不存在时返回None"""
+        return self.cache.get(outpoint_key(tx_id=tx_id, index=index))
+
+    def index_coin(self, tx_id: str, index: int, coin: Coin):
+        """将一个未花费输出加入地址索引"""
+        if not is_p2pkh_script_pubkey(script_pubkey=coin.script_pubkey):
+            return
+        pubk_hash = get_pubkhash_from_script_pubkey(script_pubkey=coin.script_pubkey)
+        self.address_index.setdefault(pubk_hash, {})[(tx_id, index)] = coin.value
+
+    def unindex_coin(self, tx_id: str, index: int, coin: Coin):
+        """将一个已花费的输出从地址索引中移除"""
+        if not is_p2pkh_script_pubkey(script_pubkey=coin.script_pubkey):
+            return
+        pubk_hash = get_pubkhash_from_script_pubkey(script_pubkey=coin.script_pubkey)
+        outpoints = self.address_index.get(pubk_hash)
+        if outpoints == None:
+            return
+        outpoints.pop((tx_id, index), None)
+        if len(outpoints) == 0:
+            del self.address_index[pubk_hash]
+
+    def build_address_index(self):
+        """扫描整个UTXO集合重建地址索引"""
+        self.flush()
+        self.address_index = {}
+        for key in self.db.getall():
+            tx_id, index = parse_outpoint_key(key=key)
+            self.index_coin(tx_id=tx_id, index=index, coin=Coin.deserialize(bytes.fromhex(self.db.get(key))))
+
+    def find_utxo_by_address(self, address: str, value: float) -> tuple:
+        """找到指定地址的足够的utxo"""
+        pubk_hash = get_pubkhash_from_address(address=address)
+        utxos = []
+        utxo_value_sum = 0
+        for outpoint, out_value in self.address_index.get(pubk_hash, {}).items():
+            utxo_value_sum += out_value
+            utxos.append(outpoint)
+            if utxo_value_sum > value:
+                break
+        return (utxo_value_sum, utxos)
+
+    def remove_utxo_by_vin(self, vin: List[TransactionInput]):
+        """从UTXO集合中移除utxo"""
+        for tx_in in vin:
+            self.spend_coin(tx_id=tx_in.tx_id, index=tx_in.index)
+
+    def spend_coin(self, tx_id: str, index: int) -> Coin:
+        """花费一个输出，返回被花费的coin，不存在时返回None"""
+        coin = self.get_coin(tx_id=tx_id, index=index)
+        if coin == None:
+            return None
+        self.cache.spend(outpoint_key(tx_id=tx_id, index=index))
+        self.unindex_coin(tx_id=tx_id, index=index, coin=coin)
+        return coin
+
+    def find_utxo_by_vin(self, vin: List[TransactionInput]) -> List[Coin]:
+        """根据tx_in从UTXO集合中获取utxo，已花费或不存在的输出对应None"""
+        return [self.get_coin(tx_id=tx_in.tx_id, index=tx_in.index) for tx_in in vin]
+
+    def get_balance_by_address(self, address: str) -> float:
+        """根据比特币地址从UTXO中找到余额"""
+        pubk_hash = get_pubkhash_from_address(address=address)
+        return sum(self.address_index.get(pubk_hash, {}).values())
+
+    def flush(self):
+        """将缓存中的修改写回数据库"""
+        self.cache.flush()
+
+    def serialize(self) -> bytes:
+        return pickle.dumps(self)
+
+    @staticmethod
+    def deserialize(data: bytes) -> 'UTXOSet':
+        return pickle.loads(data)
+
+class CoinsView:
+    """UTXO集合之上的临时视图，记录区块中前面交易产生和花费的输出，用于验证块内相互依赖的交易"""
+    def __init__(self, utxo_set: UTXOSet):
+        self.utxo_set = utxo_set
+        self.outputs: Dict[tuple, TransactionOutput] = {}   #块内新产生的输出
+        self.spent = set()  #块内已被花费的输出点
+
+    def find_utxo_by_vin(self, vin: List[TransactionInput]) -> List[TransactionOutput]:
+        """根据tx_in获取未花费输出，已花费或不存在的输出对应None"""
+        outputs = []
+        for tx_in in vin:
+            outpoint = (tx_in.tx_id, tx_in.index)
+            if outpoint in self.spent:
+                outputs.append(None)
+            elif outpoint in self.outputs:
+                outputs.append(self.outputs[outpoint])
+            else:
+                outputs.append(self.utxo_set.get_coin(tx_id=tx_in.tx_id, index=tx_in.index))
+        return outputs
+
+    def add_transaction(self, tx):
+        """记录一笔交易花费的输出和产生的输出"""
+        if not tx.is_coinbase():
+            for tx_in in tx.inputs:
+                self.spent.add((tx_in.tx_id, tx_in.index))
+        tx_id = tx.hash()
+        for index, tx_out in enumerate(tx.outputs):
+            self.outputs[(tx_id, index)] = tx_out
+
+def load_utxo_set(dir: str, cache_size: int=DEFAULT_CACHE_SIZE) -> UTXOSet:
+    utxo_set = UTXOSet()
+    utxo_set.db = load_journaled_db(dir=dir)
+    utxo_set.cache = CoinsCache(db=utxo_set.db, journal=dir+'.log', max_size=cache_size)
+    utxo_set.build_address_index()
+    return utxo_set
@@ -0,0 +1,283 @@
+import os
+import struct
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from io import BytesIO
+from typing import Dict, List
+from block import Block, read_block
+from block_chain import BlockChain, verify_block_header
+from encoding import write_varint, read_varint, write_var_bytes, read_var_bytes, read_exact
+from utxo import UTXOSet, parse_outpoint_key, write_coin_record, read_coin_record
+
+SNAPSHOT_CHUNK_COINS = 1000     #每个快照分块包含的未花费输出数量
+SNAPSHOT_WINDOW = 8             #同时下载和等待验证的分块数量上限
+SNAPSHOT_MIN_AGREEMENT = 2      #至少有这么多节点给出相同的快照承诺才采用该快照
+MAX_SNAPSHOTS = 2               #节点为其他节点保留的快照数量
+SNAPSHOT_CHUNK_TIMEOUT = 5      #请求的分块超过这个时间(秒)未到达时，改向其他节点请求
+
+def initial_commitment(block_hash: str, height: int) -> bytes:
+    """滚动哈希的初始值，把快照绑定到区块哈希和高度"""
+    return sha256(bytes.fromhex(block_hash) + struct.pack('<I', height)).digest()
+
+def next_commitment(commitment: bytes, chunk: bytes) -> bytes:
+    """把一个分块追加到滚动哈希上"""
+    return sha256(commitment + sha256(chunk).digest()).digest()
+
+def encode_chunk(records: List[tuple]) -> bytes:
+    """分块编码：数量，之后每条为交易ID、输出序号、coin编码"""
+    parts = [write_varint(len(records))]
+    for tx_id, index, coin_data in records:
+        parts.append(write_coin_record(tx_id=tx_id, index=index, coin_data=coin_data))
+    return b''.join(parts)
+
+def decode_chunk(data: bytes) -> List[tuple]:
+    """解码一个分块，返回(交易ID, 输出序号, Coin)列表"""
+    stream = BytesIO(data)
+    return [read_coin_record(stream) for _ in range(0, read_varint(stream))]
+
+class SnapshotMeta:
+    """快照描述：快照所在的区块、高度、未花费输出数量以及每个分块之后的滚动哈希"""
+    def __init__(self, block: Block, height: int, coin_count: int, chunk_hashes: List[bytes]):
+        self.block = block
+        self.height = height
+        self.coin_count = coin_count
+        self.chunk_hashes = chunk_hashes
+
+    def block_hash(self) -> str:
+        return self.block.hash()
+
+    def commitment(self) -> bytes:
+        """快照承诺，即最后一个分块之后的滚动哈希"""
+        if len(self.chunk_hashes) == 0:
+            return initial_commitment(block_hash=self.block_hash(), height=self.height)
+        return self.chunk_hashes[-1]
+
+    def serialize(self) -> bytes:
+        parts = [write_var_bytes(self.block.serialize()), write_varint(self.height), write_varint(self.coin_count), write_varint(len(self.chunk_hashes))]
+        parts += self.chunk_hashes
+        return b''.join(parts)
+
+def deserialize_snapshot_meta(data: bytes) -> SnapshotMeta:
+    """快照描述反序列化"""
+    stream = BytesIO(data)
+    block = read_block(BytesIO(read_var_bytes(stream)))
+    height = read_varint(stream)
+    coin_count = read_varint(stream)
+    chunk_hashes = [read_exact(stream, 32) for _ in range(0, read_varint(stream))]
+    return SnapshotMeta(block=block, height=height, coin_count=coin_count, chunk_hashes=chunk_hashes)
+
+class UTXOSnapshot:
+    """节点为其他节点生成的UTXO快照，分块写入文件，此后UTXO集合的变化不影响快照内容"""
+    def __init__(self, meta: SnapshotMeta, path: str, offsets: List[int]):
+        self.meta = meta
+        self.path = path
+        self.offsets = offsets  #每个分块在文件中的起止位置，长度为分块数+1
+
+    def read_chunk(self, index: int) -> bytes:
+        """读取一个分块"""
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.offsets[index])
+            return fp.read(self.offsets[index + 1] - self.offsets[index])
+
+def create_utxo_snapshot(utxo_set: UTXOSet, block_chain: BlockChain, path: str) -> UTXOSnapshot:
+    """在当前最新区块处按输出点排序生成UTXO快照"""
+    utxo_set.flush()
+    block_hash = block_chain.get_best_block_hash()
+    height = block_chain.get_best_height()
+    keys = sorted(utxo_set.db.getall())
+    commitment = initial_commitment(block_hash=block_hash, height=height)
+    chunk_hashes = []
+    offsets = [0]
+    with open(path, 'wb') as fp:
+        for start in range(0, len(keys), SNAPSHOT_CHUNK_COINS):
+            records = []
+            for key in keys[start:start + SNAPSHOT_CHUNK_COINS]:
+                tx_id, index = parse_outpoint_key(key=key)
+                records.append((tx_id, index, bytes.fromhex(utxo_set.db.get(key))))
+            chunk = encode_chunk(records)
+            fp.write(chunk)
+            offsets.append(offsets[-1] + len(chunk))
+            commitment = next_commitment(commitment=commitment, chunk=chunk)
+            chunk_hashes.append(commitment)
+    meta = SnapshotMeta(block=block_chain.get_block(block_hash), height=height, coin_count=len(keys), chunk_hashes=chunk_hashes)
+    return UTXOSnapshot(meta=meta, path=path, offsets=offsets)
+
+class SnapshotSync:
+    """分块、可验证的UTXO快照同步，新节点用它代替从创世区块开始重放全部区块"""
+    def __init__(self, node_id: int, block_chain: BlockChain, utxo_set: UTXOSet, dir: str, send, enabled: bool=False):
+        self.node_id = node_id
+        self.block_chain = block_chain
+        self.utxo_set = utxo_set
+        self.dir = dir      #为其他节点生成的快照文件所在目录
+        self.send = send    #send(to_node_id, message_type, data)
+        self.enabled = enabled
+        self.snapshots: OrderedDict = OrderedDict()     #区块哈希 -> UTXOSnapshot
+        #下载方的状态
+        self.failed = False
+        self.asked = set()
+        self.offers: Dict[tuple, tuple] = {}    #(区块哈希, 承诺) -> (SnapshotMeta, 按回复顺序排列的给出该快照的节点ID)
+        self.meta: SnapshotMeta = None
+        self.peers: List[int] = []
+        self.commitment: bytes = None           #已验证分块的滚动哈希
+        self.next_request = 0
+        self.next_verify = 0
+        self.in_flight: Dict[int, tuple] = {}   #分块序号 -> (节点ID, 请求时间)
+        self.downloaded: Dict[int, bytes] = {}  #已下载、等待前面分块验证的分块
+
+    def wants_snapshot(self) -> bool:
+        """本地还没有区块链时使用快照同步"""
+        return self.enabled and not self.failed and self.block_chain.get_best_height() < 0
+
+    def request_snapshot(self, peer_id: int):
+        """向一个节点请求其最新的快照描述"""
+        if self.meta != None or peer_id in self.asked:
+            return
+        self.asked.add(peer_id)
+        self.send(peer_id, "getsnapshot", b'')
+
+    def handle_getsnapshot(self, peer_id: int):
+        """生成或复用当前最新区块处的快照，发送快照描述"""
+        block_hash = self.block_chain.get_best_block_hash()
+        if block_hash == None:
+            self.send(peer_id, "snapshot", b'')
+            return
+        if block_hash not in self.snapshots:
+            if not os.path.exists(self.dir):
+                os.makedirs(self.dir)
+            path = os.path.join(self.dir, f'{block_hash}.dat')
+            self.snapshots[block_hash] = create_utxo_snapshot(utxo_set=self.utxo_set, block_chain=self.block_chain, path=path)
+            while len(self.snapshots) > MAX_SNAPSHOTS:
+                old_hash, old = self.snapshots.popitem(last=False)
+                os.remove(old.path)
+        self.send(peer_id, "snapshot", self.snapshots[block_hash].meta.serialize())
+
+    def handle_getchunk(self, peer_id: int, data: bytes):
+        """发送一个快照分块：请求中为区块哈希和分块序号"""
+        block_hash = data[:32].hex()
+        index = struct.unpack('<I', data[32:36])[0]
+        snapshot = self.snapshots.get(block_hash)
+        if snapshot == None or index >= len(snapshot.meta.chunk_hashes):
+            return
+        self.send(peer_id, "snapshotchunk", data[:36] + snapshot.read_chunk(index))
+
+    def handle_snapshot(self, peer_id: int, data: bytes) -> bool:
+        """收到快照描述，足够多的节点给出相同的快照后开始下载；快照同步因此结束(没有分块或无法达成一致)时返回True"""
+        if self.meta != None or not self.wants_snapshot():
+            return False
+        #只接受被询问节点的第一次回复，同一节点不能重复计入
+        if peer_id not in self.asked:
+            return False
+        self.asked.discard(peer_id)
+        if len(data) > 0:
+            meta = deserialize_snapshot_meta(data)
+            #快照所在区块必须满足工作量证明和默克尔根
+            if verify_block_header(block=meta.block) and meta.block.get_height() == meta.height:
+                key = (meta.block_hash(), meta.commitment())
+                offer_meta, peers = self.offers.setdefault(key, (meta, OrderedDict()))
+                peers[peer_id] = None
+                if len(peers) >= SNAPSHOT_MIN_AGREEMENT:
+                    self.start(meta=offer_meta, peers=list(peers))
+                    return self.meta == None
+        if len(self.asked) == 0 and self.meta == None:
+            #所有被询问的节点都已回复，但没有足够多的节点给出相同的快照
+            self.fail()
+            return True
+        return False
+
+    def start(self, meta: SnapshotMeta, peers: List[int]):
+        """开始下载快照分块"""
+        self.meta = meta
+        self.peers = peers
+        self.commitment = initial_commitment(block_hash=meta.block_hash(), height=meta.height)
+        self.next_request = 0
+        self.next_verify = 0
+        print(f"节点 {self.node_id} 开始从节点 {peers} 下载高度 {meta.height} 的UTXO快照，共 {len(meta.chunk_hashes)} 个分块")
+        if len(meta.chunk_hashes) == 0:
+            self.complete()
+        else:
+            self.request_chunks()
+
+    def request_chunks(self):
+        """在下载窗口内轮流向各个节点请求分块"""
+        while self.next_request < len(self.meta.chunk_hashes) and len(self.in_flight) + len(self.downloaded) < SNAPSHOT_WINDOW:
+            self.send_getchunk(index=self.next_request)
+            self.next_request += 1
+
+    def send_getchunk(self, index: int):
+        """向给出该快照的一个节点请求分块，记录请求时间"""
+        peer_id = self.peers[index % len(self.peers)]
+        self.in_flight[index] = (peer_id, time.monotonic())
+        self.send(peer_id, "getsnapshotchunk", bytes.fromhex(self.meta.block_hash()) + struct.pack('<I', index))
+
+    def get_timeout(self) -> float:
+        """距离最早的分块请求超时的时间，没有请求中的分块时为None"""
+        if not self.in_flight:
+            return None
+        return max(0, min(requested_at for peer_id, requested_at in self.in_flight.values()) + SNAPSHOT_CHUNK_TIMEOUT - time.monotonic())
+
+    def check_timeouts(self) -> bool:
+        """超时未回复的节点不再参与下载，其分块改向其他给出该快照的节点请求；没有节点可用时放弃快照同步并返回True"""
+        now = time.monotonic()
+        expired = sorted(index for index, (peer_id, requested_at) in self.in_flight.items() if now - requested_at >= SNAPSHOT_CHUNK_TIMEOUT)
+        if len(expired) == 0:
+            return False
+        for index in expired:
+            peer_id = self.in_flight[index][0]
+            if peer_id in self.peers:
+                print(f"节点 {self.node_id} 请求的UTXO快照分块 {index} 超时，不再向节点 {peer_id} 请求")
+                self.peers.remove(peer_id)
+        if len(self.peers) == 0:
+            print(f"节点 {self.node_id} 没有可用的节点继续下载UTXO快照")
+            self.fail()
+            return True
+        for index in expired:
+            self.send_getchunk(index=index)
+        return False
+
+    def handle_chunk(self, peer_id: int, data: bytes) -> bool:
+        """收到一个分块，按顺序验证滚动哈希并写入UTXO集合；快照同步因此结束(完成或验证失败)时返回True"""
+        if self.meta == None or data[:32].hex() != self.meta.block_hash():
+            return False
+        index = struct.unpack('<I', data[32:36])[0]
+        if self.in_flight.pop(index, None) == None:
+            return False
+        self.downloaded[index] = data[36:]
+        while self.next_verify in self.downloaded:
+            chunk = self.downloaded.pop(self.next_verify)
+            commitment = next_commitment(commitment=self.commitment, chunk=chunk)
+            if commitment != self.meta.chunk_hashes[self.next_verify]:
+                print(f"节点 {self.node_id} 收到的UTXO快照分块 {self.next_verify} 验证失败")
+                self.fail()
+                return True
+            for tx_id, index, coin in decode_chunk(chunk):
+                self.utxo_set.add_coin(tx_id=tx_id, index=index, coin=coin)
+            #每个分块验证后立即写回，下载过程中内存占用有上限
+            self.utxo_set.flush()
+            self.commitment = commitment
+            self.next_verify += 1
+        if self.next_verify == len(self.meta.chunk_hashes):
+            self.complete()
+            return True
+        self.request_chunks()
+        return False
+
+    def complete(self):
+        """所有分块验证通过，把快照所在区块作为本地区块链的起点"""
+        self.block_chain.write_block(block=self.meta.block)
+        self.block_chain.update()
+        print(f"节点 {self.node_id} 完成UTXO快照同步，区块高度 {self.meta.height}")
+        self.meta = None
+        self.in_flight = {}
+        self.downloaded = {}
+
+    def fail(self):
+        """放弃快照同步，清除已写入的未花费输出，改为从创世区块同步"""
+        for key in list(self.utxo_set.db.getall()):
+            tx_id, index = parse_outpoint_key(key=key)
+            self.utxo_set.spend_coin(tx_id=tx_id, index=index)
+        self.utxo_set.flush()
+        self.failed = True
+        self.meta = None
+        self.in_flight = {}
+        self.downloaded = {}
@@ -0,0 +1,83 @@
+import shutil
+import tempfile
+import unittest
+from block import create_block, Block
+from block_chain import create_block_chain
+from block_template import BlockTemplate
+from memory_pool import MemmoryPool
+from transaction import Transaction, create_transaction
+from transaction_input import TransactionInput
+from transaction_output import TransactionOutput
+from utxo import load_utxo_set
+from wallet import load_wallet
+
+class DisconnectBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.utxo_set = load_utxo_set(dir=self.dir+'/utxo.db')
+        self.wallet = load_wallet(dir=self.dir+'/wallet1.conf')
+        self.receiver = load_wallet(dir=self.dir+'/wallet2.conf')
+        self.block_chain = create_block_chain(to=self.wallet.get_address(), utxo_set=self.utxo_set, dir=self.dir+'/block.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def coins(self) -> list:
+        self.utxo_set.flush()
+        return sorted((key, self.utxo_set.db.get(key)) for key in self.utxo_set.db.getall())
+
+    def mine(self, value: float):
+        mem_pool = MemmoryPool(utxo_set=self.utxo_set)
+        mem_pool.add_tx(create_transaction(send=self.wallet, to=[self.receiver.get_address()], value=[value], utxo_set=self.utxo_set, tx_fee=0.01))
+        block = create_block(block_height=self.block_chain.get_best_height() + 1, pre_block_hash=self.block_chain.get_best_block_hash(), mem_pool=mem_pool, utxo_set=self.utxo_set, address=self.wallet.get_address())
+        self.assertTrue(self.block_chain.add_block(block=block, utxo_set=self.utxo_set))
+        return block
+
+    def test_disconnect_restores_utxo_set(self):
+        genesis_hash = self.block_chain.get_best_block_hash()
+        before = self.coins()
+        block = self.mine(value=1.0)
+        self.assertNotEqual(self.coins(), before)
+        self.assertEqual(self.block_chain.disconnect_block(utxo_set=self.utxo_set).hash(), block.hash())
+        self.assertEqual(self.coins(), before)
+        self.assertEqual((self.block_chain.get_best_height(), self.block_chain.get_best_block_hash()), (0, genesis_hash))
+        self.assertFalse(self.block_chain.is_main_chain(block.hash()))
+        self.assertEqual(self.receiver.get_balance(self.utxo_set), 0)
+        #已存储的区块可以重新连接
+        self.assertTrue(self.block_chain.add_block(block=block, utxo_set=self.utxo_set))
+        self.assertTrue(self.block_chain.is_main_chain(block.hash()))
+        self.assertEqual(self.receiver.get_balance(self.utxo_set), 1.0)
+
+    def test_duplicated_coinbase_is_rejected(self):
+        block = create_block(block_height=1, pre_block_hash=self.block_chain.get_best_block_hash(), mem_pool=MemmoryPool(utxo_set=self.utxo_set), utxo_set=self.utxo_set, address=self.wallet.get_address())
+        #只有一个叶子时与自身配对，重复coinbase交易不改变默克尔根
+        forged = Block(block_header=block.block_header, tx_num=2, transactions=block.transactions * 2)
+        self.assertEqual(forged.hash(), block.hash())
+        self.assertFalse(self.block_chain.add_block(block=forged, utxo_set=self.utxo_set))
+        self.assertEqual(self.block_chain.get_best_height(), 0)
+        self.assertTrue(self.block_chain.add_block(block=block, utxo_set=self.utxo_set))
+
+    def test_disconnect_evicts_mempool_spends_of_removed_outputs(self):
+        self.mine(value=1.0)
+        mem_pool = MemmoryPool(utxo_set=self.utxo_set)
+        template = BlockTemplate(mem_pool=mem_pool)
+        #花费区块中交易输出的交易，以及它在交易池中的子交易
+        parent = create_transaction(send=self.receiver, to=[self.wallet.get_address()], value=[0.5], utxo_set=self.utxo_set, tx_fee=0.01)
+        child = Transaction(version=1, vin_sz=1, vout_sz=1, lock_time=0, inputs=[TransactionInput(tx_id=parent.hash(), index=0, script_sig=self.wallet.pubkey.to_string().hex())], outputs=[TransactionOutput(value=0.4, script_pubkey=parent.outputs[0].script_pubkey)])
+        child.sign(self.wallet.sigkey.to_string().hex())
+        self.assertTrue(mem_pool.add_tx(parent))
+        self.assertTrue(mem_pool.add_tx(child))
+        self.assertEqual(len(template.get_transactions()[0]), 2)
+        self.block_chain.disconnect_block(utxo_set=self.utxo_set)
+        evicted = mem_pool.remove_for_disconnect()
+        self.assertEqual({tx.hash() for tx in evicted}, {parent.hash(), child.hash()})
+        self.assertEqual(len(mem_pool), 0)
+        self.assertEqual(template.valid, set())
+        self.assertEqual(template.get_transactions(), ([], 0))
+
+    def test_genesis_cannot_be_disconnected(self):
+        self.assertEqual(self.block_chain.disconnect_block(utxo_set=self.utxo_set), None)
+        self.assertEqual(self.block_chain.get_best_height(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
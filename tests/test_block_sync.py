@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import block_sync
+from block import create_block
+from block_chain import create_block_chain
+from block_header import BlockHeader
+from block_sync import BlockSync, decode_hashes
+from memory_pool import MemmoryPool
+from proof_of_work import pow, TARGET_BITS
+from utxo import load_utxo_set
+from wallet import load_wallet
+
+def mine_headers(pre_hash: str, count: int, target_bits: int=TARGET_BITS) -> list:
+    headers = []
+    for i in range(0, count):
+        header = BlockHeader(version=1, pre_block_hash=pre_hash, merkle_root_hash='11'*32, timestamp=float(i), target_bits=target_bits, nonce=0)
+        pow(header, workers=1)
+        headers.append(header)
+        pre_hash = header.hash()
+    return headers
+
+class BlockRequestTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.sync = BlockSync(node_id=0, block_chain=None, send=lambda to_node_id, message_type, data: self.sent.append((to_node_id, message_type, data)))
+        self.sync.peer_heights = {1: 3, 2: 3}
+        self.hashes = [f'{height:064x}' for height in range(1, 4)]
+        for height, block_hash in enumerate(self.hashes, start=1):
+            self.sync.heights[block_hash] = height
+            self.sync.queued.append(block_hash)
+            self.sync.wanted.append(block_hash)
+            self.sync.wanted_hashes.add(block_hash)
+
+    def test_expired_request_goes_to_another_peer(self):
+        self.sync.request_blocks()
+        first_peer, message_type, data = self.sent[-1]
+        self.assertEqual((message_type, decode_hashes(data)), ("getdata", self.hashes))
+        self.assertIsNotNone(self.sync.get_timeout())
+        self.sync.check_timeouts()
+        self.assertEqual(len(self.sent), 1)
+        with mock.patch.object(block_sync, 'BLOCK_REQUEST_TIMEOUT', 0):
+            self.sync.check_timeouts()
+        peer_id, message_type, data = self.sent[-1]
+        self.assertNotEqual(peer_id, first_peer)
+        self.assertEqual((message_type, decode_hashes(data)), ("getdata", self.hashes))
+        self.assertEqual({request[0] for request in self.sync.in_flight.values()}, {peer_id})
+
+class ForkHeadersTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        utxo_set = load_utxo_set(dir=self.dir+'/utxo.db')
+        wallet = load_wallet(dir=self.dir+'/wallet.conf')
+        self.block_chain = create_block_chain(to=wallet.get_address(), utxo_set=utxo_set, dir=self.dir+'/block.db')
+        self.genesis_hash = self.block_chain.get_best_block_hash()
+        block = create_block(block_height=1, pre_block_hash=self.genesis_hash, mem_pool=MemmoryPool(utxo_set=utxo_set), utxo_set=utxo_set, address=wallet.get_address())
+        self.assertTrue(self.block_chain.add_block(block=block, utxo_set=utxo_set))
+        self.sent = []
+        self.sync = BlockSync(node_id=0, block_chain=self.block_chain, send=lambda to_node_id, message_type, data: self.sent.append((to_node_id, message_type, data)))
+        self.sync.peer_heights = {1: 2}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def receive(self, headers: list):
+        self.sync.request_headers(peer_id=1)
+        self.sync.handle_headers(peer_id=1, data=b''.join(header.serialize() for header in headers))
+
+    def test_fork_without_more_work_is_not_downloaded(self):
+        self.receive(mine_headers(pre_hash=self.genesis_hash, count=1))
+        self.assertFalse(self.sync.is_syncing())
+        self.assertEqual(len(self.sync.queued) + len(self.sync.in_flight), 0)
+
+    def test_fork_headers_are_collected_until_they_have_more_work(self):
+        headers = mine_headers(pre_hash=self.genesis_hash, count=2)
+        with mock.patch.object(block_sync, 'MAX_HEADERS', 1):
+            self.receive(headers[:1])
+            #只有一个区块头时工作量与本地相同，继续请求而不下载
+            self.assertEqual(self.sent[-1][1], "getheaders")
+            self.assertEqual(len(self.sync.in_flight), 0)
+            self.sync.handle_headers(peer_id=1, data=headers[1].serialize())
+        self.assertEqual(list(self.sync.wanted), [header.hash() for header in headers])
+        self.assertEqual(self.sync.heights[headers[1].hash()], 2)
+
+    def test_headers_below_target_bits_are_rejected(self):
+        with mock.patch.object(block_sync, 'MAX_HEADERS', 3):
+            self.receive(mine_headers(pre_hash=self.genesis_hash, count=3, target_bits=TARGET_BITS - 6))
+        self.assertFalse(self.sync.is_syncing())
+        self.assertEqual(len(self.sync.wanted), 0)
+
+if __name__ == '__main__':
+    unittest.main()
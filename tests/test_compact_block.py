@@ -0,0 +1,68 @@
+import queue
+import shutil
+import tempfile
+import unittest
+from block import create_block
+from compact_block import PartialBlock, create_compact_block, deserialize_compact_block, decode_block_txn_request, encode_block_txn
+from memory_pool import MemmoryPool
+from node import Network, Node
+from signature_verifier import SignatureVerifier
+from transaction import create_transaction
+from wallet import load_wallet
+
+class CompactBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.network = Network()
+        self.node = Node(node_id=0, network=self.network, dir=self.dir+'/node', verifier=SignatureVerifier(workers=1))
+        self.network.register_node(self.node)
+        #节点1只有收件箱，用来检查节点0发出的请求
+        self.network.messages[1] = queue.Queue()
+        receiver = load_wallet(dir=self.dir+'/receiver.conf')
+        #区块中的交易不在节点0的交易池中，重建时需要向发送者请求
+        mem_pool = MemmoryPool(utxo_set=self.node.utxo_set)
+        mem_pool.add_tx(create_transaction(send=self.node.wallet, to=[receiver.get_address()], value=[1.0], utxo_set=self.node.utxo_set, tx_fee=0.01))
+        self.block = create_block(block_height=1, pre_block_hash=self.node.block_chain.get_best_block_hash(), mem_pool=mem_pool, utxo_set=self.node.utxo_set, address=receiver.get_address())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def sent(self) -> list:
+        messages = []
+        while not self.network.messages[1].empty():
+            sender_id, message_type, data = self.network.messages[1].get()
+            messages.append((message_type, data))
+        return messages
+
+    def test_reconstruct_from_candidates(self):
+        compact = deserialize_compact_block(create_compact_block(self.block).serialize())
+        self.assertEqual(compact.hash(), self.block.hash())
+        partial = PartialBlock(compact=compact)
+        self.assertEqual(partial.init_data(candidates={}), [1])
+        partial = PartialBlock(compact=compact)
+        self.assertEqual(partial.init_data(candidates={self.block.get_tx_ids()[1]: self.block.transactions[1]}), [])
+        self.assertEqual(partial.get_block().hash(), self.block.hash())
+
+    def receive_compact_block(self) -> list:
+        self.node.handle_message(1, "cmpctblock", create_compact_block(self.block).serialize())
+        message_type, data = self.sent()[0]
+        self.assertEqual(message_type, "getblocktxn")
+        block_hash, indexes = decode_block_txn_request(data)
+        self.assertEqual(block_hash, self.block.hash())
+        return indexes
+
+    def test_missing_transactions_requested(self):
+        indexes = self.receive_compact_block()
+        self.node.handle_message(1, "blocktxn", encode_block_txn(block_hash=self.block.hash(), transactions=[self.block.transactions[index] for index in indexes]))
+        self.assertEqual(self.node.block_chain.get_best_block_hash(), self.block.hash())
+
+    def test_undecodable_blocktxn_falls_back_to_full_block(self):
+        for data in (bytes.fromhex(self.block.hash()) + b'\x01\x05', encode_block_txn(block_hash=self.block.hash(), transactions=['ff' * 10])):
+            self.receive_compact_block()
+            self.node.handle_message(1, "blocktxn", data)
+            self.assertEqual(self.sent(), [("getdata", bytes.fromhex(self.block.hash()))])
+            self.assertEqual(self.node.compact_blocks, {})
+            self.assertNotEqual(self.node.block_chain.get_best_block_hash(), self.block.hash())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import tempfile
+import unittest
+from block_header import BlockHeader
+from merkle_tree import MerkleTree, MerkleProof, create_merkle_proof, verify_merkle_proof
+from transaction import create_coinbase_transaction, decode_transaction
+from wallet import load_wallet
+
+class MerkleProofTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as dir:
+            address = load_wallet(dir=dir+'/wallet.conf').get_address()
+        cls.transactions = [create_coinbase_transaction(block_height=i, coinbase_str=str(i), to=address).serialize().hex() for i in range(0, 8)]
+
+    def create_header(self, transactions: list) -> BlockHeader:
+        return BlockHeader(version=1, pre_block_hash='00' * 32, merkle_root_hash=MerkleTree(transactions=transactions).root_hash, timestamp=0, target_bits=1, nonce=0)
+
+    def test_every_index_verifies(self):
+        for tx_count in range(1, 9):
+            transactions = self.transactions[:tx_count]
+            header = self.create_header(transactions)
+            for index in range(0, tx_count):
+                proof = create_merkle_proof(transactions=transactions, index=index, block_hash=header.hash())
+                self.assertTrue(verify_merkle_proof(proof=proof, header=header), (tx_count, index))
+
+    def test_padded_index_rejected(self):
+        #奇数个交易时，末尾补齐的重复叶子与最后一笔交易算出相同的根
+        for tx_count in (1, 3, 5, 7):
+            transactions = self.transactions[:tx_count]
+            header = self.create_header(transactions)
+            tx_id = decode_transaction(transactions[-1]).hash()
+            branch = MerkleTree(transactions=transactions).get_branch(index=tx_count)
+            for claimed_count in (tx_count, tx_count + 1):
+                proof = MerkleProof(tx_id=tx_id, block_hash=header.hash(), index=tx_count, tx_count=claimed_count, branch=branch)
+                self.assertFalse(verify_merkle_proof(proof=proof, header=header), (tx_count, claimed_count))
+
+    def test_out_of_range_index_rejected(self):
+        transactions = self.transactions[:4]
+        header = self.create_header(transactions)
+        proof = create_merkle_proof(transactions=transactions, index=0, block_hash=header.hash())
+        for index in (-1, 4, 8):
+            proof.index = index
+            self.assertFalse(verify_merkle_proof(proof=proof, header=header))
+        proof.index = 0
+        proof.branch = proof.branch + proof.branch[-1:]
+        self.assertFalse(verify_merkle_proof(proof=proof, header=header))
+
+if __name__ == '__main__':
+    unittest.main()
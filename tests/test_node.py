@@ -0,0 +1,35 @@
+import shutil
+import tempfile
+import unittest
+from node import Network, Node, VersionMessage
+from signature_verifier import SignatureVerifier
+
+class VersionMessageTest(unittest.TestCase):
+    def test_roundtrip(self):
+        for node_id, best_height in ((0, -1), (3, 0), (443, 70000)):
+            message = VersionMessage.deserialize(VersionMessage(node_id=node_id, best_height=best_height).serialize())
+            self.assertEqual((message.node_id, message.best_height), (node_id, best_height))
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            VersionMessage.deserialize(b'\x01')
+
+class MalformedMessageTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.network = Network()
+        self.node = Node(node_id=0, network=self.network, dir=self.dir+'/node', verifier=SignatureVerifier(workers=1))
+        self.network.register_node(self.node)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_malformed_messages_dropped(self):
+        best_hash = self.node.block_chain.get_best_block_hash()
+        for message_type in ("block", "cmpctblock", "getblocktxn", "blocktxn", "headers", "snapshot", "getsnapshotchunk", "snapshotchunk", "transaction", "version"):
+            for data in (b'', b'\x01', b'\xff' * 7):
+                self.node.handle_message(1, message_type, data)
+        self.assertEqual(self.node.block_chain.get_best_block_hash(), best_hash)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import proof_of_work
+from block_header import BlockHeader
+from proof_of_work import pow, parallel_pow, verify_pow, verify_header_pow, TARGET_BITS
+
+def create_header(target_bits: int) -> BlockHeader:
+    return BlockHeader(version=1, pre_block_hash='0'*64, merkle_root_hash='11'*32, timestamp=1737856192.0, target_bits=target_bits, nonce=0)
+
+class ProofOfWorkTest(unittest.TestCase):
+    def test_serial_pow(self):
+        header = create_header(target_bits=8)
+        hash_result, nonce = pow(header, workers=1)
+        self.assertEqual(header.nonce, nonce)
+        self.assertEqual(header.hash(), hash_result)
+        self.assertTrue(verify_pow(header))
+
+    def test_parallel_pow_low_difficulty(self):
+        header = create_header(target_bits=8)
+        hash_result, nonce = parallel_pow(prefix=header.serialize_prefix(), target_bits=8, workers=2)
+        header.nonce = nonce
+        self.assertEqual(header.hash(), hash_result)
+        self.assertTrue(verify_pow(header))
+
+    def test_pow_uses_parallel_path(self):
+        #降低并行挖矿的难度门槛，使pow走多进程路径
+        min_bits = proof_of_work.PARALLEL_MIN_BITS
+        proof_of_work.PARALLEL_MIN_BITS = 0
+        try:
+            header = create_header(target_bits=6)
+            hash_result, nonce = pow(header, workers=2)
+        finally:
+            proof_of_work.PARALLEL_MIN_BITS = min_bits
+        self.assertEqual(header.hash(), hash_result)
+        self.assertTrue(verify_pow(header))
+
+    def test_header_below_target_bits_is_rejected(self):
+        header = create_header(target_bits=TARGET_BITS - 4)
+        pow(header, workers=1)
+        self.assertTrue(verify_pow(header))
+        self.assertFalse(verify_header_pow(header))
+        header = create_header(target_bits=TARGET_BITS)
+        pow(header, workers=1)
+        self.assertTrue(verify_header_pow(header))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import unittest
+from hashlib import sha256
+from ecdsa import SigningKey, SECP256k1
+from signature_verifier import SignatureVerifier, get_shared_verifier, MIN_PARALLEL_CHECKS
+
+def create_checks(count: int) -> list:
+    """生成count个有效的(tx_hash, pubkey, sig)签名"""
+    sk = SigningKey.generate(curve=SECP256k1)
+    pubkey = sk.get_verifying_key().to_string().hex()
+    checks = []
+    for i in range(0, count):
+        tx_hash = sha256(os.urandom(32)).hexdigest()
+        checks.append((tx_hash, pubkey, sk.sign(bytes.fromhex(tx_hash)).hex()))
+    return checks
+
+class SignatureVerifierTest(unittest.TestCase):
+    def test_shared_verifier(self):
+        self.assertIs(get_shared_verifier(workers=2), get_shared_verifier(workers=2))
+        self.assertIsNot(get_shared_verifier(workers=2), get_shared_verifier(workers=3))
+
+    def test_parallel_verify(self):
+        verifier = SignatureVerifier(workers=2)
+        try:
+            checks = create_checks(count=MIN_PARALLEL_CHECKS)
+            self.assertTrue(verifier.verify_uncached(checks))
+            tx_hash, pubkey, sig = checks[-1]
+            checks[-1] = (sha256(bytes.fromhex(tx_hash)).hexdigest(), pubkey, sig)
+            self.assertFalse(verifier.verify_uncached(checks))
+            self.assertTrue(verifier.submit(create_checks(count=2)).result(timeout=30))
+        finally:
+            verifier.shutdown()
+
+    def test_broken_pool_is_replaced(self):
+        verifier = SignatureVerifier(workers=2)
+        try:
+            checks = create_checks(count=MIN_PARALLEL_CHECKS)
+            self.assertTrue(verifier.verify_uncached(checks))
+            broken = verifier.executor
+            for process in list(broken._processes.values()):
+                process.kill()
+                process.join()
+            self.assertTrue(verifier.verify_uncached(checks))
+            self.assertIsNot(verifier.get_executor(), broken)
+            self.assertTrue(verifier.submit(create_checks(count=2)).result(timeout=30))
+        finally:
+            verifier.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+from block_chain import create_block_chain
+from transaction import Transaction, create_transaction, verify_transaction, deserialize_transaction, decode_transaction
+from transaction_input import TransactionInput
+from transaction_output import TransactionOutput
+from memory_pool import MemmoryPool
+from utxo import load_utxo_set
+from wallet import load_wallet
+
+class TransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.utxo_set = load_utxo_set(dir=self.dir+'/utxo.db')
+        self.wallet = load_wallet(dir=self.dir+'/wallet1.conf')
+        self.receiver = load_wallet(dir=self.dir+'/wallet2.conf')
+        self.block_chain = create_block_chain(to=self.wallet.get_address(), utxo_set=self.utxo_set, dir=self.dir+'/block.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def create_tx(self, value: float=1.0):
+        return create_transaction(send=self.wallet, to=[self.receiver.get_address()], value=[value], utxo_set=self.utxo_set, tx_fee=0.01)
+
+    def test_valid_transaction(self):
+        tx = self.create_tx()
+        self.assertTrue(verify_transaction(tx=tx, utxo_set=self.utxo_set))
+
+    def test_inputs_and_outputs_are_immutable(self):
+        tx = self.create_tx()
+        tx_id = tx.hash()
+        with self.assertRaises(AttributeError):
+            tx.inputs[0].script_sig = 'sig pubkey'
+        with self.assertRaises(AttributeError):
+            tx.outputs[0].value = 1000.0
+        with self.assertRaises(AttributeError):
+            tx.outputs.append(TransactionOutput(value=1000.0, script_pubkey=tx.outputs[0].script_pubkey))
+        self.assertEqual(tx.hash(), tx_id)
+
+    def test_reassigning_outputs_resets_hash(self):
+        tx = self.create_tx()
+        tx_id = tx.hash()
+        tx.outputs = tx.outputs[:1]
+        self.assertNotEqual(tx.hash(), tx_id)
+
+    def test_reject_trailing_bytes(self):
+        data = self.create_tx().serialize()
+        with self.assertRaises(ValueError):
+            deserialize_transaction(data + b'\x00')
+
+    def test_reject_non_minimal_varint(self):
+        data = self.create_tx().serialize()
+        #编码版本号之后是交易版本号，把1改写为3字节的变长整数
+        with self.assertRaises(ValueError):
+            deserialize_transaction(data[:1] + b'\xfd\x01\x00' + data[2:])
+
+    def test_txid_from_canonical_encoding(self):
+        data = self.create_tx(value=3.0).serialize()
+        tx = decode_transaction(data.hex())
+        self.assertEqual(tx.hash(), sha256(sha256(tx.serialize()).digest()).hexdigest())
+
+    def test_reject_duplicate_inputs(self):
+        #同一个输出点花费两次，输入金额被重复计算时可以凭空产生比特币
+        value, utxos = self.utxo_set.find_utxo_by_address(address=self.wallet.get_address(), value=1.0)
+        tx_id, index = utxos[0]
+        pubkey = self.wallet.pubkey.to_string().hex()
+        script_pubkey = self.create_tx().outputs[0].script_pubkey
+        inputs = [TransactionInput(tx_id=tx_id, index=index, script_sig=pubkey) for _ in range(0, 2)]
+        outputs = [TransactionOutput(value=value * 2, script_pubkey=script_pubkey)]
+        tx = Transaction(version=1, vin_sz=2, vout_sz=1, lock_time=0, inputs=inputs, outputs=outputs)
+        tx.sign(private_key=self.wallet.sigkey.to_string().hex())
+        self.assertFalse(verify_transaction(tx=tx, utxo_set=self.utxo_set))
+        self.assertFalse(MemmoryPool(utxo_set=self.utxo_set).add_tx(tx))
+
+if __name__ == '__main__':
+    unittest.main()
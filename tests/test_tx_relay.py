@@ -0,0 +1,41 @@
+import unittest
+from unittest import mock
+import tx_relay
+from block_sync import encode_hashes, decode_hashes
+from tx_relay import TxRelay
+
+class TxRelayTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.known = set()
+        self.relay = TxRelay(node_id=0, send=lambda to_node_id, message_type, data: self.sent.append((to_node_id, message_type, decode_hashes(data))), get_peers=lambda: [1, 2, 3], has_tx=lambda tx_id: tx_id in self.known)
+        self.tx_id = 'ab' * 32
+
+    def test_timed_out_request_goes_to_next_announcer(self):
+        for peer_id in (1, 2, 1, 3):
+            self.relay.handle_inv(peer_id=peer_id, data=encode_hashes([self.tx_id]))
+        self.assertEqual(self.sent, [(1, "gettxdata", [self.tx_id])])
+        with mock.patch.object(tx_relay, 'TX_REQUEST_TIMEOUT', 0):
+            self.relay.maybe_flush()
+            self.assertEqual(self.sent[-1], (2, "gettxdata", [self.tx_id]))
+            self.relay.maybe_flush()
+            self.assertEqual(self.sent[-1], (3, "gettxdata", [self.tx_id]))
+            self.relay.maybe_flush()
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(len(self.relay.requested), 0)
+
+    def test_received_tx_is_not_seen_until_admission_finishes(self):
+        self.relay.handle_inv(peer_id=1, data=encode_hashes([self.tx_id]))
+        self.assertTrue(self.relay.receive_tx(tx_id=self.tx_id))
+        self.assertFalse(self.relay.seen.contains(self.tx_id))
+        #正在验证的交易不再请求
+        self.known.add(self.tx_id)
+        self.relay.handle_inv(peer_id=2, data=encode_hashes([self.tx_id]))
+        self.assertEqual(len(self.sent), 1)
+        #验证失败后交易不在任何地方，可以再次请求
+        self.known.discard(self.tx_id)
+        self.relay.handle_inv(peer_id=2, data=encode_hashes([self.tx_id]))
+        self.assertEqual(self.sent[-1], (2, "gettxdata", [self.tx_id]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import shutil
+import tempfile
+import time
+import unittest
+from bitcoin_script import get_script_pubkey
+from utils import get_pubkhash_from_address
+from utxo import load_utxo_set, Coin, CoinsCache, CACHE_ENTRY_OVERHEAD
+from wallet import load_wallet
+
+class CoinsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.script_pubkey = get_script_pubkey(pubk_hash=get_pubkhash_from_address(load_wallet(dir=self.dir+'/wallet.conf').get_address()))
+        #上限只能容纳两个条目
+        entry_size = CoinsCache.entry_size('%064x:0' % 0, Coin(value=1.0, script_pubkey=self.script_pubkey, height=0))
+        self.utxo_set = load_utxo_set(dir=self.dir+'/utxo.db', cache_size=2 * entry_size)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def add_coins(self, count: int):
+        for i in range(0, count):
+            self.utxo_set.add_coin(tx_id='%064x' % i, index=0, coin=Coin(value=1.0, script_pubkey=self.script_pubkey, height=i))
+
+    def test_dirty_entries_kept_until_flush(self):
+        self.add_coins(count=5)
+        cache = self.utxo_set.cache
+        self.assertEqual(len(cache.dirty), 5)
+        self.assertGreater(cache.size, cache.max_size)
+        self.utxo_set.flush()
+        self.assertEqual(len(cache.dirty), 0)
+        self.assertLessEqual(cache.size, cache.max_size)
+        for i in range(0, 5):
+            self.assertEqual(self.utxo_set.get_coin(tx_id='%064x' % i, index=0).height, i)
+        self.utxo_set.spend_coin(tx_id='%064x' % 0, index=0)
+        self.assertEqual(self.utxo_set.get_coin(tx_id='%064x' % 0, index=0), None)
+        self.utxo_set.flush()
+        self.assertEqual(self.utxo_set.get_coin(tx_id='%064x' % 0, index=0), None)
+        self.assertLessEqual(cache.size, cache.max_size)
+
+    def test_eviction_with_many_dirty_entries(self):
+        #大部分条目为脏条目时，每次写入的淘汰不应遍历整个缓存
+        start = time.monotonic()
+        self.add_coins(count=20000)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(len(self.utxo_set.cache.dirty), 20000)
+
+if __name__ == '__main__':
+    unittest.main()
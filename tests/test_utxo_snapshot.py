@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+import unittest
+from block_chain import create_block_chain, open_block_chain
+from utxo import load_utxo_set
+from utxo_snapshot import SnapshotSync, SNAPSHOT_CHUNK_TIMEOUT
+from wallet import load_wallet
+
+class SnapshotOfferTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        utxo_set = load_utxo_set(dir=self.dir+'/server/utxo.db')
+        wallet = load_wallet(dir=self.dir+'/wallet.conf')
+        block_chain = create_block_chain(to=wallet.get_address(), utxo_set=utxo_set, dir=self.dir+'/server/block.db')
+        replies = []
+        server = SnapshotSync(node_id=1, block_chain=block_chain, utxo_set=utxo_set, dir=self.dir+'/server/snapshots', send=lambda to_node_id, message_type, data: replies.append(data))
+        server.handle_getsnapshot(peer_id=0)
+        self.offer = replies[0]
+        self.sent = []
+        self.client = SnapshotSync(node_id=0, block_chain=open_block_chain(dir=self.dir+'/client/block.db'), utxo_set=load_utxo_set(dir=self.dir+'/client/utxo.db'), dir=self.dir+'/client/snapshots', send=lambda to_node_id, message_type, data: self.sent.append((to_node_id, message_type)), enabled=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_duplicate_and_unasked_replies_are_ignored(self):
+        for peer_id in (1, 2, 3):
+            self.client.request_snapshot(peer_id=peer_id)
+        self.client.handle_snapshot(peer_id=1, data=self.offer)
+        self.client.handle_snapshot(peer_id=1, data=self.offer)
+        self.client.handle_snapshot(peer_id=4, data=self.offer)
+        self.assertEqual(self.client.meta, None)
+        self.client.handle_snapshot(peer_id=2, data=self.offer)
+        self.assertEqual(self.client.peers, [1, 2])
+
+    def expire_requests(self):
+        for index, (peer_id, requested_at) in self.client.in_flight.items():
+            self.client.in_flight[index] = (peer_id, requested_at - SNAPSHOT_CHUNK_TIMEOUT)
+
+    def test_chunk_timeout_moves_to_other_peer(self):
+        for peer_id in (1, 2):
+            self.client.request_snapshot(peer_id=peer_id)
+        for peer_id in (1, 2):
+            self.client.handle_snapshot(peer_id=peer_id, data=self.offer)
+        self.assertEqual(self.sent[-1], (1, "getsnapshotchunk"))
+        self.assertFalse(self.client.check_timeouts())
+        self.expire_requests()
+        self.assertEqual(self.client.get_timeout(), 0)
+        self.assertFalse(self.client.check_timeouts())
+        self.assertEqual(self.client.peers, [2])
+        self.assertEqual(self.sent[-1], (2, "getsnapshotchunk"))
+        self.expire_requests()
+        self.assertTrue(self.client.check_timeouts())
+        self.assertTrue(self.client.failed)
+        self.assertEqual(self.client.get_timeout(), None)
+
+if __name__ == '__main__':
+    unittest.main()